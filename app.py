@@ -1,10 +1,18 @@
 import streamlit as st
 import time
 import os
+import shutil
+import tempfile
 
 # Наши модули
 import auth
 import logic
+from utils import metrics
+from utils.background import JobStore
+
+# У Streamlit нет своего /metrics — при VYUD_METRICS этапы пишутся JSON-строками в лог
+if metrics.ENABLED:
+    metrics.log_to_stderr()
 
 # --- НАСТРОЙКИ СТРАНИЦЫ ---
 st.set_page_config(
@@ -38,6 +46,15 @@ if "generated_quiz" not in st.session_state:
     st.session_state.generated_quiz = None
 if "quiz_text_source" not in st.session_state:
     st.session_state.quiz_text_source = None
+if "quiz_failed_files" not in st.session_state:
+    st.session_state.quiz_failed_files = []
+if "quiz_export" not in st.session_state:
+    st.session_state.quiz_export = None
+if "job_id" not in st.session_state:
+    # После перезагрузки страницы задачу находим по ?job=... в адресе
+    st.session_state.job_id = st.query_params.get("job")
+if "loaded_job" not in st.session_state:
+    st.session_state.loaded_job = None
 
 # Достаем ключи API
 try:
@@ -47,6 +64,57 @@ except:
     st.error("❌ Не найдены API ключи в secrets.toml!")
     st.stop()
 
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+
+@st.cache_resource
+def get_job_store():
+    """Один пул задач на весь сервер: генерация не держит поток скрипта и переживает rerun"""
+    return JobStore()
+
+def save_upload(uploaded_file):
+    """Копия загрузки на диск: UploadedFile живет только в своей сессии"""
+    uploaded_file.seek(0)
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(uploaded_file.name)[1].lower())
+    with os.fdopen(fd, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f)
+    return path
+
+def run_generation(paths, names, q_count, difficulty, lang, force_fresh, report):
+    """Фоновая задача: извлечение текста из всех файлов и генерация одного теста. Временные файлы удаляются в конце"""
+    try:
+        report(f"📂 Читаем файлы и распознаем речь ({len(paths)})..." if len(paths) > 1 else "📂 Читаем файл и распознаем речь...")
+        text_content, failed = logic.process_files_to_text(paths, OPENAI_KEY, LLAMA_KEY, names=names)
+        if failed:
+            report(f"⚠️ Не удалось прочитать, пропущено: {', '.join(failed)}")
+        
+        report("🧠 Проектируем сценарии обучения...")
+        questions = []
+        for q in logic.stream_quiz_ai(
+            text_content, q_count, difficulty, lang, openai_key=OPENAI_KEY, force_fresh=force_fresh
+        ):
+            questions.append(q)
+            report(f"✔️ {len(questions)}/{q_count}: {q.scenario[:120]}")
+        return {"quiz": logic.Quiz(questions=questions), "source": text_content[:1000] + "...", "failed": failed}
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def show_job_progress(job_id):
+    """Статус задачи; когда она завершится — полный rerun, чтобы показать результат"""
+    job = get_job_store().get(job_id, owner=st.session_state.user)
+    if job is None:
+        return
+    if not job.active:
+        st.rerun()
+    with st.status(f"🚀 {job.title}: работаем...", expanded=True):
+        for line in list(job.progress):
+            st.write(line)
+
+# Без st.fragment (старый Streamlit) опрашиваем задачу перезапуском всего скрипта
+if hasattr(st, "fragment"):
+    show_job_progress = st.fragment(run_every=1.0)(show_job_progress)
+
 # --- 1. БОКОВАЯ ПАНЕЛЬ (АВТОРИЗАЦИЯ) ---
 with st.sidebar:
     st.image("https://cdn-icons-png.flaticon.com/512/4712/4712035.png", width=60)
@@ -80,6 +148,10 @@ with st.sidebar:
             
     st.divider()
     st.info("ℹ️ MVP v1.0: Поддерживает PDF, DOCX, MP4, MP3.")
+    
+    cache_stats = logic.quiz_cache_stats()
+    if cache_stats["hits"]:
+        st.caption(f"⚡ Кэш тестов: {cache_stats['hits']} попаданий, сэкономлено ~{cache_stats['saved_seconds']} с GPT-4o")
 
 # --- 2. ОСНОВНОЙ ИНТЕРФЕЙС ---
 
@@ -98,43 +170,59 @@ with tab1:
     
     with col1:
         st.subheader("1. Загрузка материала")
-        uploaded_file = st.file_uploader("Файл (PDF, Video, Audio)", type=['pdf', 'docx', 'txt', 'mp4', 'mp3', 'm4a'])
+        # Курс можно собрать из нескольких файлов: презентация + запись + регламент
+        uploaded_files = st.file_uploader(
+            "Файлы (PDF, Video, Audio)", type=['pdf', 'docx', 'pptx', 'xlsx', 'txt', 'md', 'mp4', 'mov', 'webm', 'mp3', 'm4a', 'wav', 'ogg', 'oga'],
+            accept_multiple_files=True,
+        )
         
         st.subheader("2. Настройки AI")
         q_count = st.slider("Количество вопросов", 3, 10, 5)
         difficulty = st.select_slider("Сложность", options=["Easy", "Medium", "Hard"], value="Medium")
         lang = st.selectbox("Язык курса", ["Russian", "English", "Kazakh"])
+        force_fresh = st.checkbox("🔄 Новые вопросы (не брать из кэша)", value=False)
         
         generate_btn = st.button("✨ Сгенерировать курс (1 кредит)", type="primary")
 
     with col2:
-        # Логика генерации
-        if generate_btn and uploaded_file:
-            if auth.deduct_credit(st.session_state.user, 1):
-                status = st.status("🚀 Запускаем AI двигатели...", expanded=True)
-                try:
-                    # 1. Извлечение текста
-                    status.write("📂 Читаем файл и распознаем речь...")
-                    text_content = logic.process_file_to_text(uploaded_file, OPENAI_KEY, LLAMA_KEY)
-                    st.session_state.quiz_text_source = text_content[:1000] + "..."
-                    
-                    # 2. Генерация теста
-                    status.write("🧠 Проектируем сценарии обучения...")
-                    quiz_data = logic.generate_quiz_ai(text_content, q_count, difficulty, lang)
-                    st.session_state.generated_quiz = quiz_data
-                    
-                    status.update(label="✅ Готово! Курс создан.", state="complete", expanded=False)
-                    
-                except Exception as e:
-                    status.update(label="❌ Ошибка!", state="error")
-                    st.error(f"Произошла ошибка: {e}")
+        # Логика генерации: задача уходит в фоновый пул, страница только следит за статусом
+        jobs = get_job_store()
+        if generate_btn and uploaded_files:
+            if jobs.active_jobs(st.session_state.user):
+                st.warning("⏳ Предыдущий курс еще генерируется — дождитесь его завершения.")
+            elif auth.deduct_credit(st.session_state.user, 1):
+                names = [f.name for f in uploaded_files]
+                job_id = jobs.submit(
+                    st.session_state.user, run_generation, [save_upload(f) for f in uploaded_files], names,
+                    q_count, difficulty, lang, force_fresh, title=", ".join(names),
+                )
+                st.session_state.job_id = job_id
+                st.query_params["job"] = job_id
             else:
                 st.error("💳 Недостаточно кредитов! Пожалуйста, пополните баланс.")
+        
+        job = jobs.get(st.session_state.job_id, owner=st.session_state.user) if st.session_state.job_id else None
+        if job and job.active:
+            show_job_progress(job.id)
+            if not hasattr(st, "fragment"):
+                time.sleep(1)
+                st.rerun()
+        elif job and job.id != st.session_state.loaded_job:
+            st.session_state.loaded_job = job.id
+            if job.status == "done":
+                st.session_state.generated_quiz = job.result["quiz"]
+                st.session_state.quiz_text_source = job.result["source"]
+                st.session_state.quiz_failed_files = job.result.get("failed", [])
+                st.session_state.quiz_export = None
+            else:
+                st.error(f"Произошла ошибка: {job.error}")
 
         # Отображение результатов
         if st.session_state.generated_quiz:
             quiz = st.session_state.generated_quiz
             st.success("Курс успешно сгенерирован!")
+            if st.session_state.quiz_failed_files:
+                st.warning(f"⚠️ Не удалось прочитать, в тест не вошли: {', '.join(st.session_state.quiz_failed_files)}")
             
             with st.expander("👀 Предпросмотр вопросов"):
                 for idx, q in enumerate(quiz.questions):
@@ -149,9 +237,11 @@ with tab1:
             c1, c2 = st.columns(2)
             
             with c1:
-                # Скачать HTML
-                course_name = f"Course_{int(time.time())}"
-                html_data = logic.create_html_quiz(quiz, course_name)
+                # Скачать HTML: собираем один раз на сгенерированный курс, а не на каждый rerun
+                if not st.session_state.quiz_export:
+                    course_name = f"Course_{int(time.time())}"
+                    st.session_state.quiz_export = (course_name, logic.create_html_quiz(quiz, course_name))
+                course_name, html_data = st.session_state.quiz_export
                 st.download_button(
                     label="📥 Скачать HTML-тест",
                     data=html_data,
@@ -171,6 +261,25 @@ with tab1:
                         mime="application/pdf"
                     )
 
+                # Массовая выдача: список сотрудников из CSV
+                with st.expander("👥 Сертификаты для всей группы"):
+                    roster_file = st.file_uploader("Список сотрудников (CSV)", type=['csv'])
+                    bulk_format = st.radio("Формат", ["Один PDF", "ZIP (файл на каждого)"], horizontal=True)
+                    if roster_file and st.button("📚 Сгенерировать сертификаты"):
+                        names = logic.read_names_csv(roster_file)
+                        if not names:
+                            st.error("В файле не найдено ни одного имени.")
+                        else:
+                            output = "pdf" if bulk_format == "Один PDF" else "zip"
+                            with st.spinner(f"Готовим {len(names)} сертификатов..."):
+                                bulk_buffer = logic.create_certificates_batch(names, "Корпоративное обучение", output=output)
+                            st.download_button(
+                                label=f"⬇️ Скачать ({len(names)} шт.)",
+                                data=bulk_buffer,
+                                file_name=f"Certificates.{output}",
+                                mime="application/pdf" if output == "pdf" else "application/zip"
+                            )
+
 # === ВКЛАДКА 2: МАРКЕТИНГ ===
 with tab2:
     st.header("Генератор постов для соцсетей")
@@ -184,7 +293,7 @@ with tab2:
     if st.button("✍️ Написать пост (1 кредит)"):
         if auth.deduct_credit(st.session_state.user, 1):
             with st.spinner("Копирайтер пишет текст..."):
-                post_text = logic.generate_marketing_post(m_topic, m_platform, m_tone)
+                post_text = logic.generate_marketing_post(m_topic, m_platform, m_tone, openai_key=OPENAI_KEY)
                 st.text_area("Результат:", post_text, height=300)
         else:
             st.error("Недостаточно кредитов.")
\ No newline at end of file
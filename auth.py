@@ -1,15 +1,31 @@
-import streamlit as st
-from supabase import create_client
+import threading
+
+from utils.ledger import CreditLedger, SupabaseCreditsStore
 
 # --- 1. ПОДКЛЮЧЕНИЕ К SUPABASE ---
-try:
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    # Если ключей нет, работаем в демо-режиме (без базы)
-    print(f"⚠️ Supabase error: {e}")
-    supabase = None
+# Клиент создается при первом обращении к кредитам: импорт streamlit и supabase
+# заметно тормозит старт бота, а /start они вообще не нужны
+_ledger = None
+_connected = False
+_connect_lock = threading.Lock()
+
+def get_ledger():
+    """Леджер кредитов или None, если ключей нет (демо-режим без базы)"""
+    global _ledger, _connected
+    with _connect_lock:
+        if not _connected:
+            _connected = True
+            try:
+                import streamlit as st
+                from supabase import create_client
+                
+                supabase = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+                # Все операции с кредитами идут через леджер: атомарное списание + кэш баланса
+                _ledger = CreditLedger(SupabaseCreditsStore(supabase))
+            except Exception as e:
+                # Если ключей нет, работаем в демо-режиме (без базы)
+                print(f"⚠️ Supabase error: {e}")
+    return _ledger
 
 # --- 2. АВТОРИЗАЦИЯ ---
 def check_password(email, password):
@@ -17,6 +33,8 @@ def check_password(email, password):
     Простая проверка. Админа пускаем по паролю,
     обычных пользователей — просто по email (для MVP).
     """
+    import streamlit as st
+    
     # Админ (данные в secrets или хардкод для старта)
     admin_email = st.secrets.get("ADMIN_EMAIL", "admin@vyud.online")
     admin_pass = st.secrets.get("ADMIN_PASSWORD", "ItheBestFounder26@")
@@ -32,42 +50,42 @@ def check_password(email, password):
 
 # --- 3. БАЛАНС И СПИСАНИЕ ---
 
-def get_credits(email):
-    """Получить текущий баланс. Если юзера нет — создать."""
-    if not supabase: return 999 # Если базы нет, даем безлимит
+def get_credits(email, fresh=False):
+    """Получить текущий баланс (кэш на несколько секунд). Если юзера нет — создать."""
+    ledger = get_ledger()
+    if not ledger: return 999 # Если базы нет, даем безлимит
     
     try:
-        # Ищем юзера
-        response = supabase.table("users_credits").select("credits").eq("email", email).execute()
-        
-        # Если не найден — создаем с приветственным бонусом (5 кредитов)
-        if not response.data:
-            init_credits = 5
-            supabase.table("users_credits").insert({"email": email, "credits": init_credits}).execute()
-            return init_credits
-            
-        return response.data[0]["credits"]
+        return ledger.balance(email, fresh=fresh)
     except Exception as e:
         print(f"Ошибка получения кредитов: {e}")
         return 0
 
 def deduct_credit(email, amount=1):
     """
-    Списывает кредиты.
+    Атомарно списывает кредиты (одним условным UPDATE).
     Возвращает True (успех) или False (нет денег).
     """
-    if not supabase: return True # Если базы нет, разрешаем
+    ledger = get_ledger()
+    if not ledger: return True # Если базы нет, разрешаем
 
     try:
-        current = get_credits(email)
-        
-        if current < amount:
-            return False # Недостаточно средств
-        
-        # Списываем
-        new_balance = current - amount
-        supabase.table("users_credits").update({"credits": new_balance}).eq("email", email).execute()
-        return True
+        return ledger.try_deduct(email, amount)
     except Exception as e:
+        import streamlit as st
         st.error(f"Ошибка списания: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def deduct_credit_deferred(email, amount=1):
+    """
+    Списание для потока запросов бота: резервируется в памяти сразу,
+    в базу уходит пачкой в фоне. Возвращает True или False (нет денег).
+    """
+    ledger = get_ledger()
+    if not ledger: return True
+
+    try:
+        return ledger.charge_deferred(email, amount)
+    except Exception as e:
+        print(f"Ошибка списания: {e}")
+        return False
@@ -0,0 +1,123 @@
+"""
+Бенчмарк извлечения звука: старый путь (moviepy/pydub) против текущего
+(media.prepare_audio — тот же путь, что у logic.compress_audio в продакшене).
+
+Каждый прогон идет в отдельном процессе, чтобы пиковая память не смешивалась.
+Пиковая память = max RSS самого Python + max RSS дочерних процессов (ffmpeg).
+
+Запуск:
+    python benchmarks/bench_audio.py path/to/video.mp4
+    python benchmarks/bench_audio.py --synthetic 600   # сгенерировать 10-минутное видео
+
+Для сравнения со старым путем нужен установленный moviepy (в requirements его больше нет).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VIDEO_EXTS = ('.mp4', '.mov', '.avi', '.mkv')
+
+
+def legacy_compress(input_path):
+    """Копия старого compress_audio: VideoFileClip для видео, AudioSegment для аудио"""
+    output_path = input_path + "_legacy.mp3"
+    if input_path.lower().endswith(VIDEO_EXTS):
+        from moviepy.editor import VideoFileClip
+        video = VideoFileClip(input_path)
+        video.audio.write_audiofile(output_path, bitrate="32k", logger=None)
+        video.close()
+    else:
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(input_path)
+        audio.export(output_path, format="mp3", bitrate="32k")
+    return output_path
+
+
+def ffmpeg_compress(input_path):
+    from utils.media import prepare_audio
+    return prepare_audio(input_path)[0]
+
+
+BACKENDS = {"legacy": legacy_compress, "ffmpeg": ffmpeg_compress}
+
+
+def run_backend(name, path):
+    """Выполняется в дочернем процессе: печатает JSON с временем и памятью"""
+    start = time.perf_counter()
+    output_path = BACKENDS[name](path)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss в Linux — килобайты
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    out_size = os.path.getsize(output_path)
+    if output_path != path:
+        os.remove(output_path)
+
+    print(json.dumps({
+        "backend": name,
+        "seconds": round(elapsed, 3),
+        "python_peak_mb": round(self_rss / 1024, 1),
+        "ffmpeg_peak_mb": round(child_rss / 1024, 1),
+        "output_mb": round(out_size / (1024 * 1024), 2),
+    }))
+
+
+def make_synthetic_video(seconds):
+    path = os.path.join(tempfile.gettempdir(), f"vyud_bench_{seconds}s.mp4")
+    if not os.path.exists(path):
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-y", "-v", "error",
+             "-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=25:duration={seconds}",
+             "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+             "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path],
+            check=True,
+        )
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--synthetic", type=int, help="длительность синтетического видео в секундах")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--run", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    path = make_synthetic_video(args.synthetic) if args.synthetic else args.path
+    if not path:
+        parser.error("укажите файл или --synthetic")
+
+    if args.run:
+        run_backend(args.run, path)
+        return
+
+    print(f"Файл: {path} ({os.path.getsize(path) / (1024 * 1024):.1f} МБ)")
+    print(f"{'backend':<8} {'best s':>8} {'python MB':>10} {'ffmpeg MB':>10} {'out MB':>8}")
+    for name in BACKENDS:
+        runs = []
+        for _ in range(args.repeat):
+            result = subprocess.run(
+                [sys.executable, __file__, path, "--run", name],
+                capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                print(f"{name:<8} failed: {result.stderr.strip().splitlines()[-1:]}")
+                break
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+        if runs:
+            best = min(runs, key=lambda r: r["seconds"])
+            print(f"{name:<8} {best['seconds']:>8} {max(r['python_peak_mb'] for r in runs):>10} "
+                  f"{max(r['ffmpeg_peak_mb'] for r in runs):>10} {best['output_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
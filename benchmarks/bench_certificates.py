@@ -0,0 +1,56 @@
+"""
+Бенчмарк сертификатов: N вызовов create_certificate против пакетного рендера.
+
+Запуск:
+    python benchmarks/bench_certificates.py --count 1000
+    python benchmarks/bench_certificates.py --count 1000 --logo assets/logo.png
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logic  # noqa: E402
+
+
+def bench(label, count, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    size = result.getbuffer().nbytes if isinstance(result, io.BytesIO) else 0
+    print(f"{label:<22} {elapsed:>8.2f} s {count / elapsed:>10.1f} cert/s {size / (1024 * 1024):>8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--logo", help="путь к логотипу (PNG/JPG)")
+    args = parser.parse_args()
+
+    logo_bytes = open(args.logo, "rb").read() if args.logo else None
+
+    def logo():
+        return io.BytesIO(logo_bytes) if logo_bytes else None
+
+    names = [f"Employee Number {i}" for i in range(args.count)]
+    course = "Corporate Training"
+
+    print(f"{'mode':<22} {'time':>10} {'throughput':>17} {'output':>11}")
+
+    def one_by_one():
+        total = io.BytesIO()
+        for name in names:
+            total.write(logic.create_certificate(name, course, logo()).getvalue())
+        return total
+
+    bench("create_certificate xN", args.count, one_by_one)
+    bench("batch: one PDF", args.count, lambda: logic.create_certificates_batch(names, course, logo(), output="pdf"))
+    bench("batch: ZIP", args.count, lambda: logic.create_certificates_batch(names, course, logo(), output="zip"))
+
+
+if __name__ == "__main__":
+    main()
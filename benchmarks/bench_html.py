@@ -0,0 +1,93 @@
+"""
+Бенчмарк HTML-экспорта: старая склейка строк против шаблонного рендера.
+
+Показывает, как время растет с числом вопросов (должно быть линейно).
+
+Запуск:
+    python benchmarks/bench_html.py --sizes 10 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logic  # noqa: E402
+
+
+def legacy_create_html_quiz(quiz, course_title):
+    """Старая реализация: html += f-строка в цикле (CSS и JS опущены — они не зависят от N)"""
+    correct_indices = []
+    for q in quiz.questions:
+        safe_id = q.correct_option_id
+        if safe_id >= len(q.options) or safe_id < 0:
+            safe_id = 0
+        correct_indices.append(safe_id)
+
+    html = f"<html><head><title>Тест: {course_title}</title></head><body><h1>{course_title}</h1>"
+    for i, q in enumerate(quiz.questions):
+        html += f"""
+        <div class="question" id="q{i}">
+            <h3>{i+1}. {q.scenario}</h3>
+            <div class="options">
+        """
+        for j, opt in enumerate(q.options):
+            html += f"""<label><input type="radio" name="q{i}" value="{j}"> {opt}</label>"""
+        html += f"""
+            </div>
+            <div id="feedback-{i}" class="feedback">
+                <strong>Правильный ответ:</strong> {q.options[correct_indices[i]]}<br><br>
+                <em>{q.explanation}</em>
+            </div>
+        </div>
+        """
+    html += f"<script>const correctAnswers = {correct_indices};</script></body></html>"
+    return html.encode("utf-8")
+
+
+def make_quiz(n):
+    return logic.Quiz(questions=[
+        logic.QuizQuestion(
+            scenario=f"Сотрудник {i} получил подозрительное письмо <с вложением>. Что он должен сделать в первую очередь?",
+            options=[f"Вариант {j} для вопроса {i}" for j in range(4)],
+            correct_option_id=i % 4,
+            explanation="Пояснение: почему этот ответ верен, а остальные — типичные ошибки. " * 3,
+        )
+        for i in range(n)
+    ])
+
+
+def timed(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'questions':>9} {'legacy ms':>10} {'new ms':>8} {'minify ms':>10} {'gzip ms':>8} "
+          f"{'new KB':>8} {'min KB':>8} {'gz KB':>7} {'µs/q':>6}")
+    for n in args.sizes:
+        quiz = make_quiz(n)
+        legacy, _ = timed(lambda quiz=quiz: legacy_create_html_quiz(quiz, "Bench"), args.repeat)
+        new, plain = timed(lambda quiz=quiz: logic.create_html_quiz(quiz, "Bench"), args.repeat)
+        minified, small = timed(lambda quiz=quiz: logic.create_html_quiz(quiz, "Bench", minify=True), args.repeat)
+        gzipped, packed = timed(
+            lambda quiz=quiz: logic.create_html_quiz(quiz, "Bench", minify=True, compress=True), args.repeat
+        )
+        print(f"{n:>9} {legacy * 1000:>10.2f} {new * 1000:>8.2f} {minified * 1000:>10.2f} {gzipped * 1000:>8.2f} "
+              f"{len(plain) / 1024:>8.1f} {len(small) / 1024:>8.1f} {len(packed) / 1024:>7.1f} {new / n * 1e6:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Регрессионный бенчмарк времени старта: холодный импорт logic, bot и app.
+
+Каждый импорт — в свежем интерпретаторе (лучший из --repeat прогонов).
+Если время превышает бюджет, скрипт завершается с кодом 1 — его можно
+запускать в CI, чтобы тяжелые импорты не возвращались на уровень модуля.
+
+Запуск:
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --budget logic=0.5 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджеты в секундах (с запасом на медленные машины)
+BUDGETS = {"logic": 0.6, "bot": 1.5, "app": 3.0}
+
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+try:
+    import {module}
+except BaseException:
+    # app.py — это скрипт Streamlit: вне рантайма он может остановиться на st.stop()
+    if {module!r} != "app":
+        raise
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in ("llama_index.core", "llama_parse", "openai", "pydub", "reportlab", "moviepy", "supabase")
+               if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "heavy": heavy}}))
+"""
+
+
+def measure(module, env):
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(root=ROOT, module=module)],
+        capture_output=True, text=True, cwd=ROOT, env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(module, env, limit):
+    """Самые дорогие импорты по -X importtime (кумулятивно, мкс)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r})\ntry:\n import {module}\nexcept BaseException:\n pass"],
+        capture_output=True, text=True, cwd=ROOT, env=env,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match and len(match.group(3)) <= 3:  # только верхний уровень
+            rows.append((int(match.group(2)), match.group(4)))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", action="append", default=[], help="module=seconds")
+    parser.add_argument("--top", type=int, default=0, help="показать N самых дорогих импортов")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        name, value = item.split("=")
+        budgets[name] = float(value)
+
+    env = dict(os.environ)
+    # bot.py создает Bot(token=...) при импорте — нужен синтаксически валидный токен
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+
+    failed = False
+    print(f"{'module':<8} {'best s':>8} {'budget':>8} {'RSS MB':>8}  heavy modules loaded")
+    for module in args.modules:
+        runs = [measure(module, env) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r["seconds"])
+        budget = budgets.get(module)
+        over = budget is not None and best["seconds"] > budget
+        failed |= over
+        print(f"{module:<8} {best['seconds']:>8.3f} {budget or '-':>8} {best['rss_mb']:>8.1f}  "
+              f"{', '.join(best['heavy']) or '-'}{'  <-- OVER BUDGET' if over else ''}")
+        for usec, name in top_imports(module, env, args.top) if args.top else []:
+            print(f"         {usec / 1e6:>8.3f}  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+Офлайн-бенчмарк всего пайплайна: извлечение текста, генерация теста, HTML,
+сертификат и обработка файла ботом от начала до конца.
+
+Облачные сервисы (LlamaParse, Whisper, GPT-4o, Supabase, Telegram) заменены
+локальными фейками из benchmarks/fakes.py с настраиваемой задержкой, поэтому
+сеть и ключи не нужны, а цифры воспроизводимы. Корпус (PDF, аудио, видео)
+генерируется через reportlab и ffmpeg или берется из --corpus.
+
+Для каждого этапа — p50/p90/p99/среднее в мс, пропускная способность и пик
+памяти. Результат сохраняется в benchmarks/results/<label>.json (ключи
+отсортированы, чтобы diff между версиями был читаемым); --compare печатает
+изменения относительно прошлого прогона и возвращает код 1 при регрессии.
+
+Запуск:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --scale 0.1 --iterations 5 --users 8
+    python benchmarks/bench_pipeline.py --latency whisper=4 --latency gpt_per_question=2
+    python benchmarks/bench_pipeline.py --label after --compare benchmarks/results/before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import (  # noqa: E402
+    CallCounter, FakeBot, FakeLLM, FakeLlamaParse, FakeMessage, FakeOpenAIClient, Latency, LatencyStore,
+    fake_text,
+)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DOC_EXTS = {".pdf", ".docx", ".pptx", ".xlsx", ".txt", ".md"}
+AUDIO_EXTS = {".mp3", ".ogg", ".m4a", ".wav", ".oga"}
+VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".webm", ".avi"}
+# Какое поле сообщения Telegram заполняется для файла такого типа
+MESSAGE_KIND = {"doc": "document", "audio": "audio", "voice": "voice", "video": "video"}
+ALL_STAGES = ["extract", "generate", "html", "certificate", "bot"]
+
+
+# --- КОРПУС ---
+
+def make_pdf(path, pages):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=A4)
+    for page in range(pages):
+        text = c.beginText(50, 800)
+        for line in range(50):
+            text.textLine(f"Page {page + 1}, line {line + 1}: information security policy and procedures")
+        c.drawText(text)
+        c.showPage()
+    c.save()
+
+
+def make_media(path, seconds, video=False):
+    ffmpeg = os.getenv("FFMPEG_BINARY", "ffmpeg")
+    args = [ffmpeg, "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}"]
+    if video:
+        args += ["-f", "lavfi", "-i", f"testsrc=size=320x240:rate=15:duration={seconds}", "-shortest"]
+    subprocess.run(args + [path], check=True)
+
+
+def build_corpus(directory, pdf_pages, audio_seconds):
+    """Генерирует набор файлов каждого типа, который принимают бот и приложение"""
+    os.makedirs(directory, exist_ok=True)
+    make_pdf(os.path.join(directory, "policy.pdf"), pdf_pages)
+    make_media(os.path.join(directory, "lecture.mp3"), audio_seconds)
+    make_media(os.path.join(directory, "voice.ogg"), min(audio_seconds, 60))
+    make_media(os.path.join(directory, "webinar.mp4"), audio_seconds, video=True)
+
+
+def classify(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in DOC_EXTS:
+        return "doc"
+    if ext in (".ogg", ".oga"):
+        return "voice"
+    if ext in AUDIO_EXTS:
+        return "audio"
+    if ext in VIDEO_EXTS:
+        return "video"
+    return None
+
+
+def load_corpus(directory):
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        kind = classify(path)
+        if kind and os.path.isfile(path):
+            files.append((kind, path))
+    if not files:
+        raise SystemExit(f"В корпусе {directory} нет подходящих файлов")
+    return files
+
+
+# --- ПОДМЕНА СЕРВИСОВ ---
+
+def install_fakes(latency, counter, workdir, files):
+    """Импортирует logic/bot/auth и подменяет все внешние вызовы фейками"""
+    os.environ["VYUD_CACHE_DIR"] = os.path.join(workdir, "cache")
+    # bot.py создает Bot(token=...) при импорте — нужен синтаксически валидный токен
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+
+    FakeLlamaParse.latency, FakeLlamaParse.counter = latency, counter
+    sys.modules["llama_parse"] = types.SimpleNamespace(LlamaParse=FakeLlamaParse)
+
+    import logic
+    import auth
+    import bot
+    from utils import providers
+    from utils.ledger import CreditLedger, MemoryCreditsStore
+
+    llm = FakeLLM(latency, counter)
+    client = FakeOpenAIClient(latency, counter)
+    for module in (providers, logic):
+        module.get_llm = lambda *args, **kwargs: llm
+        module.get_openai_client = lambda *args, **kwargs: client
+    # Лимиты OpenAI меряем отдельно — здесь они только исказили бы задержки этапов
+    providers.LIMITS = {kind: (10 ** 6, None) for kind in providers.LIMITS}
+    providers._limiters.clear()
+
+    store = LatencyStore(MemoryCreditsStore(), latency, counter)
+    auth._ledger = CreditLedger(store, initial_credits=10 ** 6)
+    auth._connected = True
+
+    bot.bot = FakeBot(latency, counter, files)
+    return logic, bot
+
+
+# --- ИЗМЕРЕНИЯ ---
+
+def percentile(values, q):
+    ordered = sorted(values)
+    # Nearest-rank: без интерполяции, как у большинства APM
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stage:
+    """Собирает длительности одного этапа, время стены и пик памяти"""
+
+    def __init__(self, name, trace_memory):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.samples = []
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.started
+        # ru_maxrss монотонен: это пик всего процесса к концу этапа (точнее — --trace-memory)
+        self.rss_mb = rss_mb()
+        self.py_peak_mb = None
+        if self.trace_memory:
+            self.py_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        return False
+
+    def measure(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        ms = [s * 1000 for s in self.samples]
+        row = {
+            "count": len(ms),
+            "p50_ms": round(percentile(ms, 50), 1),
+            "p90_ms": round(percentile(ms, 90), 1),
+            "p99_ms": round(percentile(ms, 99), 1),
+            "mean_ms": round(sum(ms) / len(ms), 1),
+            "throughput_per_s": round(len(ms) / self.wall, 3) if self.wall else None,
+            "rss_peak_mb": round(self.rss_mb, 1),
+        }
+        if self.py_peak_mb is not None:
+            row["py_peak_mb"] = round(self.py_peak_mb, 1)
+        return row
+
+
+def bench_extract(logic, files, iterations, trace_memory, texts):
+    stages = []
+    for kind, path in files:
+        cold = Stage(f"extract.{kind}.{os.path.basename(path)}", trace_memory)
+        with cold:
+            for _ in range(iterations):
+                logic.extraction_cache.clear()
+                texts[kind] = cold.measure(logic.process_file_to_text, path, "sk-fake", "llx-fake")
+        warm = Stage(f"extract.{kind}.{os.path.basename(path)}.cached", trace_memory)
+        with warm:
+            for _ in range(iterations):
+                warm.measure(logic.process_file_to_text, path, "sk-fake", "llx-fake")
+        stages += [cold, warm]
+    return stages
+
+
+def bench_generate(logic, text, iterations, trace_memory):
+    short = Stage("generate.single", trace_memory)
+    with short:
+        for _ in range(iterations):
+            quiz = short.measure(logic.generate_quiz_ai, text, 5, "Medium", "Russian", force_fresh=True)
+
+    long_text = fake_text(logic.SINGLE_PROMPT_CHARS // 5, seed=1)
+    chunked = Stage("generate.chunked", trace_memory)
+    with chunked:
+        for _ in range(iterations):
+            chunked.measure(logic.generate_quiz_ai, long_text, 5, "Medium", "Russian", force_fresh=True)
+
+    first = Stage("generate.stream_first_question", trace_memory)
+    with first:
+        for _ in range(iterations):
+            stream = logic.stream_quiz_ai(text, 5, "Medium", "Russian", force_fresh=True)
+            first.measure(next, stream)
+            stream.close()
+
+    cached = Stage("generate.cached", trace_memory)
+    with cached:
+        for _ in range(iterations):
+            cached.measure(logic.generate_quiz_ai, text, 5, "Medium", "Russian")
+    return [short, chunked, first, cached], quiz
+
+
+def bench_html(logic, quiz, iterations, trace_memory):
+    stage = Stage("html", trace_memory)
+    with stage:
+        for _ in range(iterations):
+            stage.measure(logic.create_html_quiz, quiz, "Benchmark course")
+    return [stage]
+
+
+def bench_certificate(logic, iterations, trace_memory):
+    stage = Stage("certificate", trace_memory)
+    with stage:
+        for i in range(iterations):
+            stage.measure(logic.create_certificate, f"Иван Петров {i}", "Информационная безопасность")
+    return [stage]
+
+
+def bench_bot(logic, bot, files, users, per_user, trace_memory):
+    """Несколько пользователей одновременно шлют файлы боту: время до первого опроса и до конца"""
+    fake_bot = bot.bot
+    total = Stage("bot.handle_files", trace_memory)
+    first_poll = Stage("bot.first_poll", trace_memory)
+
+    async def user(user_id):
+        for n in range(per_user):
+            kind, path = files[(user_id + n) % len(files)]
+            file_id = next(fid for fid, p in fake_bot.files.items() if p == path)
+            message = FakeMessage(fake_bot, user_id, file_id, MESSAGE_KIND[kind], os.path.basename(path))
+            start = time.perf_counter()
+            await bot.handle_files(message)
+            # Опросы уходят через очередь чата уже после выхода из обработчика — ждем доставки
+            await bot.sender.drain(user_id)
+            total.samples.append(time.perf_counter() - start)
+            polls = [t for chat, what, _, t in fake_bot.sent if chat == user_id and what == "poll" and t > start]
+            if polls:
+                first_poll.samples.append(min(polls) - start)
+
+    async def run():
+        await bot.scheduler.start()
+        try:
+            await asyncio.gather(*(user(i) for i in range(1, users + 1)))
+        finally:
+            await bot.scheduler.stop()
+
+    with total:
+        logic.extraction_cache.clear()
+        logic.quiz_cache.clear()
+        asyncio.run(run())
+    first_poll.wall, first_poll.rss_mb, first_poll.py_peak_mb = total.wall, total.rss_mb, None
+    if not first_poll.samples:
+        print("Warning: bot sent no polls, bot.first_poll is missing from the results")
+    return [s for s in (total, first_poll) if s.samples]
+
+
+# --- ОТЧЕТ ---
+
+def print_table(stages):
+    print(f"{'stage':<46} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'per s':>7} {'RSS MB':>7}")
+    for name, row in stages.items():
+        print(f"{name:<46} {row['count']:>4} {row['p50_ms']:>9.1f} {row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+              f"{row['mean_ms']:>9.1f} {row['throughput_per_s'] or 0:>7.2f} {row['rss_peak_mb']:>7.1f}")
+
+
+def compare(old_path, stages, threshold):
+    """Печатает изменения p50/p90 относительно прошлого прогона; True, если есть регрессия"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)["stages"]
+    regressed = False
+    print(f"\nvs {old_path} (порог {threshold:.0f}%)")
+    for name, row in stages.items():
+        if name not in old:
+            print(f"{name:<46} new")
+            continue
+        deltas = []
+        for metric in ("p50_ms", "p90_ms"):
+            before = old[name][metric]
+            change = (row[metric] - before) / before * 100 if before else 0.0
+            deltas.append(f"{metric[:3]} {before:>8.1f} -> {row[metric]:>8.1f} ({change:+.1f}%)")
+            regressed |= change > threshold
+        print(f"{name:<46} " + "  ".join(deltas))
+    return regressed
+
+
+def git_label():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="каталог с файлами (по умолчанию генерируется)")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--audio-seconds", type=int, default=120)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--users", type=int, default=4, help="одновременных пользователей бота")
+    parser.add_argument("--per-user", type=int, default=2, help="файлов от каждого пользователя")
+    parser.add_argument("--stages", nargs="+", default=ALL_STAGES, choices=ALL_STAGES)
+    parser.add_argument("--latency", action="append", default=[], help="name=seconds, см. fakes.Latency")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель всех задержек фейков")
+    parser.add_argument("--trace-memory", action="store_true", help="пик Python-аллокаций по этапам (медленнее)")
+    parser.add_argument("--label", default=None, help="имя файла результатов (по умолчанию git hash)")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    parser.add_argument("--threshold", type=float, default=10.0, help="регрессия, если p50/p90 выросли больше, %%")
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.latency:
+        name, value = item.split("=")
+        if name not in Latency.DEFAULTS:
+            parser.error(f"неизвестная задержка {name}; есть: {', '.join(Latency.DEFAULTS)}")
+        overrides[name] = float(value)
+    latency = Latency(args.scale, **overrides)
+    counter = CallCounter()
+
+    workdir = tempfile.mkdtemp(prefix="vyud_bench_")
+    try:
+        corpus = args.corpus or os.path.join(workdir, "corpus")
+        if not args.corpus:
+            print("Генерирую корпус...")
+            build_corpus(corpus, args.pdf_pages, args.audio_seconds)
+        files = load_corpus(corpus)
+        file_ids = {f"file{i}": path for i, (_, path) in enumerate(files)}
+
+        logic, bot = install_fakes(latency, counter, workdir, file_ids)
+        # Бот пишет временные файлы в текущий каталог
+        os.chdir(workdir)
+
+        results = []
+        texts = {}
+        if "extract" in args.stages or "generate" in args.stages:
+            stages = bench_extract(logic, files, args.iterations, args.trace_memory, texts)
+            if "extract" in args.stages:
+                results += stages
+        text = texts.get("doc") or next(iter(texts.values()), "")
+        quiz = None
+        if "generate" in args.stages or "html" in args.stages:
+            stages, quiz = bench_generate(logic, text or fake_text(3000), args.iterations, args.trace_memory)
+            if "generate" in args.stages:
+                results += stages
+        if "html" in args.stages:
+            results += bench_html(logic, quiz, args.iterations, args.trace_memory)
+        if "certificate" in args.stages:
+            results += bench_certificate(logic, args.iterations, args.trace_memory)
+        if "bot" in args.stages:
+            results += bench_bot(logic, bot, files, args.users, args.per_user, args.trace_memory)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {stage.name: stage.summary() for stage in results}
+    print_table(stages)
+
+    label = args.label or git_label()
+    report = {
+        "label": label,
+        "python": sys.version.split()[0],
+        "latency": {name: latency[name] for name in Latency.DEFAULTS},
+        "params": {"iterations": args.iterations, "users": args.users, "per_user": args.per_user,
+                   "corpus": [os.path.basename(path) for _, path in files]},
+        "calls": counter.counts,
+        "stages": stages,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"\nРезультаты: {os.path.relpath(out_path, ROOT)}")
+
+    if args.compare and compare(args.compare, stages, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
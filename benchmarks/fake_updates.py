@@ -0,0 +1,163 @@
+"""
+Нагрузочный тест webhook-режима бота: поток фейковых апдейтов Telegram
+(документы от многих пользователей) отправляется POST-запросами на
+serve_webhook, а обработку ведут 1, 2, 4... процесса-воркера.
+
+Telegram, OpenAI, LlamaParse и Supabase заменены фейками из benchmarks/fakes.py
+(как в bench_pipeline.py), корпус — текстовые файлы, поэтому ffmpeg и ключи не
+нужны. Для каждого числа воркеров — задержка ответа webhook (p50/p99) и
+пропускная способность: сколько апдейтов в секунду обработано до пустой очереди.
+
+Запуск:
+    python benchmarks/fake_updates.py
+    python benchmarks/fake_updates.py --workers 1 2 4 8 --updates 200 --scale 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import install_fakes, percentile  # noqa: E402
+from fakes import CallCounter, Latency, fake_text  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_update(update_id, user_id, file_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"},
+            "document": {"file_id": file_id, "file_unique_id": f"u_{file_id}", "file_name": f"{file_id}.txt"},
+        },
+    }
+
+
+async def drive(port, updates, users, files, queue):
+    """Шлет апдейты параллельно, как Telegram, и ждет, пока очередь опустеет"""
+    import aiohttp
+
+    url = f"http://127.0.0.1:{port}/telegram"
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.post(url, json={"update_id": 0}, headers={"X-Telegram-Bot-Api-Secret-Token": "-"}):
+                    break
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+
+        async def post(n):
+            update = make_update(n, n % users + 1, files[n % len(files)])
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(n) for n in range(1, updates + 1)))
+        while True:
+            stats = await asyncio.to_thread(queue.stats)
+            if not stats.get("queued") and not stats.get("leased"):
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed, stats
+
+
+def run_child(args):
+    """Один прогон с args.child воркерами; результат — JSON в stdout"""
+    workdir = tempfile.mkdtemp(prefix="vyud_updates_")
+    try:
+        os.environ["VYUD_UPDATES_PATH"] = os.path.join(workdir, "updates.sqlite")
+        os.environ["WEBHOOK_SECRET"] = SECRET
+        corpus = {}
+        for i in range(4):
+            path = os.path.join(workdir, f"doc{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(fake_text(2000, seed=i))
+            corpus[f"doc{i}"] = path
+
+        _, bot = install_fakes(Latency(args.scale), CallCounter(), workdir, corpus)
+        from utils.updates import UpdateQueue
+        os.chdir(workdir)
+
+        port = free_port()
+        queue = UpdateQueue()
+
+        async def main():
+            server = asyncio.create_task(
+                bot.serve_webhook(processes=args.child, port=port, set_webhook=False, start_method="fork")
+            )
+            try:
+                return await drive(port, args.updates, args.users, list(corpus), queue)
+            finally:
+                os.kill(os.getpid(), signal.SIGTERM)
+                await server
+
+        latencies, elapsed, stats = asyncio.run(main())
+        print(json.dumps({
+            "workers": args.child,
+            "post_p50_ms": percentile(latencies, 50) * 1000,
+            "post_p99_ms": percentile(latencies, 99) * 1000,
+            "elapsed_s": elapsed,
+            "per_s": args.updates / elapsed,
+            "dead": stats.get("dead", 0),
+        }))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="числа процессов-воркеров")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50, help="разных чатов среди апдейтов")
+    parser.add_argument("--scale", type=float, default=0.1, help="множитель задержек фейков")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    # Каждое число воркеров — в отдельном процессе: чистые модули, очередь и порт
+    rows = []
+    for workers in args.workers:
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", str(workers), "--updates", str(args.updates),
+             "--users", str(args.users), "--scale", str(args.scale)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        rows.append(json.loads(out.strip().splitlines()[-1]))
+
+    base = rows[0]["per_s"]
+    print(f"{'workers':>7} {'POST p50 ms':>12} {'POST p99 ms':>12} {'total s':>8} {'upd/s':>7} {'speedup':>8} {'dead':>5}")
+    for row in rows:
+        print(f"{row['workers']:>7} {row['post_p50_ms']:>12.1f} {row['post_p99_ms']:>12.1f} {row['elapsed_s']:>8.2f} "
+              f"{row['per_s']:>7.2f} {row['per_s'] / base:>7.2f}x {row['dead']:>5}")
+
+
+if __name__ == "__main__":
+    main()
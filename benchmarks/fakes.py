@@ -0,0 +1,250 @@
+"""
+Локальные заменители облачных сервисов для офлайн-бенчмарков.
+
+Каждый фейк ведет себя как настоящий API по форме ответа и спит
+заданную задержку (Latency), так что пайплайн можно гонять без сети и ключей.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+
+WORDS = (
+    "безопасность сотрудник политика данные доступ пароль инцидент отчет клиент процесс "
+    "регламент обучение проверка риск компания руководитель система почта вложение ответ"
+).split()
+
+
+class Latency:
+    """Задержки фейков в секундах; scale позволяет ускорить все разом"""
+
+    DEFAULTS = {
+        "whisper": 2.0,          # на запрос
+        "llamaparse": 3.0,       # на документ
+        "gpt_first_token": 1.0,  # до первого токена
+        "gpt_per_question": 1.5, # генерация одного вопроса
+        "supabase": 0.05,        # на запрос
+        "telegram": 0.05,        # на вызов Bot API
+        "telegram_download_mbps": 50.0,
+    }
+
+    def __init__(self, scale=1.0, **overrides):
+        self.scale = scale
+        self.values = {**self.DEFAULTS, **overrides}
+
+    def __getitem__(self, name):
+        value = self.values[name]
+        return value if name.endswith("_mbps") else value * self.scale
+
+    def sleep(self, name, factor=1.0):
+        time.sleep(self[name] * factor)
+
+    async def asleep(self, name, factor=1.0):
+        await asyncio.sleep(self[name] * factor)
+
+
+def fake_text(words, seed=0):
+    rnd = random.Random(seed)
+    return " ".join(rnd.choice(WORDS) for _ in range(words)) + "."
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+
+# --- OPENAI (Whisper) ---
+
+class FakeOpenAIClient:
+    """Минимальный OpenAI-клиент: только audio.transcriptions.create"""
+
+    def __init__(self, latency, counter, api_key="sk-fake"):
+        self.api_key = api_key
+        latency_ref, counter_ref = latency, counter
+
+        class Transcriptions:
+            def create(self, model, file, response_format="json", **kwargs):
+                size = len(file.read())
+                counter_ref.add("whisper")
+                latency_ref.sleep("whisper")
+                # ~1 слово на 400 байт mp3 32k — порядок как у живой речи
+                return SimpleNamespace(text=fake_text(max(20, size // 400), seed=size))
+
+        self.audio = SimpleNamespace(transcriptions=Transcriptions())
+
+
+# --- GPT-4o ---
+
+def _fake_question(i, seed):
+    rnd = random.Random(seed * 1000 + i)
+    return {
+        "scenario": f"Вопрос {i + 1}: " + fake_text(25, seed + i),
+        "options": [fake_text(6, seed + i * 10 + j) for j in range(4)],
+        "correct_option_id": rnd.randrange(4),
+        "explanation": fake_text(15, seed - i),
+    }
+
+
+class FakeLLM:
+    """Заменитель llama_index OpenAI: complete() и stream_complete() возвращают JSON теста"""
+
+    def __init__(self, latency, counter):
+        self.latency = latency
+        self.counter = counter
+
+    def _quiz_json(self, prompt):
+        match = re.search(r"Number of questions: (\d+)", prompt)
+        count = int(match.group(1)) if match else 5
+        seed = len(prompt)
+        return count, json.dumps(
+            {"questions": [_fake_question(i, seed) for i in range(count)]}, ensure_ascii=False
+        )
+
+    def complete(self, prompt, **kwargs):
+        self.counter.add("gpt")
+        self.counter.add("gpt_prompt_chars", len(prompt))
+        count, raw = self._quiz_json(prompt)
+        self.latency.sleep("gpt_first_token")
+        self.latency.sleep("gpt_per_question", count)
+        return SimpleNamespace(text=raw)
+
+    def stream_complete(self, prompt, **kwargs):
+        self.counter.add("gpt")
+        self.counter.add("gpt_prompt_chars", len(prompt))
+        count, raw = self._quiz_json(prompt)
+        self.latency.sleep("gpt_first_token")
+        # Отдаем кусками так, чтобы на каждый вопрос ушло gpt_per_question секунд
+        step = 40
+        pieces = [raw[i:i + step] for i in range(0, len(raw), step)]
+        pause = self.latency["gpt_per_question"] * count / max(len(pieces), 1)
+        for piece in pieces:
+            time.sleep(pause)
+            yield SimpleNamespace(delta=piece, text=piece)
+
+
+# --- LlamaParse ---
+
+class FakeLlamaParse:
+    """Заменитель llama_parse.LlamaParse для SimpleDirectoryReader (file_extractor)"""
+
+    latency = None
+    counter = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def load_data(self, file_path, extra_info=None, **kwargs):
+        from llama_index.core import Document
+
+        self.counter.add("llamaparse")
+        size = os.path.getsize(file_path)
+        self.latency.sleep("llamaparse")
+        # ~1 слово на 20 байт PDF
+        return [Document(text=fake_text(max(200, size // 20), seed=size), metadata=extra_info or {})]
+
+
+# --- SUPABASE ---
+
+class LatencyStore:
+    """Оборачивает MemoryCreditsStore задержкой сети"""
+
+    def __init__(self, store, latency, counter):
+        self.store = store
+        self.latency = latency
+        self.counter = counter
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def call(*args, **kwargs):
+            self.counter.add("supabase")
+            self.latency.sleep("supabase")
+            return method(*args, **kwargs)
+        return call
+
+
+# --- TELEGRAM ---
+
+class FakeBot:
+    """Заменитель aiogram.Bot с методами, которые вызывает bot.py"""
+
+    def __init__(self, latency, counter, files):
+        self.latency = latency
+        self.counter = counter
+        self.files = files           # file_id -> локальный путь из корпуса
+        self.sent = []               # (chat_id, kind, payload, время)
+        self._ids = itertools.count(1)
+        self.id = 123456789
+        self.session = SimpleNamespace(close=self._close)
+
+    async def _close(self):
+        pass
+
+    async def __call__(self, method, request_timeout=None):
+        # Вызовы через объекты методов (m.answer() в webhook-режиме): SendMessage -> send_message
+        name = re.sub(r"(?<!^)(?=[A-Z])", "_", method.__api_method__).lower()
+        fields = {key: value for key, value in method.model_dump().items() if value is not None}
+        return await getattr(self, name)(**fields)
+
+    async def _call(self, name):
+        self.counter.add(f"telegram.{name}")
+        await self.latency.asleep("telegram")
+
+    async def get_file(self, file_id):
+        await self._call("get_file")
+        path = self.files[file_id]
+        return SimpleNamespace(file_id=file_id, file_path=f"files/{file_id}.{path.rsplit('.', 1)[-1]}")
+
+    async def download_file(self, file_path, destination):
+        await self._call("download_file")
+        file_id = file_path.split("/")[-1].rsplit(".", 1)[0]
+        source = self.files[file_id]
+        size_mb = os.path.getsize(source) / (1024 * 1024)
+        await asyncio.sleep(size_mb / self.latency["telegram_download_mbps"])
+        await asyncio.to_thread(shutil.copyfile, source, destination)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("send_message")
+        self.sent.append((chat_id, "message", text, time.perf_counter()))
+        return SimpleNamespace(message_id=next(self._ids), chat=SimpleNamespace(id=chat_id))
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._call("edit_message_text")
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call("delete_message")
+
+    async def send_poll(self, chat_id, question, options, **kwargs):
+        await self._call("send_poll")
+        self.sent.append((chat_id, "poll", question, time.perf_counter()))
+        return SimpleNamespace(message_id=next(self._ids))
+
+
+class FakeMessage:
+    """Входящее сообщение с файлом: поля как у aiogram.types.Message"""
+
+    def __init__(self, bot, user_id, file_id, kind="document", file_name=None, media_group_id=None):
+        self._bot = bot
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}")
+        self.chat = SimpleNamespace(id=user_id)
+        self.message_id = next(bot._ids)
+        self.media_group_id = media_group_id
+        for field in ("video_note", "voice", "audio", "video", "document"):
+            setattr(self, field, None)
+        setattr(self, kind, SimpleNamespace(
+            file_id=file_id, file_unique_id=f"u_{file_id}", file_name=file_name, mime_type=None,
+        ))
+
+    async def answer(self, text, **kwargs):
+        return await self._bot.send_message(self.chat.id, text)
@@ -1,6 +1,10 @@
 import asyncio
+import json
 import logging
+import multiprocessing
 import os
+import signal
+import time
 import toml
 from pathlib import Path
 from aiogram import Bot, Dispatcher, Router, F
@@ -10,6 +14,11 @@ from aiogram.types import Message
 # Импортируем нашу логику
 import logic 
 import auth
+from utils.jobs import JobScheduler, QueueFull, iterate_in_thread
+from utils.sender import MessageSender
+from utils.singleflight import SingleFlight
+from utils.updates import UpdateQueue, LEASE_SECONDS
+from utils import metrics
 
 # --- НАСТРОЙКИ ---
 secrets_path = Path(__file__).parent / ".streamlit" / "secrets.toml"
@@ -23,18 +32,20 @@ else:
     OPENAI_KEY = os.getenv("OPENAI_API_KEY")
     LLAMA_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
 
-router = Router()
-bot = Bot(token=TOKEN)
+# Порт для Prometheus (/metrics); без него метрики собираются только при VYUD_METRICS=1
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
-# --- АДАПТЕР ФАЙЛОВ ---
-class LocalFileWrapper:
-    def __init__(self, path):
-        self.name = path
-        with open(path, "rb") as f:
-            self._data = f.read()
+# Webhook-режим включается, если задан WEBHOOK_URL (иначе — long polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", "2"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "120"))
+POLL_INTERVAL = 0.2
 
-    def getvalue(self):
-        return self._data
+router = Router()
+bot = Bot(token=TOKEN)
 
 # --- ОБРАБОТЧИКИ ---
 
@@ -42,102 +53,416 @@ class LocalFileWrapper:
 async def start(m: Message): 
     await m.answer("👋 Привет! Я VYUD AI. Пришли мне файл (PDF/DOCX), голосовое, видео-кружочек или аудио.")
 
+# --- ОЧЕРЕДЬ ЗАДАЧ ---
+scheduler = JobScheduler(
+    workers=int(os.getenv("BOT_WORKERS", "4")),
+    max_queue=int(os.getenv("BOT_MAX_QUEUE", "50")),
+    max_per_user=int(os.getenv("BOT_MAX_PER_USER", "3")),
+)
+
+# Исходящие сообщения с учетом лимитов Telegram (общий и на чат)
+sender = MessageSender()
+
+async def report_queue_position(job, set_status):
+    """Пока задача ждет в очереди, показываем пользователю его место"""
+    last = None
+    timeout = 0.5  # Если воркер свободен, задача стартует сразу — не показываем очередь зря
+    while True:
+        try:
+            await asyncio.wait_for(job.started.wait(), timeout=timeout)
+            return
+        except asyncio.TimeoutError:
+            timeout = 3
+        pos = scheduler.position(job)
+        if pos and pos != last:
+            await set_status(f"⏳ Вы в очереди: №{pos}", only_if_queued=job)
+            last = pos
+
+# Альбом (media group) приходит отдельными сообщениями: собираем их в один пакет
+MEDIA_GROUP_DELAY = float(os.getenv("MEDIA_GROUP_DELAY", "1.0"))
+media_groups = {}   # media_group_id -> {"messages": [...], "arrived": asyncio.Event, "done": asyncio.Event}
+
+def _file_of(m: Message):
+    """(file_id, file_unique_id, тип, имя файла) из сообщения или None"""
+    if m.video_note: return m.video_note.file_id, m.video_note.file_unique_id, "video_note", None
+    if m.voice: return m.voice.file_id, m.voice.file_unique_id, "voice", None
+    if m.audio: return m.audio.file_id, m.audio.file_unique_id, "audio", m.audio.file_name
+    if m.video: return m.video.file_id, m.video.file_unique_id, "video", m.video.file_name
+    if m.document: return m.document.file_id, m.document.file_unique_id, "document", m.document.file_name
+    return None
+
+# Параметры теста в боте (одинаковые для всех пользователей)
+QUIZ_PARAMS = {"count": 5, "difficulty": "Medium", "lang": "Russian"}
+
+# Один и тот же файл, пересланный по чату компании, обрабатывается один раз:
+# одновременные запросы с тем же file_unique_id получают те же вопросы
+flights = SingleFlight()
+
+def _flight_key(files):
+    return (tuple(unique_id for _, unique_id, _, _ in files), *QUIZ_PARAMS.values())
+
 @router.message(F.video_note | F.voice | F.audio | F.video | F.document)
 async def handle_files(m: Message):
+    if not m.media_group_id:
+        await handle_batch([m])
+        return
+    
+    group = media_groups.get(m.media_group_id)
+    if group is not None:
+        group["messages"].append(m)
+        group["arrived"].set()
+        # Не завершаем обработку апдейта, пока пакет не готов: иначе воркер подтвердит
+        # его в очереди (utils/updates.py), и после падения альбом вернется неполным
+        await group["done"].wait()
+        return
+    
+    # Первое сообщение альбома ждет, пока остальные перестанут приходить
+    group = media_groups[m.media_group_id] = {"messages": [m], "arrived": asyncio.Event(), "done": asyncio.Event()}
+    try:
+        while True:
+            group["arrived"].clear()
+            try:
+                await asyncio.wait_for(group["arrived"].wait(), timeout=MEDIA_GROUP_DELAY)
+            except asyncio.TimeoutError:
+                break
+    finally:
+        del media_groups[m.media_group_id]
+    try:
+        await handle_batch(group["messages"])
+    finally:
+        group["done"].set()
+
+async def handle_batch(messages):
+    """Один или несколько файлов пользователя -> один тест (и одно списание)"""
+    m = messages[0]
     user_email = f"{m.from_user.username or m.from_user.id}@telegram.vyud"
     
     # 1. Проверка баланса
     if auth.get_credits(user_email) <= 0: 
         await m.answer("🚫 Недостаточно кредитов. Попросите админа пополнить баланс.")
         return
-        
-    msg = await m.answer("📥 Скачиваю файл...")
     
-    # Определение ID
-    if m.video_note: fid = m.video_note.file_id
-    elif m.voice: fid = m.voice.file_id
-    elif m.audio: fid = m.audio.file_id
-    elif m.video: fid = m.video.file_id
-    elif m.document: fid = m.document.file_id
-    else: return
+    files = [f for f in map(_file_of, messages) if f]
+    if not files:
+        return
+    
+    kind = files[0][2] if len(files) == 1 else "batch"
+    with metrics.span("bot.request", kind=kind) as request_span:
+        await _handle_files(m, files, user_email, request_span)
 
-    path = f"temp_bot_{m.from_user.id}_{fid}" 
+async def _handle_files(m: Message, files, user_email, request_span):
+    """Ставит файлы в очередь и ждет результата, показывая место в очереди"""
+    msg = await m.answer("📥 Файл принят..." if len(files) == 1 else f"📥 Принято файлов: {len(files)}...")
+    
+    # Статус правят и очередь, и сама задача — не даем им перебивать друг друга
+    status_lock = asyncio.Lock()
     
+    async def set_status(text, only_if_queued=None):
+        async with status_lock:
+            if only_if_queued is not None and only_if_queued.started.is_set():
+                return
+            await sender.send(m.chat.id, lambda: bot.edit_message_text(
+                text=text, chat_id=m.chat.id, message_id=msg.message_id
+            ), kind="edit_message_text")
+    
+    # Этот файл уже обрабатывается для другого пользователя — очередь не нужна, ждем тот же результат
+    if flights.running(_flight_key(files)):
+        request_span.set(result=await process_upload(m, files, msg, user_email, set_status))
+        return
+    
+    submitted = time.perf_counter()
     try:
-        f_info = await bot.get_file(fid)
-        ext = f_info.file_path.split('.')[-1]
-        path = f"{path}.{ext}"
-        
-        await bot.download_file(f_info.file_path, path)
+        job = await scheduler.submit(m.from_user.id, lambda: process_upload(m, files, msg, user_email, set_status))
+    except QueueFull:
+        request_span.set(result="queue_full")
+        await set_status("⏳ Сейчас слишком много задач. Попробуйте отправить файл через пару минут.")
+        return
+    
+    await report_queue_position(job, set_status)
+    metrics.observe("bot.queue", time.perf_counter() - submitted)
+    request_span.set(result=await job.future)
+
+async def produce_quiz(m: Message, files):
+    """
+    Общая часть обработки (выполняется один раз на файл, см. flights):
+    отдает ("status", текст), ("no_text", None), ("failed", имена непрочитанных файлов)
+    и ("question", QuizQuestion).
+    """
+    paths = []
+    
+    async def download(fid):
+        async with scheduler.stage("download"):
+            with metrics.span("telegram.download") as s:
+                f_info = await bot.get_file(fid)
+                ext = f_info.file_path.split('.')[-1]
+                path = f"temp_bot_{m.from_user.id}_{fid}.{ext}"
+                paths.append(path)
+                
+                await bot.download_file(f_info.file_path, path)
+                s.set(bytes=os.path.getsize(path))
+                return path
+    
+    try:
+        yield "status", "📥 Скачиваю файл..." if len(files) == 1 else "📥 Скачиваю файлы..."
         
-        # 2. Обработка (Используем именованные аргументы!)
-        await bot.edit_message_text(
-            text="👂 Изучаю содержимое ...", 
-            chat_id=m.chat.id, 
-            message_id=msg.message_id
-        )
+        # Ждем все загрузки, даже если одна упала, чтобы finally удалил все файлы
+        downloaded = await asyncio.gather(*(download(fid) for fid, _, _, _ in files), return_exceptions=True)
+        for result in downloaded:
+            if isinstance(result, Exception):
+                raise result
         
-        wrapped_file = LocalFileWrapper(path)
+        # 2. Обработка
+        yield "status", "👂 Изучаю содержимое ..."
         
-        # Запускаем логику в потоке
-        text = await asyncio.to_thread(logic.process_file_to_text, wrapped_file, OPENAI_KEY, LLAMA_KEY)
+        # Передаем пути: файлы уходят в ffmpeg/LlamaParse без копий в память
+        # Тяжелые этапы ограничены лимитами очереди
+        text, failed = await asyncio.to_thread(
+            logic.process_files_to_text, downloaded, OPENAI_KEY, LLAMA_KEY, scheduler.blocking_stage,
+            [name for _, _, _, name in files],
+        )
         
         if not text:
-            await bot.edit_message_text(
-                text="❌ Не удалось извлечь текст.", 
-                chat_id=m.chat.id, 
-                message_id=msg.message_id
-            )
+            yield "no_text", None
             return
+        if failed:
+            yield "failed", failed
 
-        # 3. Генерация квиза
-        await bot.edit_message_text(
-            text="🧠 Придумываю вопросы ...", 
-            chat_id=m.chat.id, 
-            message_id=msg.message_id
-        )
-        
-        quiz = await asyncio.to_thread(
-            logic.generate_quiz_ai, 
-            text=text, 
-            count=5, 
-            difficulty="Medium", 
-            lang="Russian"
-        )
+        # 3. Генерация квиза: вопросы приходят по одному, первый опрос уходит через секунды
+        yield "status", "🧠 Придумываю вопросы ..."
         
-        # 4. Финал
-        auth.deduct_credit(user_email, 1)
-        await bot.delete_message(chat_id=m.chat.id, message_id=msg.message_id)
-        await m.answer("✅ Готово! Вот ваш тест:")
+        async with scheduler.stage("generate"):
+            async for q in iterate_in_thread(logic.stream_quiz_ai, text=text, openai_key=OPENAI_KEY, **QUIZ_PARAMS):
+                yield "question", q
+    finally:
+        for path in paths:
+            if os.path.exists(path): 
+                os.remove(path)
 
-        for q in quiz.questions:
-            try:
-                await bot.send_poll(
-                    chat_id=m.chat.id,
-                    question=q.scenario[:299], 
-                    options=[o[:99] for o in q.options], 
-                    type='quiz', 
-                    correct_option_id=q.correct_option_id,
-                    explanation=q.explanation[:199]
-                )
-                await asyncio.sleep(1)
-            except Exception as e:
-                logging.error(f"Poll error: {e}")
+def _log_delivery(future):
+    """Ошибка отправки опроса — в лог (задача к этому моменту уже могла завершиться)"""
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Poll error: {future.exception()}")
+
+async def process_upload(m: Message, files, msg, user_email, set_status):
+    """
+    Скачивание, извлечение текста, генерация и отправка квиза (выполняется воркером очереди).
+    files — список (file_id, file_unique_id, тип, имя); несколько файлов скачиваются и читаются параллельно.
+    Если тот же файл сейчас обрабатывается для другого пользователя, подключаемся к этой обработке:
+    кредит списывается и опросы отправляются каждому отдельно.
+    Возвращает итог для метрик: "ok", "no_text" или "error".
+    """
+    started = time.perf_counter()
+    
+    try:
+        stream, shared = flights.stream(_flight_key(files), lambda: produce_quiz(m, files))
+        if shared:
+            metrics.count("shared_requests", "bot.request", 1)
+        
+        sent = 0
+        failed = []
+        async for kind, value in stream:
+            if kind == "status":
+                await set_status(value)
+                continue
+            if kind == "no_text":
+                await set_status("❌ Не удалось извлечь текст.")
+                return "no_text"
+            if kind == "failed":
+                failed = value
+                continue
+            
+            q = value
+            # 4. Первый вопрос готов — списываем кредит и убираем статус
+            if sent == 0:
+                metrics.observe("bot.first_poll", time.perf_counter() - started)
+                auth.deduct_credit_deferred(user_email, 1)
+                await sender.send(m.chat.id, lambda: bot.delete_message(
+                    chat_id=m.chat.id, message_id=msg.message_id
+                ), kind="delete_message")
+                done = "✅ Готово! Вот ваш тест:"
+                if failed:
+                    done = f"⚠️ Не удалось прочитать, в тест не вошли: {', '.join(failed)}\n\n" + done
+                await sender.send(m.chat.id, lambda done=done: m.answer(done))
+            
+            # Не ждем отправки: следующий вопрос генерируется, пока этот стоит в очереди чата,
+            # а воркер очереди задач освобождается сразу после последнего вопроса
+            delivery = sender.submit(m.chat.id, lambda q=q: bot.send_poll(
+                chat_id=m.chat.id,
+                question=q.scenario,
+                options=q.options,
+                type='quiz',
+                correct_option_id=q.correct_option_id,
+                explanation=q.explanation or None
+            ), kind="send_poll")
+            delivery.add_done_callback(_log_delivery)
+            sent += 1
+        
+        return "ok"
                 
     except Exception as e:
         await m.answer(f"❌ Произошла ошибка: {e}")
         logging.error(e)
-    finally:
-        if os.path.exists(path): 
-            os.remove(path)
+        return "error"
 
 async def main():
     logging.basicConfig(level=logging.INFO)
     dp = Dispatcher()
     dp.include_router(router)
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Апдейты, пришедшие во время рестарта, не выбрасываем
+    await bot.delete_webhook(drop_pending_updates=False)
+    await scheduler.start()
+    if METRICS_PORT:
+        metrics.enable()
+        await metrics.start_http_server(METRICS_PORT)
+        print(f"📈 Метрики: http://localhost:{METRICS_PORT}/metrics")
+    # Supabase и streamlit грузим в фоне, чтобы первая загрузка файла не ждала импорта
+    asyncio.create_task(asyncio.to_thread(auth.get_ledger))
     print("🤖 Бот VYUD AI запущен!")
     await dp.start_polling(bot)
+    # Остановка: досылаем то, что уже стоит в очередях чатов
+    await sender.drain()
+
+# --- WEBHOOK-РЕЖИМ ---
+# Процесс-приемник только складывает апдейты в очередь на диске (utils/updates.py),
+# обработкой занимаются BOT_PROCESSES воркеров. Рестарт или падение воркера не теряет
+# задачи: неподтвержденный апдейт после истечения аренды берется заново.
+
+def _update_chat_id(data):
+    """Чат апдейта — по нему апдейты делятся между воркерами"""
+    for key in ("message", "edited_message", "channel_post", "callback_query", "my_chat_member"):
+        item = data.get(key)
+        if not item:
+            continue
+        chat = item.get("chat") or (item.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if item.get("from"):
+            return item["from"]["id"]
+    return 0
+
+async def serve_webhook(processes=BOT_PROCESSES, port=WEBHOOK_PORT, set_webhook=True, start_method="spawn"):
+    """Принимает апдейты по HTTP и держит пул процессов-воркеров (перезапускает упавшие)"""
+    from aiohttp import web
+    
+    logging.basicConfig(level=logging.INFO)
+    queue = UpdateQueue()
+    ctx = multiprocessing.get_context(start_method)
+    workers = [None] * processes
+    
+    def spawn(shard):
+        workers[shard] = ctx.Process(target=run_worker, args=(shard, processes), name=f"vyud-worker-{shard}")
+        workers[shard].start()
+    
+    for shard in range(processes):
+        spawn(shard)
+    
+    async def handle(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        data = await request.json()
+        # Ответ Telegram — только после записи на диск: иначе апдейт может потеряться
+        await asyncio.to_thread(queue.put, data["update_id"], _update_chat_id(data), json.dumps(data))
+        return web.Response()
+    
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    if set_webhook:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, drop_pending_updates=False)
+    print(f"🤖 Бот VYUD AI: webhook на :{port}{WEBHOOK_PATH}, воркеров: {processes}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        for shard, process in enumerate(workers):
+            if not stop.is_set() and not process.is_alive():
+                print(f"Warning: worker {shard} exited with {process.exitcode}, restarting")
+                spawn(shard)
+    
+    # Сначала перестаем принимать, потом даем воркерам доработать
+    await runner.cleanup()
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        await asyncio.to_thread(process.join, DRAIN_TIMEOUT + 10)
+    await bot.session.close()
+
+def run_worker(shard, shards):
+    """Точка входа процесса-воркера"""
+    asyncio.run(_worker_loop(shard, shards))
+
+async def _worker_loop(shard, shards):
+    from aiogram.types import Update
+    
+    logging.basicConfig(level=logging.INFO)
+    dp = Dispatcher()
+    dp.include_router(router)
+    queue = UpdateQueue()
+    await scheduler.start()
+    if METRICS_PORT:
+        metrics.enable()
+        await metrics.start_http_server(METRICS_PORT + 1 + shard)
+    asyncio.create_task(asyncio.to_thread(auth.get_ledger))
+    
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    
+    inflight = {}   # id в очереди -> задача
+    capacity = scheduler.max_queue
+    
+    async def process(row_id, payload):
+        try:
+            await dp.feed_update(bot, Update.model_validate_json(payload))
+        except Exception as e:
+            # Ошибки пользователю уже показал обработчик; повтор того же апдейта не поможет
+            logging.error(f"Update {row_id} failed: {e}")
+        await asyncio.to_thread(queue.ack, row_id)
+    
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            await asyncio.to_thread(queue.extend, list(inflight))
+    
+    beat = asyncio.create_task(heartbeat())
+    while not stopping.is_set():
+        free = capacity - len(inflight)
+        batch = await asyncio.to_thread(queue.lease, shard, shards, free) if free > 0 else []
+        for row_id, payload in batch:
+            task = asyncio.create_task(process(row_id, payload))
+            inflight[row_id] = task
+            task.add_done_callback(lambda _, row_id=row_id: inflight.pop(row_id, None))
+        if not batch:
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    # Плавная остановка: новые апдейты не берем, текущие дорабатываем;
+    # не успевшие за DRAIN_TIMEOUT возвращаем в очередь для следующего запуска
+    if inflight:
+        print(f"Worker {shard}: draining {len(inflight)} jobs...")
+        await asyncio.wait(list(inflight.values()), timeout=DRAIN_TIMEOUT)
+    for row_id, task in list(inflight.items()):
+        task.cancel()
+        queue.release(row_id)
+    await sender.drain()
+    beat.cancel()
+    await scheduler.stop()
+    await bot.session.close()
 
 if __name__ == "__main__": 
-    asyncio.run(main())
\ No newline at end of file
+    if WEBHOOK_URL:
+        asyncio.run(serve_webhook())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -1,25 +1,50 @@
 import os
+import re
+import math
+import shutil
 import tempfile
+import csv
+import json
+import gzip
+import zipfile
+import html as html_lib
+from string import Template
 import io
+import time
+import itertools
 from datetime import datetime
+from contextlib import nullcontext
 from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Библиотеки AI
-from openai import OpenAI as OpenAIClient
-from llama_parse import LlamaParse
-from llama_index.core import SimpleDirectoryReader, Settings
-from llama_index.llms.openai import OpenAI
-from llama_index.core.program import LLMTextCompletionProgram
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
-# Библиотеки для работы с видео/аудио
-from moviepy.editor import VideoFileClip
-from pydub import AudioSegment
+# Тяжелые библиотеки (llama_index, llama_parse, openai, pydub, reportlab)
+# импортируются внутри функций при первом использовании: /start в боте
+# и PDF-сценарий в приложении не платят за загрузку всего стека.
 
-# Библиотеки PDF
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.lib.utils import ImageReader
+# Работа с видео/аудио (ffmpeg + Whisper)
+from utils.audio import split_audio, transcribe_segments
+# Разбор медиа по содержимому и выбор самого дешевого пути к Whisper
+from utils.media import MEDIA_EXTS, is_media, prepare_audio, probe
+# Общие клиенты OpenAI с пулом соединений и лимитами RPM/TPM
+from utils.providers import get_openai_client, get_llm, call_with_limits, estimate_tokens
+
+# Кэш извлеченного текста (общий для app.py и bot.py)
+from utils.cache import DiskCache, file_hash, content_hash
+# Быстрый локальный разбор простых документов (txt, docx, pdf с текстовым слоем)
+from utils.extractors import extract_local
+# Чистка колонтитулов/дублей и отбор главного под бюджет токенов
+from utils.passages import clean_text, select_passages
+# Замеры этапов (при выключенных метриках span() ничего не делает)
+from utils.metrics import span, observe, ext_label
+# Разбор и локальная починка ответа модели (обрезанный JSON, индексы, лимиты Telegram)
+from utils.quiz_repair import (
+    QuestionStreamParser, extract_questions, loads_lenient, normalize_question, fix_prompt, repair_slots,
+    QUESTION_MAX, OPTION_MAX, EXPLANATION_MAX, MIN_OPTIONS, MAX_OPTIONS,
+)
+
+extraction_cache = DiskCache(namespace="extraction")
 
 # --- МОДЕЛИ ДАННЫХ ---
 class QuizQuestion(BaseModel):
@@ -27,87 +52,159 @@ class QuizQuestion(BaseModel):
     options: List[str] = Field(..., description="Список вариантов ответа")
     correct_option_id: int = Field(..., description="Индекс правильного ответа (0-3)")
     explanation: str = Field(..., description="Образовательное пояснение: почему этот ответ верен")
+    
+    @model_validator(mode="after")
+    def _check_correct_option(self):
+        # Все вопросы проходят через normalize_question; индекс вне диапазона — ошибка, а не «нулевой ответ»
+        if not 0 <= self.correct_option_id < len(self.options):
+            raise ValueError("correct_option_id вне диапазона вариантов")
+        return self
 
 class Quiz(BaseModel):
     questions: List[QuizQuestion]
 
 # --- ФУНКЦИИ ОБРАБОТКИ ---
 
+# Пакет файлов: документы и медиа в разных пулах, чтобы ffmpeg не отнимал потоки у парсинга
+DOC_WORKERS = 4
+MEDIA_WORKERS = 2
+
+def is_media_file(name, source=None):
+    """Медиа ли файл; если есть путь или поток — проверяем содержимое, а не только расширение"""
+    if source is not None:
+        try:
+            return is_media(source, name)
+        except (OSError, AttributeError):
+            pass
+    return os.path.splitext(name)[1].lower() in MEDIA_EXTS
+
 def compress_audio(input_path):
     """
-    Превращает видео/аудио в MP3 и сжимает, если файл > 25MB.
+    Превращает видео/аудио в формат для Whisper самым дешевым путем (utils/media.py):
+    как есть, копией дорожки или перекодированием. Возвращает путь.
     """
-    try:
-        file_size = os.path.getsize(input_path) / (1024 * 1024) # Размер в МБ
-        output_path = input_path + "_compressed.mp3"
-        
-        # Если это видео, достаем звук
-        if input_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-            video = VideoFileClip(input_path)
-            # Извлекаем аудио, глушим вывод логов (logger=None)
-            video.audio.write_audiofile(output_path, bitrate="32k", logger=None)
-            video.close()
-            return output_path
-            
-        # Если это аудио, но тяжелое (>24MB)
-        elif file_size > 24:
-            audio = AudioSegment.from_file(input_path)
-            audio.export(output_path, format="mp3", bitrate="32k")
-            return output_path
-            
+    return prepare_audio(input_path)[0]
+
+def _spool_to_temp(stream, suffix):
+    """Копирует поток во временный файл кусками (для UploadedFile и прочих не-путей)"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        if hasattr(stream, "read"):
+            if hasattr(stream, "seekable") and stream.seekable():
+                stream.seek(0)
+            shutil.copyfileobj(stream, tmp, 1024 * 1024)
         else:
-            return input_path # Возвращаем как есть
-            
-    except Exception as e:
-        print(f"Warning: Audio compression failed: {e}")
-        return input_path
+            # Старые обертки, у которых есть только getvalue()
+            tmp.write(stream.getvalue())
+        return tmp.name
 
-def process_file_to_text(uploaded_file, openai_key, llama_key):
-    """Определяет тип файла и извлекает текст"""
-    
+def process_file_to_text(source, openai_key, llama_key, limiter=None, name=None):
+    """
+    Определяет тип файла и извлекает текст.
+    Документы сначала читаются локально (utils/extractors.py); в LlamaParse
+    уходят только сканы и сложная верстка. Уровень и время печатаются в лог.
+    source — путь к файлу (используется напрямую, без копий) или поток/UploadedFile
+    (копируется во временный файл). name — имя файла, если у потока его нет.
+    limiter(stage) — необязательный контекст-менеджер, ограничивающий
+    параллелизм этапов "transcode", "transcribe" и "parse" (см. utils/jobs.py).
+    """
+    with span("extract") as extract_span:
+        return _process_file_to_text(source, openai_key, llama_key, limiter, name, extract_span)
+
+def _process_file_to_text(source, openai_key, llama_key, limiter, name, extract_span):
+    limiter = limiter or (lambda stage: nullcontext())
     text = ""
-    file_ext = os.path.splitext(uploaded_file.name)[1].lower()
+    is_path = isinstance(source, (str, os.PathLike))
+    name = name or (os.fspath(source) if is_path else getattr(source, "name", ""))
+    file_ext = os.path.splitext(name)[1].lower()
+    start = time.perf_counter()
+    
+    # Поток без seek() хэшировать заранее нельзя — сначала сохраняем на диск
+    tmp_path = None
+    if not is_path and not (hasattr(source, "seekable") and source.seekable()):
+        tmp_path = _spool_to_temp(source, file_ext)
+    
+    # Тип — по содержимому: голосовые .oga и файлы без расширения не уходят в LlamaParse
+    media = is_media(tmp_path or source, name)
+    mode = 'whisper' if media else 'document'
+    extract_span.set(mode=mode)
     
-    # Создаем временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-        tmp.write(uploaded_file.getvalue())
-        tmp_path = tmp.name
+    # Тот же файл уже обрабатывали — отдаем текст из кэша
+    cache_key = f"{file_hash(tmp_path or source)}:{mode}"
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        extract_span.set(cache="hit", tier="cache", output_chars=len(cached))
+        _report_tier(name, "cache", start)
+        return cached.decode("utf-8")
+    
+    # Путь используем как есть; поток сохраняем во временный файл
+    if is_path:
+        file_path = os.fspath(source)
+    else:
+        file_path = tmp_path = tmp_path or _spool_to_temp(source, file_ext)
+    extract_span.set(cache="miss", input_bytes=os.path.getsize(file_path))
 
+    tier = mode
+    route = None
     try:
         # 1. ВИДЕО И АУДИО (Whisper)
-        if file_ext in [".mp4", ".mov", ".avi", ".mp3", ".mpeg", ".m4a", ".wav"]:
-            
-            # Сжимаем/конвертируем перед отправкой
-            processed_path = compress_audio(tmp_path)
+        if media:
             
-            client = OpenAIClient(api_key=openai_key)
-            with open(processed_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="json"
-                )
+            # Готовим звук самым дешевым путем; неподходящий файл отсекается до вызова Whisper
+            # Длинные паузы вырезаются (route="trim") — Whisper получает меньше секунд
+            with limiter("transcode"), span("transcode") as s:
+                info = probe(file_path)
+                processed_path, route, trim_stats = prepare_audio(file_path, info=info)
+                s.set(route=route, output_bytes=os.path.getsize(processed_path))
+                if route == "trim":
+                    s.set(audio_seconds_removed=trim_stats["seconds_removed"],
+                          whisper_usd_saved=trim_stats["cost_saved_usd"])
+            extract_span.set(route=route)
+            if trim_stats and route == "trim":
+                print(f"Silence trim: {trim_stats['seconds_in']}s -> {trim_stats['seconds_out']}s, "
+                      f"saved ~${trim_stats['cost_saved_usd']} and ~{trim_stats['latency_saved_s']}s of Whisper")
             
-            # Удаляем сжатую копию
-            if processed_path != tmp_path and os.path.exists(processed_path):
-                os.remove(processed_path)
-            
-            # Обработка разных форматов ответа
-            if hasattr(transcription, 'text'):
-                text = transcription.text
-            elif isinstance(transcription, dict):
-                text = transcription.get('text', '')
-            else:
-                text = str(transcription)
+            segments = []
+            try:
+                # Нарезка длинной записи по паузам — тоже ffmpeg, поэтому под лимитом "transcode";
+                # длительность уже известна из probe (после обрезки — из ее статистики)
+                duration = trim_stats["seconds_out"] if route == "trim" else info["duration"]
+                with limiter("transcode"), span("split") as s:
+                    segments = split_audio(processed_path, duration or None)
+                    s.set(segments=len(segments))
+                
+                # Сегменты распознаются параллельно
+                client = get_openai_client(openai_key)
+                with limiter("transcribe"), span("transcribe") as s:
+                    text = transcribe_segments(segments, client)
+                    s.set(input_bytes=os.path.getsize(processed_path))
+            finally:
+                # Удаляем сжатую копию и сегменты
+                for path in {processed_path, *segments} - {file_path}:
+                    if os.path.exists(path):
+                        os.remove(path)
 
-        # 2. ДОКУМЕНТЫ (LlamaParse)
+        # 2. ДОКУМЕНТЫ: локально, если получится
         else:
+            with span("local_extract", ext=ext_label(file_ext)) as s:
+                text = extract_local(file_path, file_ext) or ""
+                s.set(result="ok" if text else "escalate")
+            tier = "local"
+        
+        # 3. ДОКУМЕНТЫ (LlamaParse): сканы, сложная верстка и прочие форматы
+        if not media and not text:
+            tier = "llamaparse"
+            from llama_parse import LlamaParse
+            from llama_index.core import SimpleDirectoryReader
+            
             # Инициализация LlamaParse
             parser = LlamaParse(result_type="markdown", api_key=llama_key)
             
             file_extractor = {".pdf": parser, ".pptx": parser, ".docx": parser, ".xlsx": parser, ".txt": parser}
             # SimpleDirectoryReader умеет читать файлы по одному
-            docs = SimpleDirectoryReader(input_files=[tmp_path], file_extractor=file_extractor).load_data()
+            with limiter("parse"), span("parse", ext=ext_label(file_ext)):
+                docs = SimpleDirectoryReader(input_files=[file_path], file_extractor=file_extractor).load_data()
             
             if docs:
                 text = "\n\n".join([doc.text for doc in docs])
@@ -115,19 +212,80 @@ def process_file_to_text(uploaded_file, openai_key, llama_key):
                 raise Exception("Не удалось прочитать документ")
                 
     finally:
-        # Всегда удаляем исходный временный файл
-        if os.path.exists(tmp_path):
+        # Всегда удаляем временную копию (файл по переданному пути не трогаем)
+        if tmp_path and os.path.exists(tmp_path):
             os.remove(tmp_path)
+    
+    if text:
+        extraction_cache.set(cache_key, text)
+    extract_span.set(tier=tier, output_chars=len(text))
+    _report_tier(name, tier, start, route)
             
     return text
 
-def generate_quiz_ai(text, count, difficulty, lang):
-    """Генерирует JSON с тестом через GPT-4o"""
+def process_files_to_text(sources, openai_key, llama_key, limiter=None, names=None):
+    """
+    Пакетное извлечение (курс из нескольких файлов): файлы обрабатываются параллельно,
+    общее время — примерно как у самого долгого файла. Тексты склеиваются в исходном
+    порядке с заголовком-источником. Один файл — текст без заголовка.
+    Возвращает (текст, имена упавших файлов): упавшие пропускаются, чтобы вызывающий
+    показал их пользователю; если не прочитался ни один — ошибка.
+    """
+    names = list(names or [None] * len(sources))
+    # Подпись источника — имя файла, если его передали (у голосовых и кружочков имени нет)
+    labels = [os.path.basename(name) if name else f"Файл {i + 1}" for i, name in enumerate(names)]
     
-    # Настраиваем LLM глобально для LlamaIndex
-    Settings.llm = OpenAI(model="gpt-4o", temperature=0.2)
+    texts = [None] * len(sources)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=DOC_WORKERS) as doc_pool, \
+            ThreadPoolExecutor(max_workers=MEDIA_WORKERS) as media_pool:
+        futures = {}
+        for i, (source, name) in enumerate(zip(sources, names)):
+            # Тип определяем по пути, если он есть: имя из Telegram бывает без расширения
+            is_path = isinstance(source, (str, os.PathLike))
+            name = None if is_path else name
+            pool = media_pool if is_media_file(os.fspath(source) if is_path else name or "", source) else doc_pool
+            futures[pool.submit(process_file_to_text, source, openai_key, llama_key, limiter, name)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                texts[i] = future.result()
+            except Exception as e:
+                print(f"Warning: {labels[i]} failed: {e}")
+                errors[i] = f"{labels[i]}: {e}"
     
-    system_prompt = (
+    parts = [(label, text) for label, text in zip(labels, texts) if text]
+    if not parts:
+        reasons = "; ".join(errors[i] for i in sorted(errors))
+        raise Exception("Не удалось извлечь текст ни из одного файла" + (f" ({reasons})" if reasons else ""))
+    failed = [labels[i] for i in sorted(errors)]
+    if len(sources) == 1:
+        return parts[0][1], failed
+    return "\n\n".join(f"## Источник: {label}\n\n{text}" for label, text in parts), failed
+
+def _report_tier(name, tier, start, route=None):
+    route = f", route={route}" if route else ""
+    print(f"Extracted {os.path.basename(name) or 'upload'}: tier={tier}{route}, {time.perf_counter() - start:.2f}s")
+
+# --- ГЕНЕРАЦИЯ ТЕСТОВ ---
+
+SINGLE_PROMPT_CHARS = 50000   # Сколько текста влезает в один промпт
+CHARS_PER_TOKEN = 4           # Грубая оценка без токенизатора
+CHUNK_TOKENS = 6000           # Размер куска для map-reduce режима
+MAX_CHUNK_WORKERS = 4         # Сколько кусков обрабатываем параллельно
+# Бюджет текста в одном промпте: лишнее отсекается по информативности, а не по позиции.
+# Меньше SINGLE_PROMPT_CHARS — иначе в режиме auto отбирать было бы нечего
+PROMPT_TOKEN_BUDGET = int(os.getenv("QUIZ_TOKEN_BUDGET", "8000"))
+# Бюджет всего map-reduce: число кусков (и цена) не растет с длиной документа бесконечно
+CHUNKED_TOKEN_BUDGET = int(os.getenv("QUIZ_CHUNKED_TOKEN_BUDGET", str(8 * CHUNK_TOKENS)))
+
+# Меняйте версию при правке промпта — старые закэшированные тесты перестанут подходить
+QUIZ_PROMPT_VERSION = "v4"
+quiz_cache = DiskCache(namespace="quiz", max_bytes=64 * 1024 * 1024, max_age=7 * 24 * 3600)
+_quiz_cache_saved = {"seconds": 0.0}
+
+def _build_quiz_prompt(count, difficulty, lang):
+    return (
         f"Role: You are a Senior Instructional Designer for a Fortune 500 company. "
         f"Task: Create a high-quality assessment quiz based on the provided text. "
         f"Target Audience: Corporate employees. "
@@ -147,33 +305,325 @@ def generate_quiz_ai(text, count, difficulty, lang):
         f"2. Distractors (wrong answers) must be PLAUSIBLE common misconceptions, not obvious jokes.\n"
         f"3. The 'scenario' field should be the question text. For Hard/Medium, make it a mini-story.\n"
         f"4. The 'explanation' must explain WHY the correct answer is right AND why the distraction was wrong. It should be educational.\n"
-        f"5. Strictly follow the JSON schema provided."
+        f"5. Length limits (answers are shown as Telegram polls): 'scenario' at most {QUESTION_MAX} characters, "
+        f"each option at most {OPTION_MAX}, 'explanation' at most {EXPLANATION_MAX}; "
+        f"{MIN_OPTIONS} to {MAX_OPTIONS} options (4 is best).\n"
+        f"6. Strictly follow the JSON schema provided."
     )
+
+_OUTPUT_FORMAT = (
+    "\n\nOutput format: return ONLY a JSON object, no markdown fences, exactly like:\n"
+    '{"questions": [{"scenario": "...", "options": ["...", "..."], "correct_option_id": 0, "explanation": "..."}]}'
+)
+
+def _quiz_prompt(text, count, difficulty, lang, avoid=()):
+    prompt = _build_quiz_prompt(count, difficulty, lang) + _OUTPUT_FORMAT
+    if avoid:
+        prompt += "\n\nDo not repeat these questions:\n" + "\n".join(f"- {q}" for q in avoid)
+    return prompt + "\n\nContent to analyze:\n" + text
+
+def _run_quiz_program(text, count, difficulty, lang, llm, openai_key=None):
+    """Один запрос к модели: ответ разбирается и чинится локально, сломанные вопросы переспрашиваются"""
+    prompt = _quiz_prompt(text, count, difficulty, lang)
+    # Вход + примерно 400 токенов ответа на вопрос
+    tokens = estimate_tokens(prompt) + 400 * count
+    response = call_with_limits(lambda prompt=prompt: llm.complete(prompt), tokens=tokens, api_key=openai_key)
+    
+    slots = parse_quiz_slots(response.text)
+    valid = [slot for slot in slots if not isinstance(slot, tuple)]
+    # Годных вопросов хватает — сломанные просто отбрасываем, лишний запрос не нужен
+    if len(valid) >= count:
+        questions = valid[:count]
+    else:
+        questions = repair_questions(slots, count, text, difficulty, lang, llm, openai_key)
+    if not questions:
+        raise Exception("Модель не вернула ни одного корректного вопроса")
+    return Quiz(questions=questions)
+
+# --- ПРОВЕРКА И ПОЧИНКА ОТВЕТА ---
+
+def parse_quiz_slots(raw):
+    """
+    Ответ модели по порядку: QuizQuestion для годных и (объект или строка, причина) для сломанных.
+    Обрезанный JSON, индексы ответа, дубли вариантов и т.п. чинятся без запроса к модели.
+    """
+    slots = []
+    for item in extract_questions(raw):
+        fixed, problem = normalize_question(item)
+        slots.append(QuizQuestion(**fixed) if fixed else (item, problem))
+    return slots
+
+def repair_questions(slots, count, text, difficulty, lang, llm, openai_key=None):
+    """
+    Второй шанс только для проблемных вопросов (см. utils/quiz_repair.repair_slots):
+    разобранные, но нарушающие правила, переписываются без исходного текста и встают
+    на свои места; недостающие догенерируются в нужном количестве.
+    """
+    def ask(prompt, n):
+        try:
+            return call_with_limits(
+                lambda prompt=prompt: llm.complete(prompt).text,
+                tokens=estimate_tokens(prompt) + 400 * n, api_key=openai_key,
+            )
+        except Exception as e:
+            print(f"Warning: question repair request failed: {e}")
+            return None
+    
+    def ask_fix(items):
+        return ask(fix_prompt(items, lang), len(items))
+    
+    def ask_more(n, existing):
+        return ask(_quiz_prompt(text, n, difficulty, lang, [q["scenario"] for q in existing]), n)
+    
+    plain = [slot.model_dump() if isinstance(slot, QuizQuestion) else slot for slot in slots]
+    broken = sum(1 for slot in slots if isinstance(slot, tuple))
+    with span("generate.repair", broken=broken, missing=max(0, count - len(slots))) as s:
+        questions = [QuizQuestion(**q) for q in repair_slots(plain, count, ask_fix, ask_more)]
+        s.set(result_questions=len(questions))
+    return questions
+
+def split_text(text, chunk_tokens=CHUNK_TOKENS):
+    """Режет текст на куски примерно по chunk_tokens токенов, стараясь не рвать абзацы"""
+    max_chars = chunk_tokens * CHARS_PER_TOKEN
+    
+    # Абзацы; слишком длинные (транскрипты без переносов) дорезаем по предложениям
+    pieces = []
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        while len(para) > max_chars:
+            cut = para.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > max_chars // 2 else max_chars
+            pieces.append(para[:cut].strip())
+            para = para[cut:].strip()
+        if para:
+            pieces.append(para)
+    
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def _words(s):
+    return set(re.findall(r"\w+", s.lower()))
+
+def _select_diverse(candidates, count, max_overlap=0.6):
+    """
+    Reduce-шаг без обращения к LLM: берем вопросы по кругу из каждого куска
+    (покрытие всего документа) и пропускаем почти одинаковые по словам.
+    """
+    picked, picked_words = [], []
+    queues = [list(qs) for qs in candidates if qs]
+    
+    while queues and len(picked) < count:
+        next_round = []
+        for queue in queues:
+            if len(picked) >= count:
+                break
+            q = queue.pop(0)
+            words = _words(q.scenario)
+            is_duplicate = any(
+                len(words & other) / max(len(words | other), 1) > max_overlap
+                for other in picked_words
+            )
+            if not is_duplicate:
+                picked.append(q)
+                picked_words.append(words)
+            if queue:
+                next_round.append(queue)
+        queues = next_round
+    
+    return picked
+
+def generate_quiz_ai(text, count, difficulty, lang, mode="auto", openai_key=None, force_fresh=False):
+    """
+    Генерирует JSON с тестом через GPT-4o.
+    mode: "single" — один промпт (в него попадают самые информативные фрагменты
+                    в пределах PROMPT_TOKEN_BUDGET),
+          "chunked" — map-reduce по кускам документа (в пределах CHUNKED_TOKEN_BUDGET),
+          "auto" — chunked только для длинных текстов.
+    openai_key — ключ OpenAI (по умолчанию из OPENAI_API_KEY).
+    Результат кэшируется по (тексту, параметрам, версии промпта);
+    force_fresh=True — сгенерировать заново и перезаписать кэш.
+    """
+    
+    with span("generate", mode=mode, input_chars=len(text)) as generate_span:
+        cache_key = _quiz_cache_key(text, count, difficulty, lang, mode)
+        if not force_fresh:
+            cached = _load_cached_quiz(cache_key)
+            if cached is not None:
+                generate_span.set(cache="hit")
+                return cached
+        
+        generate_span.set(cache="miss")
+        start = time.perf_counter()
+        quiz = _generate_quiz(text, count, difficulty, lang, mode, openai_key)
+        _store_quiz(cache_key, quiz, time.perf_counter() - start)
+        return quiz
+
+def _quiz_cache_key(text, count, difficulty, lang, mode):
+    return ":".join([
+        content_hash(text.encode("utf-8")), str(count), difficulty, lang, mode, QUIZ_PROMPT_VERSION
+    ])
+
+def _load_cached_quiz(cache_key):
+    cached = quiz_cache.get(cache_key)
+    if cached is None:
+        return None
+    entry = json.loads(cached)
+    _quiz_cache_saved["seconds"] += entry.get("seconds", 0)
+    return Quiz.model_validate(entry["quiz"])
+
+def _store_quiz(cache_key, quiz, seconds):
+    quiz_cache.set(cache_key, json.dumps({
+        "quiz": quiz.model_dump(),
+        "seconds": round(seconds, 2),
+    }, ensure_ascii=False))
+
+def quiz_cache_stats():
+    """Попадания/промахи кэша тестов и сэкономленное время GPT (в рамках процесса)"""
+    return {**quiz_cache.stats(), "saved_seconds": round(_quiz_cache_saved["seconds"], 1)}
+
+def _is_chunked(cleaned, mode):
+    """Map-reduce по кускам: явно или для текста, который не влезает в один промпт (auto)"""
+    return mode == "chunked" or (mode == "auto" and len(cleaned) > SINGLE_PROMPT_CHARS)
+
+def _generate_quiz(text, count, difficulty, lang, mode, openai_key):
+    llm = get_llm("gpt-4o", temperature=0.2, api_key=openai_key)
+    # Колонтитулы, номера страниц и повторы не тратят токены ни в одном режиме
+    text = clean_text(text)
+    
+    if not _is_chunked(text, mode):
+        prompt_text = select_passages(text, PROMPT_TOKEN_BUDGET, CHARS_PER_TOKEN, cleaned=True)
+        return _run_quiz_program(prompt_text, count, difficulty, lang, llm, openai_key)
+    
+    # Очень длинный документ сначала ужимаем до CHUNKED_TOKEN_BUDGET лучшими фрагментами
+    text = select_passages(text, CHUNKED_TOKEN_BUDGET, CHARS_PER_TOKEN, cleaned=True)
+    chunks = split_text(text)
+    if len(chunks) == 1:
+        return _run_quiz_program(chunks[0], count, difficulty, lang, llm, openai_key)
+    
+    # Map: кандидаты из каждого куска (с запасом x2 для отбора)
+    per_chunk = min(count, max(2, math.ceil(count * 2 / len(chunks))))
+    candidates = [[] for _ in chunks]
+    with ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS) as pool:
+        futures = {
+            pool.submit(_run_quiz_program, chunk, per_chunk, difficulty, lang, llm, openai_key): idx
+            for idx, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            try:
+                candidates[futures[future]] = future.result().questions
+            except Exception as e:
+                print(f"Warning: chunk {futures[future]} failed: {e}")
     
-    safe_text = text[:50000]
+    if not any(candidates):
+        raise Exception("Не удалось сгенерировать вопросы ни по одному фрагменту")
     
-    program = LLMTextCompletionProgram.from_defaults(
-        output_cls=Quiz,
-        prompt_template_str=system_prompt + "\n\nContent to analyze:\n{text}",
-        llm=Settings.llm
+    # Reduce: выбираем count разнообразных вопросов
+    return Quiz(questions=_select_diverse(candidates, count))
+
+# --- ПОТОКОВАЯ ГЕНЕРАЦИЯ ---
+
+def stream_quiz_ai(text, count, difficulty, lang, mode="auto", openai_key=None, force_fresh=False):
+    """
+    Генератор: отдает QuizQuestion, как только объект вопроса закрылся в потоке токенов.
+    Длинные тексты (map-reduce) потоково не генерируются — вопросы отдаются после reduce.
+    Кэш общий с generate_quiz_ai.
+    """
+    cleaned = clean_text(text)
+    is_long = _is_chunked(cleaned, mode)
+    cache_key = _quiz_cache_key(text, count, difficulty, lang, mode)
+    
+    cached = None if force_fresh else _load_cached_quiz(cache_key)
+    if cached is not None or is_long:
+        # Промах уже учтен при поиске выше — generate_quiz_ai в кэш второй раз не смотрит
+        quiz = cached if cached is not None else generate_quiz_ai(
+            text, count, difficulty, lang, mode, openai_key, force_fresh=True
+        )
+        yield from quiz.questions
+        return
+    
+    start = time.perf_counter()
+    llm = get_llm("gpt-4o", temperature=0.2, api_key=openai_key)
+    prompt_text = select_passages(cleaned, PROMPT_TOKEN_BUDGET, CHARS_PER_TOKEN, cleaned=True)
+    prompt = _quiz_prompt(prompt_text, count, difficulty, lang)
+    
+    def open_stream():
+        # Первый кусок берем внутри лимитера: 429 прилетает именно тут и переотправится
+        stream = iter(llm.stream_complete(prompt))
+        return next(stream, None), stream
+    
+    first, stream = call_with_limits(
+        open_stream, tokens=estimate_tokens(prompt) + 400 * count, api_key=openai_key
     )
     
-    return program(text=safe_text)
+    parser = QuestionStreamParser()
+    questions = []
+    broken = []
+    for response in itertools.chain([first] if first else [], stream):
+        for raw in parser.feed(response.delta or ""):
+            item = loads_lenient(raw) or raw
+            fixed, problem = normalize_question(item)
+            if not fixed:
+                # Чиним после потока одним запросом — пользователь тем временем отвечает на готовые
+                broken.append((item, problem))
+                continue
+            question = QuizQuestion(**fixed)
+            questions.append(question)
+            if len(questions) == 1:
+                # Главная метрика для бота: сколько пользователь ждет первый опрос
+                observe("generate.first_question", time.perf_counter() - start, mode="stream")
+            yield question
+            if len(questions) >= count:
+                break
+        if len(questions) >= count:
+            break
+    
+    # Сломанные и недостающие (ответ оборвался) вопросы — отдельным коротким запросом,
+    # только если годных не хватило до count
+    if len(questions) < count:
+        # Уже отправленные идут первыми — из результата берем только новые
+        repaired = repair_questions(questions + broken, count, prompt_text, difficulty, lang, llm, openai_key)
+        for question in repaired[len(questions):]:
+            questions.append(question)
+            if len(questions) == 1:
+                observe("generate.first_question", time.perf_counter() - start, mode="stream")
+            yield question
+    
+    if not questions:
+        raise Exception("Модель не вернула ни одного вопроса")
+    elapsed = time.perf_counter() - start
+    observe("generate", elapsed, mode="stream", cache="miss", outcome="ok")
+    _store_quiz(cache_key, Quiz(questions=questions), elapsed)
 
-def create_certificate(student_name, course_name, logo_file=None):
-    """Генерирует PDF сертификат"""
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=landscape(letter))
-    width, height = landscape(letter)
+# --- СЕРТИФИКАТЫ ---
+
+def _load_logo(logo_file):
+    """Декодирует логотип один раз; битый файл просто пропускаем"""
+    if not logo_file:
+        return None
+    from reportlab.lib.utils import ImageReader
     
+    try:
+        logo_file.seek(0)
+        return ImageReader(logo_file)
+    except:
+        return None
+
+def _draw_certificate_static(c, width, height, course_name, logo=None):
+    """Все, что одинаково у всех сотрудников: рамка, логотип, тексты, курс, дата"""
     c.setStrokeColorRGB(0.2, 0.2, 0.2)
     c.setLineWidth(5)
     c.rect(30, 30, width-60, height-60)
     
-    if logo_file:
+    if logo:
         try:
-            logo_file.seek(0)
-            logo = ImageReader(logo_file)
             c.drawImage(logo, width/2 - 50, height - 140, width=100, preserveAspectRatio=True, mask='auto')
         except:
             pass
@@ -184,9 +634,6 @@ def create_certificate(student_name, course_name, logo_file=None):
     c.drawCentredString(width/2, height/2, "OF COMPLETION")
     c.setFont("Helvetica", 16)
     c.drawCentredString(width/2, height/2 - 30, "This is to certify that")
-    c.setFont("Helvetica-Bold", 30)
-    c.drawCentredString(width/2, height/2 - 70, student_name)
-    c.setFont("Helvetica", 16)
     c.drawCentredString(width/2, height/2 - 100, "has successfully completed the course")
     c.setFont("Helvetica-Bold", 20)
     c.drawCentredString(width/2, height/2 - 130, course_name)
@@ -195,111 +642,281 @@ def create_certificate(student_name, course_name, logo_file=None):
     c.setFont("Helvetica", 12)
     c.drawString(50, 50, f"Date: {date_str}")
     c.drawRightString(width-50, 50, "Authorized by Vyud AI")
+
+def _draw_certificate_name(c, width, height, student_name):
+    c.setFont("Helvetica-Bold", 30)
+    c.drawCentredString(width/2, height/2 - 70, student_name)
+
+def create_certificate(student_name, course_name, logo_file=None):
+    """Генерирует PDF сертификат"""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter, landscape
+    
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=landscape(letter))
+    width, height = landscape(letter)
+    
+    _draw_certificate_static(c, width, height, course_name, _load_logo(logo_file))
+    _draw_certificate_name(c, width, height, student_name)
     
     c.save()
     buffer.seek(0)
     return buffer
 
-def create_html_quiz(quiz, course_title):
-    """Генерирует интерактивный HTML файл с тестом"""
-    correct_indices = []
-    for q in quiz.questions:
-        safe_id = q.correct_option_id
-        if not q.options:
-            correct_indices.append(0)
-            continue
-        if safe_id >= len(q.options) or safe_id < 0: safe_id = 0
-        correct_indices.append(safe_id)
-
-    html = f"""
+def read_names_csv(csv_file):
+    """
+    Достает список имен из CSV (путь, поток байт или UploadedFile).
+    Берется колонка name/имя/фио, если есть заголовок, иначе первая колонка.
+    """
+    if isinstance(csv_file, (str, os.PathLike)):
+        with open(csv_file, "rb") as f:
+            raw = f.read()
+    else:
+        csv_file.seek(0)
+        raw = csv_file.read()
+    content = raw.decode("utf-8-sig") if isinstance(raw, bytes) else raw
+    
+    try:
+        dialect = csv.Sniffer().sniff(content[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(content), dialect) if row and any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    
+    column = 0
+    header = [cell.strip().lower() for cell in rows[0]]
+    for key in ("name", "full name", "имя", "фио"):
+        if key in header:
+            column = header.index(key)
+            rows = rows[1:]
+            break
+    
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+def _certificate_filename(student_name, used):
+    base = re.sub(r"[^\w\- ]+", "", student_name).strip().replace(" ", "_") or "certificate"
+    filename = f"{base}.pdf"
+    n = 2
+    while filename in used:
+        filename = f"{base}_{n}.pdf"
+        n += 1
+    used.add(filename)
+    return filename
+
+def create_certificates_batch(names, course_name, logo_file=None, output="pdf", out=None):
+    """
+    Сертификаты для целого списка сотрудников.
+    output="pdf" — один многостраничный PDF: фон рисуется один раз как form XObject,
+                   каждая страница добавляет только имя.
+    output="zip" — ZIP с отдельным PDF на каждого; пишется в out потоком
+                   (подойдет и файл, и несикабельный поток ответа).
+    names — список строк или CSV-файл (см. read_names_csv).
+    """
+    if not isinstance(names, (list, tuple)):
+        names = read_names_csv(names)
+    
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter, landscape
+    
+    out = out if out is not None else io.BytesIO()
+    width, height = landscape(letter)
+    logo = _load_logo(logo_file)
+    
+    if output == "pdf":
+        c = canvas.Canvas(out, pagesize=landscape(letter))
+        c.beginForm("certificate_static")
+        _draw_certificate_static(c, width, height, course_name, logo)
+        c.endForm()
+        for student_name in names:
+            c.doForm("certificate_static")
+            _draw_certificate_name(c, width, height, student_name)
+            c.showPage()
+        c.save()
+    
+    elif output == "zip":
+        used = set()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+            for student_name in names:
+                page = io.BytesIO()
+                c = canvas.Canvas(page, pagesize=landscape(letter))
+                _draw_certificate_static(c, width, height, course_name, logo)
+                _draw_certificate_name(c, width, height, student_name)
+                c.save()
+                archive.writestr(_certificate_filename(student_name, used), page.getvalue())
+    
+    else:
+        raise ValueError(f"Неизвестный формат: {output}")
+    
+    if out.seekable():
+        out.seek(0)
+    return out
+
+# --- HTML ЭКСПОРТ ---
+# Шаблоны готовятся один раз при импорте; все данные экранируются при подстановке.
+# Шапка и подвал — string.Template (в CSS и JS много фигурных скобок), вопросы — str.format:
+# их тысячи, а Template.substitute на каждый вариант ответа в разы медленнее
+
+_HTML_HEAD = """
     <!DOCTYPE html>
     <html lang="ru">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Тест: {course_title}</title>
+        <title>Тест: $title</title>
         <style>
-            body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; background: #f4f4f9; color: #333; }}
-            .container {{ background: white; padding: 40px; border-radius: 12px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }}
-            h1 {{ text-align: center; color: #2c3e50; margin-bottom: 30px; }}
-            .question {{ margin-bottom: 30px; border-bottom: 1px solid #eee; padding-bottom: 20px; }}
-            .question h3 {{ margin-bottom: 15px; font-weight: 600; }}
-            .options label {{ display: block; margin: 8px 0; padding: 12px; border: 1px solid #ddd; border-radius: 8px; cursor: pointer; transition: all 0.2s; }}
-            .options label:hover {{ background: #f8f9fa; border-color: #adb5bd; }}
-            .options input {{ margin-right: 10px; }}
-            .btn {{ display: block; width: 100%; padding: 15px; background: #4F46E5; color: white; border: none; border-radius: 8px; font-size: 18px; font-weight: bold; cursor: pointer; margin-top: 30px; transition: background 0.3s; }}
-            .btn:hover {{ background: #4338ca; }}
-            .feedback {{ margin-top: 15px; padding: 15px; border-radius: 8px; display: none; line-height: 1.5; }}
-            .correct {{ background: #d1fae5; color: #065f46; border: 1px solid #a7f3d0; }}
-            .wrong {{ background: #fee2e2; color: #991b1b; border: 1px solid #fecaca; }}
+            body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; background: #f4f4f9; color: #333; }
+            .container { background: white; padding: 40px; border-radius: 12px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }
+            h1 { text-align: center; color: #2c3e50; margin-bottom: 30px; }
+            h2 { color: #4F46E5; margin: 40px 0 20px; }
+            .question { margin-bottom: 30px; border-bottom: 1px solid #eee; padding-bottom: 20px; }
+            .question h3 { margin-bottom: 15px; font-weight: 600; }
+            .options label { display: block; margin: 8px 0; padding: 12px; border: 1px solid #ddd; border-radius: 8px; cursor: pointer; transition: all 0.2s; }
+            .options label:hover { background: #f8f9fa; border-color: #adb5bd; }
+            .options input { margin-right: 10px; }
+            .btn { display: block; width: 100%; padding: 15px; background: #4F46E5; color: white; border: none; border-radius: 8px; font-size: 18px; font-weight: bold; cursor: pointer; margin-top: 30px; transition: background 0.3s; }
+            .btn:hover { background: #4338ca; }
+            .feedback { margin-top: 15px; padding: 15px; border-radius: 8px; display: none; line-height: 1.5; }
+            .correct { background: #d1fae5; color: #065f46; border: 1px solid #a7f3d0; }
+            .wrong { background: #fee2e2; color: #991b1b; border: 1px solid #fecaca; }
         </style>
     </head>
     <body>
         <div class="container">
-            <h1>🎓 {course_title}</h1>
+            <h1>🎓 $title</h1>
             <form id="quizForm">
-    """
-    
-    for i, q in enumerate(quiz.questions):
-        html += f"""
+"""
+
+_HTML_SECTION = """
+            <h2>{section}</h2>
+"""
+
+_HTML_QUESTION = """
         <div class="question" id="q{i}">
-            <h3>{i+1}. {q.scenario}</h3>
+            <h3>{number}. {scenario}</h3>
             <div class="options">
-        """
-        for j, opt in enumerate(q.options):
-            html += f"""<label><input type="radio" name="q{i}" value="{j}"> {opt}</label>"""
-        
-        html += f"""
+{options}
             </div>
             <div id="feedback-{i}" class="feedback">
-                <strong>Правильный ответ:</strong> {q.options[correct_indices[i]]}<br><br>
-                <em>{q.explanation}</em>
+                <strong>Правильный ответ:</strong> {answer}<br><br>
+                <em>{explanation}</em>
             </div>
         </div>
-        """
+"""
+
+_HTML_OPTION = """<label><input type="radio" name="q{i}" value="{j}"> {option}</label>"""
 
-    html += f"""
+_HTML_FOOTER = """
             <button type="button" class="btn" onclick="checkAnswers()">Проверить результаты</button>
         </form>
     </div>
     <script>
-        const correctAnswers = {correct_indices};
-        function checkAnswers() {{
+        const correctAnswers = $answers;
+        function checkAnswers() {
             let score = 0;
-            correctAnswers.forEach((correct, index) => {{
+            correctAnswers.forEach((correct, index) => {
                 const feedback = document.getElementById('feedback-' + index);
                 const options = document.getElementsByName('q' + index);
                 let selected = -1;
                 
-                options.forEach(opt => {{
+                options.forEach(opt => {
                     if (opt.checked) selected = parseInt(opt.value);
                     opt.disabled = true;
-                }});
+                });
                 
                 feedback.style.display = 'block';
                 
-                if (selected === correct) {{
+                if (selected === correct) {
                     score++;
                     feedback.className = 'feedback correct';
                     feedback.innerHTML = '✅ <strong>Верно!</strong><br>' + feedback.innerHTML;
-                }} else {{
+                } else {
                     feedback.className = 'feedback wrong';
                     feedback.innerHTML = '❌ <strong>Ошибка.</strong><br>' + feedback.innerHTML;
-                }}
-            }});
+                }
+            });
             
             window.scrollTo(0, 0);
-            alert(`Ваш результат: ${{score}} из ${{correctAnswers.length}}`);
-        }}
+            alert(`Ваш результат: $${score} из $${correctAnswers.length}`);
+        }
     </script>
     </body>
     </html>
+"""
+
+def _minify_html(template_str):
+    # Убираем отступы и пустые строки; переводы строк оставляем, чтобы не сломать JS
+    lines = (line.strip() for line in template_str.splitlines())
+    return "\n".join(line for line in lines if line) + "\n"
+
+def _compile_html_templates(minify):
+    prepare = _minify_html if minify else (lambda t: t)
+    return {
+        "head": Template(prepare(_HTML_HEAD)),
+        "section": prepare(_HTML_SECTION),
+        "question": prepare(_HTML_QUESTION),
+        "option": _HTML_OPTION,
+        "option_sep": "\n" if minify else "",   # в сжатом виде — вариант на строку
+        "footer": Template(prepare(_HTML_FOOTER)),
+    }
+
+_HTML_TEMPLATES = {False: _compile_html_templates(False), True: _compile_html_templates(True)}
+
+def iter_html_quiz(quizzes, course_title, minify=False):
     """
-    return html.encode('utf-8')
+    Генератор кусков HTML (str). Работает за линейное время от числа вопросов.
+    quizzes — один Quiz или список Quiz (каждый станет отдельной частью файла).
+    """
+    if isinstance(quizzes, Quiz):
+        quizzes = [quizzes]
+    t = _HTML_TEMPLATES[minify]
+    esc = html_lib.escape
+    question_html, option_html, option_sep = t["question"].format, t["option"].format, t["option_sep"]
+    
+    yield t["head"].substitute(title=esc(str(course_title)))
+    
+    correct_indices = []
+    i = 0
+    for part, quiz in enumerate(quizzes, start=1):
+        if len(quizzes) > 1:
+            yield t["section"].format(section=f"Часть {part}")
+        for q in quiz.questions:
+            correct = q.correct_option_id
+            correct_indices.append(correct)
+            
+            # Один кусок на вопрос: варианты склеиваются join-ом, шаблон форматируется один раз
+            yield question_html(
+                i=i,
+                number=i + 1,
+                scenario=esc(q.scenario),
+                options=option_sep.join([option_html(i=i, j=j, option=esc(opt)) for j, opt in enumerate(q.options)]),
+                answer=esc(q.options[correct]),
+                explanation=esc(q.explanation),
+            )
+            i += 1
+    
+    # Только числа, но сериализуем через json — так безопасно вставлять в <script>
+    yield t["footer"].substitute(answers=json.dumps(correct_indices))
+
+def write_html_quiz(stream, quizzes, course_title, minify=False, compress=False):
+    """Пишет HTML в бинарный поток по кускам; compress=True — сразу в gzip"""
+    target = gzip.GzipFile(fileobj=stream, mode="wb") if compress else stream
+    try:
+        for chunk in iter_html_quiz(quizzes, course_title, minify):
+            target.write(chunk.encode("utf-8"))
+    finally:
+        if compress:
+            target.close()
+
+def create_html_quiz(quiz, course_title, minify=False, compress=False):
+    """Генерирует интерактивный HTML файл с тестом (bytes; gzip, если compress=True)"""
+    buffer = io.BytesIO()
+    write_html_quiz(buffer, quiz, course_title, minify, compress)
+    return buffer.getvalue()
 
-def generate_marketing_post(topic, platform, tone, extra_context=""):
+def generate_marketing_post(topic, platform, tone, extra_context="", openai_key=None):
     """Генерирует маркетинговый пост"""
-    Settings.llm = OpenAI(model="gpt-4o", temperature=0.7)
+    llm = get_llm("gpt-4o", temperature=0.7, api_key=openai_key)
     
     product_info = (
         "Product: Vyud AI.\n"
@@ -323,4 +940,8 @@ def generate_marketing_post(topic, platform, tone, extra_context=""):
         f"4. Language: RUSSIAN.\n"
     )
     
-    return Settings.llm.complete(system_prompt).text
\ No newline at end of file
+    return call_with_limits(
+        lambda: llm.complete(system_prompt).text,
+        tokens=estimate_tokens(system_prompt) + 800,
+        api_key=openai_key
+    )
\ No newline at end of file
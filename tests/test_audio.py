@@ -0,0 +1,32 @@
+from utils import audio
+from utils.audio import merge_overlap, plan_segments, split_audio
+
+
+def test_short_audio_is_one_segment():
+    assert plan_segments(300.0, [(100.0, 102.0)]) == [(0.0, 300.0)]
+
+
+def test_cut_at_nearest_pause_with_overlap():
+    # Пауза в 590–592 с ближе к границе 600, чем 620–622; 700–702 вне окна поиска
+    segments = plan_segments(1000.0, [(590.0, 592.0), (620.0, 622.0), (700.0, 702.0)],
+                             segment_s=600, overlap_s=3, window_s=30)
+    assert segments == [(0.0, 594.0), (591.0, 1000.0)]
+
+
+def test_cut_exactly_at_boundary_without_pauses():
+    assert plan_segments(1300.0, segment_s=600, overlap_s=3) == [(0.0, 603.0), (600.0, 1203.0), (1200.0, 1300.0)]
+
+
+def test_merge_overlap_drops_repeated_words():
+    assert merge_overlap("раз два три четыре", "Три, четыре пять") == "раз два три четыре пять"
+
+
+def test_short_audio_is_not_probed_again(tmp_path, monkeypatch):
+    path = tmp_path / "voice.mp3"
+    path.write_bytes(b"\0" * 1024)
+
+    def fail(path):
+        raise AssertionError("длительность уже известна из probe()")
+
+    monkeypatch.setattr(audio, "_duration_seconds", fail)
+    assert split_audio(str(path), duration=60.0) == [str(path)]
@@ -0,0 +1,57 @@
+import codecs
+import zipfile
+
+import pytest
+
+from utils.extractors import extract_local, extract_xlsx
+
+SHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+
+def make_xlsx(path, sheets, shared=None):
+    with zipfile.ZipFile(path, "w") as archive:
+        if shared is not None:
+            items = "".join(f"<si><t>{s}</t></si>" for s in shared)
+            archive.writestr("xl/sharedStrings.xml", f'<sst xmlns="{SHEET_NS}">{items}</sst>')
+        for n, rows in enumerate(sheets, 1):
+            archive.writestr(
+                f"xl/worksheets/sheet{n}.xml",
+                f'<worksheet xmlns="{SHEET_NS}"><sheetData>{rows}</sheetData></worksheet>',
+            )
+
+
+def test_xlsx_reads_shared_and_inline_strings(tmp_path):
+    path = tmp_path / "book.xlsx"
+    make_xlsx(path, [
+        '<row><c t="s"><v>0</v></c><c t="inlineStr"><is><t>инлайн</t></is></c><c><v>42</v></c></row>',
+    ], shared=["общая строка"])
+    assert extract_xlsx(str(path)) == "## Лист 1\nобщая строка | инлайн | 42"
+
+
+def test_xlsx_empty_sheet_falls_back(tmp_path):
+    path = tmp_path / "empty.xlsx"
+    make_xlsx(path, [""])
+    assert extract_local(str(path), ".xlsx") is None
+
+
+def test_xlsx_dangling_shared_string_falls_back(tmp_path):
+    # Ссылка на строку, которой нет в sharedStrings (или нет самого файла), — не ошибка, а уход в LlamaParse
+    path = tmp_path / "broken.xlsx"
+    make_xlsx(path, ["", '<row><c t="s"><v>3</v></c></row>'])
+    assert extract_local(str(path), ".xlsx") is None
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-16-be", "utf-8-sig", "cp1251"])
+def test_text_file_encodings(tmp_path, encoding):
+    path = tmp_path / "notes.txt"
+    data = "Привет, мир".encode(encoding)
+    if encoding == "utf-16-be":
+        data = codecs.BOM_UTF16_BE + data
+    path.write_bytes(data)
+    assert extract_local(str(path)) == "Привет, мир"
+
+
+def test_binary_text_file_falls_back(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes("Привет".encode("utf-32"))
+    assert extract_local(str(path)) is None
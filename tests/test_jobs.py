@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.jobs import JobScheduler, QueueFull, iterate_in_thread
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_users_are_served_round_robin():
+    async def main():
+        scheduler = JobScheduler(workers=1, max_per_user=5)
+        gate = asyncio.Event()
+        order = []
+
+        async def blocker():
+            await gate.wait()
+
+        def job(name):
+            async def func():
+                order.append(name)
+            return func
+
+        # Единственный воркер занят — остальные задачи копятся в очереди
+        await scheduler.submit("x", blocker)
+        await asyncio.sleep(0)
+        jobs = [await scheduler.submit(user, job(f"{user}{n}")) for user, n in
+                (("a", 1), ("a", 2), ("a", 3), ("b", 1), ("c", 1))]
+        assert [scheduler.position(j) for j in jobs] == [1, 4, 5, 2, 3]
+        gate.set()
+        await asyncio.gather(*(j.future for j in jobs))
+        await scheduler.stop()
+        return order
+
+    assert run(main()) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_backpressure_limits_queue_and_user():
+    async def main():
+        scheduler = JobScheduler(workers=1, max_queue=2, max_per_user=2)
+        gate = asyncio.Event()
+
+        async def wait():
+            await gate.wait()
+
+        await scheduler.submit("a", wait)
+        await asyncio.sleep(0)
+        await scheduler.submit("a", wait)
+        with pytest.raises(QueueFull, match="одного пользователя"):
+            await scheduler.submit("a", wait)
+        await scheduler.submit("b", wait)
+        with pytest.raises(QueueFull, match="переполнена"):
+            await scheduler.submit("c", wait)
+        assert scheduler.pending == 2
+        gate.set()
+        await scheduler.stop()
+
+    run(main())
+
+
+def test_job_error_goes_to_future():
+    async def main():
+        scheduler = JobScheduler(workers=1)
+
+        async def fail():
+            raise ValueError("boom")
+
+        job = await scheduler.submit("a", fail)
+        with pytest.raises(ValueError):
+            await job.future
+        await scheduler.stop()
+
+    run(main())
+
+
+def test_async_stage_limit():
+    async def main():
+        scheduler = JobScheduler(stage_limits={"generate": 2})
+        running = peak = 0
+
+        async def work():
+            nonlocal running, peak
+            async with scheduler.stage("generate"):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        return peak
+
+    assert run(main()) == 2
+
+
+def test_blocking_stage_limit():
+    scheduler = JobScheduler(stage_limits={"transcode": 2})
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work():
+        with scheduler.blocking_stage("transcode"):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+
+
+def test_iterate_in_thread_streams_items():
+    def numbers():
+        yield from range(3)
+
+    async def main():
+        return [n async for n in iterate_in_thread(numbers)]
+
+    assert run(main()) == [0, 1, 2]
@@ -0,0 +1,49 @@
+import threading
+
+from utils.ledger import CreditLedger, MemoryCreditsStore
+
+
+class LockCheckingStore(MemoryCreditsStore):
+    """Хранилище, которое проверяет, что леджер не держит блокировку во время запроса"""
+
+    def __init__(self, initial=None):
+        super().__init__(initial)
+        self.ledger = None
+        self.locked_calls = 0
+
+    def fetch(self, email):
+        # RLock отпускает только владелец — пробуем взять ее из другого потока
+        acquired = []
+
+        def probe():
+            acquired.append(self.ledger._lock.acquire(timeout=0.2))
+            if acquired[0]:
+                self.ledger._lock.release()
+
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        if not acquired[0]:
+            self.locked_calls += 1
+        return super().fetch(email)
+
+
+def make_ledger(credits):
+    store = LockCheckingStore({"a@b": credits})
+    ledger = CreditLedger(store, flush_interval=60)
+    store.ledger = ledger
+    return ledger, store
+
+
+def test_deferred_charge_does_not_hold_lock_during_fetch():
+    ledger, store = make_ledger(3)
+    assert ledger.charge_deferred("a@b")
+    assert store.calls == 1 and store.locked_calls == 0
+
+
+def test_deferred_charges_stop_at_balance_and_flush():
+    ledger, store = make_ledger(2)
+    assert [ledger.charge_deferred("a@b") for _ in range(3)] == [True, True, False]
+    ledger.flush()
+    assert store.rows["a@b"] == 0
+    assert ledger.balance("a@b") == 0
@@ -0,0 +1,127 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+logic = pytest.importorskip("logic")
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ("a.txt", "b.txt", "c.txt"):
+        path = tmp_path / name
+        path.write_text(name, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def fake_extract(source, *args):
+    if source.endswith("b.txt"):
+        raise ValueError("битый файл")
+    return f"текст {source[-5:]}"
+
+
+def test_failed_file_is_reported_with_partial_text(monkeypatch, files):
+    monkeypatch.setattr(logic, "process_file_to_text", fake_extract)
+    text, failed = logic.process_files_to_text(files, None, None, names=["a.txt", "b.txt", "c.txt"])
+    assert failed == ["b.txt"]
+    assert "## Источник: a.txt" in text and "## Источник: c.txt" in text
+    assert "b.txt" not in text
+
+
+def test_all_files_failed_raises(monkeypatch, files):
+    def broken(*args):
+        raise ValueError("битый файл")
+
+    monkeypatch.setattr(logic, "process_file_to_text", broken)
+    with pytest.raises(Exception, match="ни из одного файла"):
+        logic.process_files_to_text(files, None, None)
+
+
+def test_stream_counts_one_cache_miss_per_lookup(monkeypatch, tmp_path):
+    from utils.cache import DiskCache
+
+    cache = DiskCache(namespace="quiz", path=tmp_path / "cache.sqlite")
+    quiz = logic.Quiz(questions=[logic.QuizQuestion(
+        scenario="Вопрос?", options=["да", "нет"], correct_option_id=0, explanation="Потому что."
+    )])
+    monkeypatch.setattr(logic, "quiz_cache", cache)
+    monkeypatch.setattr(logic, "_generate_quiz", lambda *args: quiz)
+
+    assert list(logic.stream_quiz_ai("текст", 1, "Medium", "Russian", mode="chunked")) == quiz.questions
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert list(logic.stream_quiz_ai("текст", 1, "Medium", "Russian", mode="chunked")) == quiz.questions
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+class FakeLLM:
+    """Отвечает заранее заданными текстами и записывает вызовы"""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def complete(self, prompt):
+        self.calls.append("complete")
+        return SimpleNamespace(text=self.answers.pop(0))
+
+    def stream_complete(self, prompt):
+        self.calls.append("stream")
+        text = self.answers.pop(0)
+        for i in range(0, len(text), 40):
+            yield SimpleNamespace(delta=text[i:i + 40])
+
+
+def quiz_json(valid, broken=0):
+    questions = [
+        {"scenario": f"Вопрос {i}?", "options": ["да", "нет"], "correct_option_id": 0, "explanation": "."}
+        for i in range(valid)
+    ]
+    questions[1:1] = [{"scenario": "Сломан?", "options": ["да"], "correct_option_id": 0}] * broken
+    return json.dumps({"questions": questions}, ensure_ascii=False)
+
+
+@pytest.fixture
+def no_limits(monkeypatch, tmp_path):
+    from utils.cache import DiskCache
+
+    monkeypatch.setattr(logic, "call_with_limits", lambda fn, **kwargs: fn())
+    monkeypatch.setattr(logic, "quiz_cache", DiskCache(namespace="quiz", path=tmp_path / "cache.sqlite"))
+
+
+def test_broken_question_is_not_repaired_when_enough_are_valid(no_limits):
+    llm = FakeLLM(quiz_json(3, broken=1))
+    quiz = logic._run_quiz_program("текст", 3, "Medium", "Russian", llm)
+    assert llm.calls == ["complete"]
+    assert [q.scenario for q in quiz.questions] == ["Вопрос 0?", "Вопрос 1?", "Вопрос 2?"]
+
+
+def test_stream_skips_repair_after_count_questions(no_limits, monkeypatch):
+    llm = FakeLLM(quiz_json(3, broken=1))
+    monkeypatch.setattr(logic, "get_llm", lambda *args, **kwargs: llm)
+    questions = list(logic.stream_quiz_ai("текст", 3, "Medium", "Russian", mode="single"))
+    assert llm.calls == ["stream"]
+    assert len(questions) == 3
+
+
+def test_chunked_generation_is_capped_by_budget(no_limits, monkeypatch):
+    import random
+
+    rng = random.Random(1)
+    words = [f"термин{i}" for i in range(5000)]
+    # ~1 МБ разных абзацев: без бюджета это ~40 кусков по CHUNK_TOKENS
+    text = "\n\n".join(" ".join(rng.choice(words) for _ in range(60)) + "." for _ in range(2500))
+    calls = []
+
+    def fake_program(chunk, count, *args):
+        calls.append(len(chunk))
+        return logic.Quiz(questions=[logic.QuizQuestion(
+            scenario=f"Вопрос {len(calls)}?", options=["да", "нет"], correct_option_id=0, explanation="."
+        )])
+
+    monkeypatch.setattr(logic, "get_llm", lambda *args, **kwargs: None)
+    monkeypatch.setattr(logic, "_run_quiz_program", fake_program)
+    logic._generate_quiz(text, 5, "Medium", "Russian", "auto", None)
+    assert len(calls) <= logic.CHUNKED_TOKEN_BUDGET // logic.CHUNK_TOKENS + 1
+    assert sum(calls) <= logic.CHUNKED_TOKEN_BUDGET * logic.CHARS_PER_TOKEN
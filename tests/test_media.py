@@ -0,0 +1,33 @@
+import io
+
+from utils.media import is_media, sniff
+
+
+def test_sniff_known_signatures():
+    assert sniff(io.BytesIO(b"OggS\x00\x02" + b"\x00" * 10)) == "ogg"
+    assert sniff(io.BytesIO(b"\x00\x00\x00\x18ftypM4A " + b"\x00" * 4)) == "mp4"
+    assert sniff(io.BytesIO(b"ID3\x03\x00")) == "mp3"
+    assert sniff(io.BytesIO(b"\xff\xfb\x90\x64" + b"\x00" * 12)) == "mp3"   # MPEG-1 Layer III, 128 кбит/с
+    assert sniff(io.BytesIO(b"\xff\xf1\x50\x80")) == "aac"
+    assert sniff(io.BytesIO(b"%PDF-1.7")) == "pdf"
+
+
+def test_utf16_text_is_not_mp3(tmp_path):
+    for encoding, name in (("utf-16-le", "notes.txt"), ("utf-16-be", "roster.csv"), ("utf-8-sig", "notes.md")):
+        bom = {"utf-16-le": b"\xff\xfe", "utf-16-be": b"\xfe\xff", "utf-8-sig": b""}[encoding]
+        path = tmp_path / name
+        path.write_bytes(bom + "Политика безопасности\n".encode(encoding))
+        assert sniff(str(path)) == "text"
+        assert not is_media(str(path), name)
+
+
+def test_invalid_frame_header_is_not_mp3():
+    # Sync есть, но битрейт «1111» недопустим — это не кадр MPEG
+    assert sniff(io.BytesIO(b"\xff\xfb\xf0\x00")) is None
+
+
+def test_stream_position_is_kept():
+    stream = io.BytesIO(b"OggS" + b"\x00" * 20)
+    stream.seek(0)
+    assert is_media(stream, "voice")
+    assert stream.tell() == 0
@@ -0,0 +1,24 @@
+import pytest
+
+from utils import metrics
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_unknown_extensions_share_one_label():
+    assert metrics.ext_label(".PDF") == ".pdf"
+    assert metrics.ext_label(".exe") == metrics.ext_label("") == metrics.ext_label(None) == "other"
+
+
+def test_span_numbers_become_counters(enabled):
+    with metrics.span("openai", kind="chat", estimated_tokens=120):
+        pass
+    text = metrics.render_prometheus()
+    assert 'vyud_stage_estimated_tokens_total{stage="openai",kind="chat"} 120' in text
+    assert 'vyud_stage_seconds_count{stage="openai",kind="chat",outcome="ok"} 1' in text
@@ -0,0 +1,36 @@
+from utils import passages
+from utils.passages import clean_text, select_passages
+
+PAGE = "Отчет ООО «Ромашка»\n\n{body}\n\nСтраница {n}"
+
+
+TOPICS = [
+    "Сотрудник сообщает о фишинговом письме в службу безопасности.",
+    "Пароли меняются раз в квартал и не записываются на бумаге.",
+    "Посетители проходят в офис только с гостевым пропуском.",
+    "Ноутбук блокируется, когда сотрудник отходит от рабочего места.",
+    "Флешки из неизвестных источников к компьютеру не подключаются.",
+    "Конфиденциальные документы уничтожаются в шредере.",
+]
+
+
+def document():
+    return "\n\n".join(PAGE.format(n=n, body=f"Раздел {n}. {topic}") for n, topic in enumerate(TOPICS, start=1))
+
+
+def test_clean_text_drops_repeated_headers():
+    cleaned = clean_text(document())
+    assert "Ромашка" not in cleaned and "Раздел 3." in cleaned
+
+
+def test_select_passages_on_cleaned_text_does_not_clean_again(monkeypatch):
+    text = document()
+    cleaned = clean_text(text)
+    expected = select_passages(text, 10_000)
+
+    def fail(*args):
+        raise AssertionError("текст чистится второй раз")
+
+    monkeypatch.setattr(passages, "strip_boilerplate", fail)
+    monkeypatch.setattr(passages, "dedupe_passages", fail)
+    assert select_passages(cleaned, 10_000, cleaned=True) == expected
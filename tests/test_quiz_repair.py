@@ -0,0 +1,77 @@
+import json
+
+from utils.quiz_repair import extract_questions, normalize_question, repair_slots
+
+
+def question(name, correct=0):
+    return {"scenario": f"Вопрос {name}?", "options": ["да", "нет", "не знаю"], "correct_option_id": correct,
+            "explanation": f"Пояснение {name}."}
+
+
+def slot(item):
+    fixed, problem = normalize_question(item)
+    return fixed if fixed else (item, problem)
+
+
+def answer(*questions):
+    return json.dumps({"questions": list(questions)}, ensure_ascii=False)
+
+
+def test_truncated_answer_keeps_closed_questions():
+    raw = answer(question(1), question(2))[:-30]
+    items = extract_questions(raw)
+    assert [normalize_question(item)[0]["scenario"] for item in items] == ["Вопрос 1?"]
+
+
+def test_index_and_labels_are_fixed_locally():
+    fixed, problem = normalize_question(
+        {"question": "Q?", "answers": ["A) один", "B) два", "C) три"], "correct": "B"}
+    )
+    assert problem is None
+    assert fixed["options"] == ["один", "два", "три"] and fixed["correct_option_id"] == 1
+
+
+def test_partial_repair_replaces_only_fixed_questions_in_place():
+    # 1-й и 3-й сломанные починены, 2-й остался сломанным — он выпадает, остальные на своих местах
+    too_long = "Очень длинный вопрос " * 20
+    broken = [
+        {"scenario": too_long + "1", "options": ["x"], "correct_option_id": 0},
+        {"scenario": too_long + "2", "options": ["x"], "correct_option_id": 0},
+        {"scenario": too_long + "3", "options": ["x"], "correct_option_id": 0},
+    ]
+    slots = [slot(question("A")), slot(broken[0]), slot(question("B")), slot(broken[1]), slot(broken[2])]
+    asked = {}
+
+    def ask_fix(items):
+        asked["ids"] = list(items)
+        # Модель вернула починенные вопросы не по порядку, второй так и не починила
+        return answer(
+            {"id": 4, **question("fixed-3")},
+            {"id": 3, "scenario": "Все еще сломан", "options": ["x"], "correct_option_id": 0},
+            {"id": 1, **question("fixed-1")},
+        )
+
+    result = repair_slots(slots, 5, ask_fix, lambda n, existing: None)
+
+    assert asked["ids"] == [1, 3, 4]
+    assert [q["scenario"] for q in result] == ["Вопрос A?", "Вопрос fixed-1?", "Вопрос B?", "Вопрос fixed-3?"]
+
+
+def test_positional_match_requires_same_count():
+    broken = {"scenario": "Q?", "options": ["x"], "correct_option_id": 0}
+    slots = [slot(broken), slot(dict(broken, scenario="R?"))]
+    # Ответ без id и с одним вопросом из двух — непонятно, какой это, не берем ни один
+    result = repair_slots(slots, 2, lambda items: answer(question("?")), lambda n, existing: None)
+    assert result == []
+
+
+def test_missing_questions_are_requested_once_and_appended():
+    calls = []
+
+    def ask_more(n, existing):
+        calls.append((n, [q["scenario"] for q in existing]))
+        return answer(question("extra-1"), question("extra-2"), question("extra-3"))
+
+    result = repair_slots([slot(question("A"))], 3, lambda items: None, ask_more)
+    assert calls == [(2, ["Вопрос A?"])]
+    assert [q["scenario"] for q in result] == ["Вопрос A?", "Вопрос extra-1?", "Вопрос extra-2?"]
@@ -0,0 +1,26 @@
+import asyncio
+
+from utils.sender import MessageSender
+
+
+def test_drain_waits_for_one_chat():
+    async def main():
+        sender = MessageSender(chat_burst=10)
+        sent = []
+        slow = asyncio.Event()
+
+        async def send(chat, text, wait=None):
+            if wait:
+                await wait.wait()
+            sent.append((chat, text))
+
+        for n in range(3):
+            sender.submit(1, lambda n=n: send(1, n))
+        sender.submit(2, lambda: send(2, "slow", slow))
+        await asyncio.wait_for(sender.drain(1), timeout=1)
+        assert sent == [(1, 0), (1, 1), (1, 2)]
+        slow.set()
+        await sender.drain()
+        assert sent[-1] == (2, "slow")
+
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_follower_replays_items_from_the_start():
+    async def main():
+        flights = SingleFlight()
+        step = asyncio.Event()
+        runs = []
+
+        async def produce():
+            runs.append(1)
+            yield 1
+            await step.wait()
+            yield 2
+
+        leader, shared = flights.stream("k", produce)
+        assert not shared
+        first = await leader.__anext__()
+        follower, shared = flights.stream("k", produce)
+        assert shared and flights.running("k")
+        step.set()
+        rest, replay = await asyncio.gather(collect(leader), collect(follower))
+        assert [first] + rest == [1, 2] and replay == [1, 2]
+        assert runs == [1] and not flights.running("k")
+
+    asyncio.run(main())
+
+
+def test_error_reaches_every_subscriber():
+    async def main():
+        flights = SingleFlight()
+
+        async def produce():
+            yield 1
+            raise ValueError("boom")
+
+        streams = [flights.stream("k", produce)[0] for _ in range(3)]
+        results = await asyncio.gather(*(collect(s) for s in streams), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert not flights.running("k")
+
+    asyncio.run(main())
+
+
+def test_leader_cancellation_reaches_followers():
+    async def main():
+        flights = SingleFlight()
+
+        async def produce():
+            yield 1
+            await asyncio.sleep(10)
+            yield 2
+
+        stream, _ = flights.stream("k", produce)
+        follower = asyncio.create_task(collect(stream))
+        await asyncio.sleep(0.01)
+        flights._flights["k"].task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(follower, timeout=1)
+        assert not flights.running("k")
+
+    asyncio.run(main())
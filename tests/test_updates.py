@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from utils import updates
+from utils.updates import UpdateQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return UpdateQueue(tmp_path / "updates.sqlite")
+
+
+def test_duplicate_put_is_ignored(queue):
+    assert queue.put(1, 10, "a")
+    assert not queue.put(1, 10, "a again")
+    assert queue.lease(limit=5) == [(1, "a")]
+
+
+def test_lease_is_exclusive_until_it_expires(queue):
+    queue.put(1, 10, "a")
+    assert queue.lease(lease_seconds=0.05) == [(1, "a")]
+    assert queue.lease() == []
+    time.sleep(0.06)
+    # Воркер «упал» — аренда истекла, апдейт достается снова
+    assert queue.lease() == [(1, "a")]
+
+
+def test_lease_respects_shards(queue):
+    for update_id, chat_id in ((1, 10), (2, 11), (3, -12)):
+        queue.put(update_id, chat_id, str(update_id))
+    assert [p for _, p in queue.lease(shard=0, shards=2, limit=5)] == ["1", "3"]
+    assert [p for _, p in queue.lease(shard=1, shards=2, limit=5)] == ["2"]
+
+
+def test_acked_update_is_not_processed_again(queue):
+    queue.put(1, 10, "a")
+    [(row_id, _)] = queue.lease()
+    queue.ack(row_id)
+    # Повтор от Telegram после обработки
+    assert not queue.put(1, 10, "a")
+    assert queue.lease() == []
+    assert queue.stats() == {"done": 1}
+
+
+def test_purge_forgets_old_done_updates(queue, monkeypatch):
+    queue.put(1, 10, "a")
+    [(row_id, _)] = queue.lease()
+    queue.ack(row_id)
+    queue.purge(ttl=0)
+    assert queue.stats() == {}
+    assert queue.put(1, 10, "a")
+
+
+def test_release_returns_update_without_penalty(queue, monkeypatch):
+    monkeypatch.setattr(updates, "MAX_ATTEMPTS", 1)
+    queue.put(1, 10, "a")
+    [(row_id, _)] = queue.lease()
+    queue.release(row_id)
+    assert queue.lease() == [(row_id, "a")]
+
+
+def test_release_does_not_requeue_done_update(queue):
+    queue.put(1, 10, "a")
+    [(row_id, _)] = queue.lease()
+    queue.ack(row_id)
+    queue.release(row_id)
+    assert queue.lease() == []
+
+
+def test_update_goes_dead_after_max_attempts(queue, monkeypatch):
+    monkeypatch.setattr(updates, "MAX_ATTEMPTS", 2)
+    queue.put(1, 10, "a")
+    for _ in range(2):
+        assert queue.lease(lease_seconds=0) == [(1, "a")]
+    assert queue.lease() == []
+    assert queue.stats() == {"dead": 1}
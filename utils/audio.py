@@ -0,0 +1,295 @@
+import os
+import re
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# pydub и numpy импортируются внутри функций — модуль грузится без тяжелых зависимостей
+from utils.providers import call_with_limits
+
+# --- НАСТРОЙКИ ТРАНСКРИБАЦИИ ---
+SEGMENT_SECONDS = 600          # Целевая длина сегмента (10 минут ≈ 2.4 МБ в mp3 32k)
+OVERLAP_SECONDS = 3            # Перекрытие соседних сегментов, чтобы не терять слова на стыке
+SEARCH_WINDOW_SECONDS = 30     # Где искать паузу вокруг точки разреза
+WHISPER_MAX_MB = 24            # Лимит Whisper — 25 МБ, оставляем запас
+WHISPER_PARALLELISM = int(os.getenv("WHISPER_PARALLELISM", "4"))
+
+# --- ИЗВЛЕЧЕНИЕ ЗВУКА (ffmpeg) ---
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE = os.getenv("FFPROBE_BINARY", "ffprobe")
+TARGET_BITRATE = "32k"
+
+# --- ТИШИНА И ТЕМП ---
+# Whisper берет деньги и время за каждую секунду, включая паузы между слайдами
+TRIM_SILENCE = os.getenv("WHISPER_TRIM_SILENCE", "1") != "0"
+WHISPER_TEMPO = float(os.getenv("WHISPER_TEMPO", "1.0"))   # например, 1.15; 1.0 — без ускорения
+WHISPER_USD_PER_MINUTE = 0.006
+WHISPER_SECONDS_PER_MINUTE = 3.0   # грубо: сколько Whisper обрабатывает минуту звука
+ANALYSIS_RATE = 16000
+FRAME_MS = 30
+MIN_SILENCE_SECONDS = 1.0          # паузы короче — часть речи
+KEEP_PAUSE_SECONDS = 0.25          # сколько тишины оставить на краях вырезанной паузы
+MIN_TRIM_SECONDS = 5.0             # меньше — не стоит перекодирования
+TRIM_MIN_DURATION = 30.0           # короткие голосовые не анализируем
+SILENCE_FLOOR_DB = -50.0
+
+# Кодеки, которые Whisper принимает как есть: копируем дорожку без перекодирования
+COPY_CODECS = {"mp3": ".mp3", "aac": ".m4a", "opus": ".ogg", "vorbis": ".ogg", "flac": ".flac"}
+
+
+def _ffmpeg(args):
+    # Один процесс ffmpeg, данные идут потоком с диска на диск — PCM в память Python не попадает
+    subprocess.run([FFMPEG, "-nostdin", "-y", "-v", "error", *args], capture_output=True, check=True)
+
+
+def transcode_audio(input_path, output_path, bitrate=TARGET_BITRATE):
+    """Перекодирует первую аудиодорожку в моно MP3 с заданным битрейтом"""
+    _ffmpeg(["-i", input_path, "-vn", "-map", "0:a:0", "-ac", "1",
+             "-c:a", "libmp3lame", "-b:a", bitrate, output_path])
+    return output_path
+
+
+def _frame_levels(path, rate=ANALYSIS_RATE, frame_ms=FRAME_MS, chunk_seconds=30):
+    """
+    Громкость (dBFS) каждого кадра: ffmpeg декодирует в моно PCM 16 кГц в канал,
+    numpy считает RMS кусками по chunk_seconds — весь файл в памяти не держим.
+    """
+    import numpy as np
+
+    frame = rate * frame_ms // 1000
+    chunk_bytes = rate * chunk_seconds * 2
+    proc = subprocess.Popen(
+        [FFMPEG, "-nostdin", "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(rate), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    levels = []
+    rest = np.zeros(0, dtype=np.float32)
+    try:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            samples = np.concatenate([rest, np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2") / 32768.0])
+            usable = len(samples) // frame * frame
+            frames = samples[:usable].reshape(-1, frame)
+            levels.append(10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10))
+            rest = samples[usable:]
+    finally:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError("ffmpeg не смог декодировать звук")
+    return np.concatenate(levels) if levels else np.zeros(0)
+
+
+def speech_spans(levels, frame_ms=FRAME_MS):
+    """
+    Отрезки речи [(начало, конец)] в секундах по громкости кадров.
+    Порог адаптивный — между фоном (10-й перцентиль) и речью (90-й);
+    паузы короче MIN_SILENCE_SECONDS остаются. Если фон от речи не отличается
+    (сплошная речь или музыка) — None.
+    """
+    import numpy as np
+
+    if len(levels) == 0:
+        return None
+    frame_s = frame_ms / 1000
+    noise, speech = np.percentile(levels, [10, 90])
+    if speech - noise < 6:
+        return None
+    threshold = max(SILENCE_FLOOR_DB, noise + (speech - noise) * 0.3)
+
+    # Границы серий тихих кадров
+    silent = np.concatenate([[False], levels < threshold, [False]])
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    long_runs = (ends - starts) * frame_s >= MIN_SILENCE_SECONDS
+
+    total = len(levels) * frame_s
+    spans, pos = [], 0.0
+    for start, end in zip(starts[long_runs] * frame_s, ends[long_runs] * frame_s):
+        cut_from = start + KEEP_PAUSE_SECONDS if start > 0 else 0.0
+        cut_to = end - KEEP_PAUSE_SECONDS if end < total else total
+        if cut_from > pos:
+            spans.append((pos, cut_from))
+        pos = max(pos, cut_to)
+    if pos < total:
+        spans.append((pos, total))
+    return spans
+
+
+def trim_silence(path, output_path, tempo=WHISPER_TEMPO):
+    """
+    Вырезает длинные паузы (и, если tempo > 1, немного ускоряет речь) одним
+    проходом ffmpeg в моно MP3. Возвращает (путь, статистика) или (None, статистика),
+    если выигрыш меньше MIN_TRIM_SECONDS и перекодировать не стоит.
+    Статистика: секунды до/после, сэкономленные деньги и примерное время Whisper.
+    """
+    started = time.perf_counter()
+    levels = _frame_levels(path)
+    duration = len(levels) * FRAME_MS / 1000
+    spans = speech_spans(levels) or [(0.0, duration)]
+    kept = sum(end - start for start, end in spans)
+    billed = kept / tempo
+    stats = {"seconds_in": round(duration, 1), "seconds_out": round(billed, 1),
+             "seconds_removed": round(duration - billed, 1)}
+    if duration - billed < MIN_TRIM_SECONDS:
+        stats["seconds_removed"] = 0.0
+        return None, stats
+
+    filters = []
+    if len(spans) > 1 or spans[0] != (0.0, duration):
+        select = "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in spans)
+        filters += [f"aselect='{select}'", "asetpts=N/SR/TB"]
+    if tempo != 1.0:
+        filters.append(f"atempo={tempo:.3f}")
+    _ffmpeg(["-i", path, "-vn", "-map", "0:a:0", "-af", ",".join(filters), "-ac", "1",
+             "-c:a", "libmp3lame", "-b:a", TARGET_BITRATE, output_path])
+
+    removed_minutes = (duration - billed) / 60
+    stats["cost_saved_usd"] = round(removed_minutes * WHISPER_USD_PER_MINUTE, 4)
+    # Время самой обрезки вычитаем: экономия честная, а не только со стороны Whisper
+    stats["latency_saved_s"] = round(removed_minutes * WHISPER_SECONDS_PER_MINUTE - (time.perf_counter() - started), 2)
+    return output_path, stats
+
+
+def _transcription_text(transcription):
+    # Обработка разных форматов ответа
+    if hasattr(transcription, 'text'):
+        return transcription.text
+    elif isinstance(transcription, dict):
+        return transcription.get('text', '')
+    return str(transcription)
+
+
+def _whisper(client, audio_file):
+    def request():
+        audio_file.seek(0)  # при повторе после 429 файл читается заново
+        return client.audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            response_format="json"
+        )
+    transcription = call_with_limits(request, kind="whisper", api_key=client.api_key)
+    return _transcription_text(transcription)
+
+
+def find_pauses(levels, frame_ms=FRAME_MS):
+    """Паузы [(начало, конец)] в секундах — промежутки между отрезками речи (см. speech_spans)"""
+    spans = speech_spans(levels, frame_ms)
+    if not spans:
+        return []
+    return [(prev_end, start) for (_, prev_end), (start, _) in zip(spans, spans[1:])]
+
+
+def plan_segments(duration, pauses=(), segment_s=SEGMENT_SECONDS, overlap_s=OVERLAP_SECONDS,
+                  window_s=SEARCH_WINDOW_SECONDS):
+    """
+    Список (start, end) в секундах: разрез — в середине паузы, ближайшей к границе
+    сегмента (в пределах window_s), иначе ровно по границе; каждый сегмент заходит
+    на overlap_s в следующий.
+    """
+    mids = [(start + end) / 2 for start, end in pauses]
+    segments = []
+    start = 0.0
+    while duration - start > segment_s:
+        target = start + segment_s
+        near = [m for m in mids if abs(m - target) <= window_s and m > start]
+        cut = min(near, key=lambda m: abs(m - target)) if near else target
+        segments.append((start, min(cut + overlap_s, duration)))
+        start = cut
+    segments.append((start, duration))
+    return segments
+
+
+def cut_segment(path, start, end, output_path):
+    """Вырезает [start, end) секунд одним вызовом ffmpeg сразу в моно MP3 16 кГц — без декодирования всего файла"""
+    _ffmpeg(["-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", path, "-vn", "-map", "0:a:0",
+             "-ac", "1", "-ar", str(ANALYSIS_RATE), "-c:a", "libmp3lame", "-b:a", TARGET_BITRATE, output_path])
+    return output_path
+
+
+def _normalize(word):
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def merge_overlap(prev_text, next_text, max_words=40):
+    """Склеивает тексты соседних сегментов, выкидывая слова, повторенные на перекрытии"""
+    prev_words = prev_text.split()
+    next_words = next_text.split()
+    if not prev_words:
+        return next_text
+    if not next_words:
+        return prev_text
+
+    tail = [_normalize(w) for w in prev_words[-max_words:]]
+    head = [_normalize(w) for w in next_words[:max_words]]
+
+    # Самый длинный суффикс prev, совпадающий с префиксом next (минимум 2 слова)
+    for k in range(min(len(tail), len(head)), 1, -1):
+        if tail[-k:] == head[:k]:
+            next_words = next_words[k:]
+            break
+
+    return " ".join(prev_words + next_words)
+
+
+def _duration_seconds(path):
+    from pydub.utils import mediainfo
+
+    try:
+        return float(mediainfo(path).get("duration", 0))
+    except Exception:
+        return 0.0
+
+
+def split_audio(path, duration=None):
+    """
+    Готовит файл к Whisper: короткий — [path] как есть, длинный режется по паузам
+    на сегменты (временные файлы рядом с исходным, удаляет вызывающий).
+    duration — длительность из probe(); без нее спрашиваем ffprobe еще раз.
+    Все ffmpeg-вызовы здесь — работа процессора, вызывающий держит для нее этап "transcode".
+    """
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    if duration is None:
+        duration = _duration_seconds(path)
+    if size_mb <= WHISPER_MAX_MB and 0 < duration <= SEGMENT_SECONDS * 1.2:
+        return [path]
+
+    # Паузы ищем по потоковой громкости кадров (ffmpeg -> numpy), файл целиком не декодируем
+    try:
+        levels = _frame_levels(path)
+        pauses = find_pauses(levels)
+        duration = duration or len(levels) * FRAME_MS / 1000
+    except ImportError:
+        print("Warning: numpy is not installed, long audio is cut without looking for pauses")
+        pauses = []
+
+    paths = []
+    try:
+        for n, (start, end) in enumerate(plan_segments(duration, pauses)):
+            paths.append(cut_segment(path, start, end, f"{path}_segment{n}.mp3"))
+    except Exception:
+        for segment_path in paths:
+            os.remove(segment_path)
+        raise
+    return paths
+
+
+def transcribe_segments(paths, client, parallelism=None):
+    """
+    Распознает сегменты из split_audio через whisper-1 параллельно (parallelism потоков)
+    и склеивает тексты, убирая повторы на перекрытиях.
+    """
+    def transcribe_segment(segment_path):
+        with open(segment_path, "rb") as audio_file:
+            return _whisper(client, audio_file)
+
+    if len(paths) == 1:
+        return transcribe_segment(paths[0])
+    with ThreadPoolExecutor(max_workers=parallelism or WHISPER_PARALLELISM) as pool:
+        texts = list(pool.map(transcribe_segment, paths))
+
+    text = ""
+    for part in texts:
+        text = merge_overlap(text, part)
+    return text
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# --- НАСТРОЙКИ ---
+APP_WORKERS = int(os.getenv("APP_WORKERS", "4"))
+JOB_TTL = 3600          # сколько хранить готовый результат (секунды)
+
+
+class JobState:
+    """Снимок задачи: status — queued / running / done / error"""
+
+    def __init__(self, job_id, owner, title):
+        self.id = job_id
+        self.owner = owner
+        self.title = title
+        self.status = "queued"
+        self.progress = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+
+class JobStore:
+    """
+    Фоновые задачи приложения: живут в процессе сервера Streamlit (через
+    st.cache_resource), а не в сессии, поэтому переживают rerun и переподключение.
+    Функция задачи получает report(text) для статуса и возвращает результат.
+    """
+
+    def __init__(self, max_workers=APP_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vyud-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, func, *args, title="", **kwargs):
+        """Ставит func(*args, report=..., **kwargs) в пул. Возвращает id задачи"""
+        self._cleanup()
+        job = JobState(uuid.uuid4().hex, owner, title)
+        with self._lock:
+            self._jobs[job.id] = job
+
+        def report(text):
+            with self._lock:
+                job.progress.append(text)
+
+        def run():
+            job.status = "running"
+            try:
+                result = func(*args, report=report, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    job.error = str(e)
+                    job.status = "error"
+            else:
+                with self._lock:
+                    job.result = result
+                    job.status = "done"
+            finally:
+                job.finished = time.time()
+
+        self._pool.submit(run)
+        return job.id
+
+    def get(self, job_id, owner=None):
+        """Задача по id; чужие (owner не совпадает) не отдаем"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def active_jobs(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner and job.active]
+
+    def _cleanup(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and now - j.finished > self.ttl]:
+                del self._jobs[job_id]
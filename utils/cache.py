@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import time
+import hashlib
+from pathlib import Path
+
+# --- НАСТРОЙКИ КЭША ---
+# Один SQLite-файл на проект: его видят и app.py, и bot.py
+CACHE_DIR = Path(os.getenv("VYUD_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+CACHE_PATH = CACHE_DIR / "vyud_cache.sqlite"
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024   # 512 МБ на одно пространство имен
+DEFAULT_MAX_AGE = 30 * 24 * 3600        # 30 дней
+HASH_CHUNK = 1024 * 1024                # Хэшируем файлы кусками по 1 МБ
+
+
+def content_hash(data):
+    """SHA-256 от содержимого файла (bytes)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(source):
+    """SHA-256 файла по пути или seekable-потоку; читается кусками, без загрузки в память"""
+    h = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(HASH_CHUNK), b""):
+            h.update(chunk)
+        source.seek(0)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Персистентный кэш на SQLite с вытеснением по размеру (LRU) и по возрасту.
+    Безопасен для нескольких потоков и процессов: каждое обращение
+    открывает свое короткое соединение.
+    """
+
+    def __init__(self, namespace, path=None, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.namespace = namespace
+        self.path = Path(path) if path else CACHE_PATH
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._ready = False
+        # Счетчики попаданий в рамках процесса
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        """Возвращает значение (bytes) или None"""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def _get(self, key):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"Warning: cache unavailable: {e}")
+            return None
+
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            # Протухшую запись удаляем сразу
+            if self.max_age and now - created_at > self.max_age:
+                conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                conn.commit()
+                return None
+
+            conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            conn.commit()
+            return value
+        except sqlite3.Error as e:
+            print(f"Warning: cache read failed: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def set(self, key, value):
+        """Сохраняет значение (bytes или str) и запускает вытеснение"""
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"Warning: cache unavailable: {e}")
+            return
+
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: cache write failed: {e}")
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        # 1. По возрасту
+        if self.max_age:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, now - self.max_age),
+            )
+
+        # 2. По размеру: выкидываем давно не читанные, пока не влезем в лимит
+        if not self.max_bytes:
+            return
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed_at ASC",
+            (self.namespace,),
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            total -= size
+
+    def clear(self):
+        """Удаляет все записи этого пространства имен"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+            conn.commit()
+        finally:
+            conn.close()
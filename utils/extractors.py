@@ -0,0 +1,200 @@
+import codecs
+import os
+import re
+import unicodedata
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Локальный (быстрый) уровень извлечения текста: без сети, за миллисекунды.
+# Каждая функция возвращает текст или None — тогда документ уходит в LlamaParse.
+
+# --- НАСТРОЙКИ ---
+TEXT_EXTS = {".txt", ".md"}
+OOXML_EXTS = {".docx", ".pptx", ".xlsx"}
+LOCAL_EXTS = TEXT_EXTS | OOXML_EXTS | {".pdf"}
+
+MAX_XML_BYTES = 50 * 1024 * 1024   # распакованный XML больше — подозрительно (zip-бомба), отдаем в облако
+TEXT_ENCODINGS = ("utf-8-sig", "cp1251")
+UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+# cp1251 читает любые байты: управляющие символы в результате — признак чужой кодировки
+CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0e-\x1f]")
+MAX_CONTROL_RATIO = 0.01
+
+# Эвристика качества текстового слоя PDF
+PDF_MIN_CHARS_PER_PAGE = 200    # меньше — скорее всего скан или картинки
+PDF_MIN_TEXT_PAGES = 0.8        # доля страниц с текстом
+PDF_MIN_CLEAN_RATIO = 0.9       # доля «нормальных» символов (буквы, цифры, пунктуация)
+PDF_MAX_SHORT_LINES = 0.6       # доля коротких строк: таблицы и многоколоночная верстка
+
+_NS = {
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+}
+
+
+def extract_local(path, ext=None):
+    """Пробует извлечь текст локально. None — формат не поддерживается или качество плохое"""
+    ext = (ext or os.path.splitext(path)[1]).lower()
+    try:
+        if ext in TEXT_EXTS:
+            return read_text_file(path)
+        if ext == ".docx":
+            return extract_docx(path)
+        if ext == ".pptx":
+            return extract_pptx(path)
+        if ext == ".xlsx":
+            return extract_xlsx(path)
+        if ext == ".pdf":
+            return extract_pdf(path)
+    except (zipfile.BadZipFile, ET.ParseError, KeyError, IndexError, ValueError) as e:
+        print(f"Warning: local extraction failed for {os.path.basename(path)}: {e}")
+    return None
+
+
+# --- TXT / MD ---
+
+def read_text_file(path):
+    """Текст файла в UTF-8/UTF-16 (по BOM)/cp1251; None — кодировку не угадали"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    encodings = ("utf-16",) if raw.startswith(UTF16_BOMS) else TEXT_ENCODINGS
+    for encoding in encodings:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = raw.decode("utf-8", errors="replace")
+    if len(CONTROL_RE.findall(text)) > len(text) * MAX_CONTROL_RATIO:
+        return None
+    return text.strip() or None
+
+
+# --- DOCX / PPTX / XLSX (это zip с XML внутри) ---
+
+def _read_xml(archive, name):
+    if archive.getinfo(name).file_size > MAX_XML_BYTES:
+        raise ValueError(f"{name} слишком большой")
+    return ET.fromstring(archive.read(name))
+
+
+def _numbered(names, pattern):
+    """slide10.xml должен идти после slide9.xml"""
+    regex = re.compile(pattern)
+    found = [(int(m.group(1)), n) for n in names for m in [regex.fullmatch(n)] if m]
+    return [n for _, n in sorted(found)]
+
+
+def _paragraphs(root, ns, tag):
+    """Текст абзацев: runs внутри абзаца склеиваются, абзацы — через перевод строки"""
+    lines = []
+    for p in root.iter(f"{{{_NS[ns]}}}p"):
+        line = "".join(t.text or "" for t in p.iter(f"{{{_NS[ns]}}}{tag}")).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        root = _read_xml(archive, "word/document.xml")
+    text = "\n".join(_paragraphs(root, "w", "t"))
+    return text or None
+
+
+def extract_pptx(path):
+    slides = []
+    with zipfile.ZipFile(path) as archive:
+        for n, name in enumerate(_numbered(archive.namelist(), r"ppt/slides/slide(\d+)\.xml"), 1):
+            lines = _paragraphs(_read_xml(archive, name), "a", "t")
+            if lines:
+                slides.append(f"## Слайд {n}\n" + "\n".join(lines))
+    return "\n\n".join(slides) or None
+
+
+def extract_xlsx(path):
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        shared = []
+        if "xl/sharedStrings.xml" in names:
+            for si in _read_xml(archive, "xl/sharedStrings.xml").iter(f"{{{_NS['s']}}}si"):
+                shared.append("".join(t.text or "" for t in si.iter(f"{{{_NS['s']}}}t")))
+
+        sheets = []
+        for n, name in enumerate(_numbered(names, r"xl/worksheets/sheet(\d+)\.xml"), 1):
+            rows = []
+            for row in _read_xml(archive, name).iter(f"{{{_NS['s']}}}row"):
+                cells = []
+                for c in row.iter(f"{{{_NS['s']}}}c"):
+                    kind = c.get("t")
+                    if kind == "inlineStr":
+                        value = "".join(t.text or "" for t in c.iter(f"{{{_NS['s']}}}t"))
+                    else:
+                        v = c.find("s:v", _NS)
+                        value = v.text if v is not None and v.text else ""
+                        if kind == "s" and value:
+                            value = shared[int(value)]
+                    if value.strip():
+                        cells.append(value.strip())
+                if cells:
+                    rows.append(" | ".join(cells))
+            if rows:
+                sheets.append(f"## Лист {n}\n" + "\n".join(rows))
+    return "\n\n".join(sheets) or None
+
+
+# --- PDF (текстовый слой) ---
+
+def _clean_ratio(text):
+    """Доля символов, похожих на нормальный текст (битые шрифты дают мусор и (cid:NN))"""
+    if not text:
+        return 0.0
+    good = sum(1 for ch in text if ch.isalnum() or ch.isspace() or unicodedata.category(ch)[0] in "PS")
+    bad = text.count("�") + text.count("(cid:") * 6
+    return max(0.0, good - bad) / len(text)
+
+
+def pdf_text_quality(pages):
+    """Проверяет, что текстового слоя достаточно. Возвращает (ok, причина)"""
+    if not pages:
+        return False, "нет страниц"
+    total = sum(len(p.strip()) for p in pages)
+    if total / len(pages) < PDF_MIN_CHARS_PER_PAGE:
+        return False, "мало текста (скан?)"
+    with_text = sum(1 for p in pages if len(p.strip()) >= PDF_MIN_CHARS_PER_PAGE // 4)
+    if with_text / len(pages) < PDF_MIN_TEXT_PAGES:
+        return False, "часть страниц без текста"
+    text = "".join(pages)
+    if _clean_ratio(text) < PDF_MIN_CLEAN_RATIO:
+        return False, "битая кодировка шрифтов"
+    lines = [line for line in text.splitlines() if line.strip()]
+    short = sum(1 for line in lines if len(line.strip()) < 25)
+    if lines and short / len(lines) > PDF_MAX_SHORT_LINES:
+        return False, "сложная верстка (таблицы, колонки)"
+    return True, ""
+
+
+def extract_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        print("Warning: pypdf is not installed, PDF goes to LlamaParse")
+        return None
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            return None
+        pages = [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        # Битый или нестандартный PDF — LlamaParse справится лучше
+        print(f"Warning: pypdf failed on {os.path.basename(path)}: {e}")
+        return None
+    ok, reason = pdf_text_quality(pages)
+    if not ok:
+        print(f"Info: {os.path.basename(path)} -> LlamaParse ({reason})")
+        return None
+    # Разделитель страниц как у LlamaParse: по нему utils/passages.py находит колонтитулы
+    return "\n\n---\n\n".join(p.strip() for p in pages if p.strip())
@@ -0,0 +1,209 @@
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+# --- ЛИМИТЫ ПО УМОЛЧАНИЮ ---
+# Сколько задач одновременно может находиться на каждом этапе
+DEFAULT_STAGE_LIMITS = {
+    "download": 4,      # скачивание из Telegram
+    "transcode": 2,     # ffmpeg: самый тяжелый по CPU этап
+    "transcribe": 4,    # Whisper (сеть)
+    "parse": 4,         # LlamaParse (сеть)
+    "generate": 3,      # GPT-4o
+}
+
+
+class QueueFull(Exception):
+    """Очередь переполнена — задачу не приняли (backpressure)"""
+
+
+class Job:
+    def __init__(self, user_id, func):
+        self.user_id = user_id
+        self.func = func
+        self.started = asyncio.Event()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """
+    Очередь задач бота с пулом воркеров.
+    - Справедливость: пользователи обслуживаются по кругу, по одной задаче за ход,
+      поэтому десять файлов от одного не задерживают всех остальных.
+    - Backpressure: при переполнении submit() бросает QueueFull.
+    - Лимиты по этапам: stage() для корутин, blocking_stage() для кода в потоках.
+    """
+
+    def __init__(self, workers=4, max_queue=50, max_per_user=3, stage_limits=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.stage_limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+
+        self._queues = {}          # user_id -> deque[Job]
+        self._order = deque()      # очередь пользователей для round-robin
+        self._active = {}          # user_id -> сколько задач сейчас выполняется
+        self._pending = 0
+        self._cond = None
+        self._tasks = []
+        self._async_sems = {}
+        self._thread_sems = {}
+        self._thread_lock = threading.Lock()
+
+    # --- ЖИЗНЕННЫЙ ЦИКЛ ---
+
+    async def start(self):
+        self._cond = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- ПОСТАНОВКА В ОЧЕРЕДЬ ---
+
+    async def submit(self, user_id, func):
+        """Ставит корутинную функцию func() в очередь. Возвращает Job (результат — job.future)"""
+        if self._cond is None:
+            await self.start()
+
+        async with self._cond:
+            if self._pending >= self.max_queue:
+                raise QueueFull("Очередь переполнена")
+            user_jobs = len(self._queues.get(user_id, ())) + self._active.get(user_id, 0)
+            if user_jobs >= self.max_per_user:
+                raise QueueFull("Слишком много задач от одного пользователя")
+
+            job = Job(user_id, func)
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._order.append(user_id)
+            self._queues[user_id].append(job)
+            self._pending += 1
+            self._cond.notify()
+            return job
+
+    def position(self, job):
+        """Место задачи в очереди (1 — следующая), 0 — уже выполняется или завершена"""
+        if job.started.is_set():
+            return 0
+        # Проигрываем round-robin: каждый круг забирает по одной задаче у каждого пользователя
+        depth = None
+        queue = self._queues.get(job.user_id)
+        if queue is not None:
+            for i, queued in enumerate(queue):
+                if queued is job:
+                    depth = i
+                    break
+        if depth is None:
+            return 0
+
+        ahead = depth
+        passed = False
+        for user_id in self._order:
+            if user_id == job.user_id:
+                passed = True
+                continue
+            # Пользователи до нас успеют забрать depth + 1 задач, после нас — depth
+            ahead += min(len(self._queues[user_id]), depth if passed else depth + 1)
+        return ahead + 1
+
+    @property
+    def pending(self):
+        return self._pending
+
+    # --- ВОРКЕРЫ ---
+
+    def _pop_next(self):
+        user_id = self._order.popleft()
+        queue = self._queues[user_id]
+        job = queue.popleft()
+        if queue:
+            self._order.append(user_id)
+        else:
+            del self._queues[user_id]
+        self._pending -= 1
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+        return job
+
+    async def _worker(self):
+        while True:
+            async with self._cond:
+                while not self._order:
+                    await self._cond.wait()
+                job = self._pop_next()
+
+            job.started.set()
+            try:
+                result = await job.func()
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._active[job.user_id] -= 1
+                if not self._active[job.user_id]:
+                    del self._active[job.user_id]
+
+    # --- ЛИМИТЫ ЭТАПОВ ---
+
+    @asynccontextmanager
+    async def stage(self, name):
+        """Ограничивает число одновременных корутин на этапе name"""
+        sem = self._async_sems.get(name)
+        if sem is None:
+            sem = self._async_sems[name] = asyncio.Semaphore(self.stage_limits.get(name, self.workers))
+        async with sem:
+            yield
+
+    @contextmanager
+    def blocking_stage(self, name):
+        """То же для кода в потоках (asyncio.to_thread): передается в logic как limiter"""
+        with self._thread_lock:
+            sem = self._thread_sems.get(name)
+            if sem is None:
+                sem = self._thread_sems[name] = threading.BoundedSemaphore(
+                    self.stage_limits.get(name, self.workers)
+                )
+        with sem:
+            yield
+
+
+# --- ПОТОКИ ---
+
+async def iterate_in_thread(gen_func, *args, **kwargs):
+    """
+    Асинхронно перебирает синхронный генератор, который работает в отдельном потоке
+    (например, logic.stream_quiz_ai): элементы приходят в event loop по мере появления.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def run():
+        try:
+            for item in gen_func(*args, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+    worker = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        await worker
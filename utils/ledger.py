@@ -0,0 +1,199 @@
+import atexit
+import threading
+import time
+
+# --- НАСТРОЙКИ ---
+INITIAL_CREDITS = 5        # Приветственный бонус новому пользователю
+BALANCE_TTL = 5.0          # Сколько секунд доверяем закэшированному балансу
+FLUSH_INTERVAL = 2.0       # Как часто сбрасываем отложенные списания
+MAX_CAS_RETRIES = 5        # Попыток атомарного списания при конкурентных изменениях
+
+
+# --- ХРАНИЛИЩА ---
+
+class SupabaseCreditsStore:
+    """Таблица users_credits в Supabase"""
+
+    def __init__(self, client, table="users_credits"):
+        self.client = client
+        self.table = table
+
+    def fetch(self, email):
+        response = self.client.table(self.table).select("credits").eq("email", email).execute()
+        return response.data[0]["credits"] if response.data else None
+
+    def insert(self, email, credits):
+        self.client.table(self.table).insert({"email": email, "credits": credits}).execute()
+
+    def compare_and_set(self, email, expected, new):
+        """UPDATE ... WHERE email = ? AND credits = expected — атомарно на стороне Postgres"""
+        response = (
+            self.client.table(self.table)
+            .update({"credits": new})
+            .eq("email", email)
+            .eq("credits", expected)
+            .execute()
+        )
+        return bool(response.data)
+
+
+class MemoryCreditsStore:
+    """Локальная замена users_credits для тестов и бенчмарков (та же семантика CAS)"""
+
+    def __init__(self, initial=None):
+        self.rows = dict(initial or {})
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, email):
+        with self._lock:
+            self.calls += 1
+            return self.rows.get(email)
+
+    def insert(self, email, credits):
+        with self._lock:
+            self.calls += 1
+            if email in self.rows:
+                raise ValueError(f"duplicate key: {email}")
+            self.rows[email] = credits
+
+    def compare_and_set(self, email, expected, new):
+        with self._lock:
+            self.calls += 1
+            if self.rows.get(email) != expected:
+                return False
+            self.rows[email] = new
+            return True
+
+
+# --- ЛЕДЖЕР ---
+
+class CreditLedger:
+    """
+    Баланс и списания поверх хранилища.
+    - try_deduct: атомарное «списать, если хватает» через compare-and-set;
+      при известном балансе это один запрос вместо двух-трех.
+    - balance: кэш в памяти процесса с коротким TTL (для st.metric на каждом rerun).
+    - charge_deferred: отложенные списания для бота — копятся в памяти
+      и сбрасываются пачкой раз в FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self, store, initial_credits=INITIAL_CREDITS, ttl=BALANCE_TTL, flush_interval=FLUSH_INTERVAL):
+        self.store = store
+        self.initial_credits = initial_credits
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._cache = {}       # email -> (balance, fetched_at)
+        self._pending = {}     # email -> сумма отложенных списаний
+        self._inflight = {}    # email -> списания, которые сейчас пишутся в базу
+        self._lock = threading.RLock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    # --- БАЛАНС ---
+
+    def _load(self, email):
+        """Баланс из базы; нового пользователя создаем с бонусом"""
+        credits = self.store.fetch(email)
+        if credits is None:
+            try:
+                self.store.insert(email, self.initial_credits)
+                credits = self.initial_credits
+            except Exception:
+                # Параллельный запрос уже создал строку
+                credits = self.store.fetch(email)
+        self._remember(email, credits)
+        return credits
+
+    def _remember(self, email, credits):
+        with self._lock:
+            self._cache[email] = (credits, time.monotonic())
+
+    def _stored_balance(self, email, fresh=False):
+        with self._lock:
+            cached = self._cache.get(email)
+        if cached and not fresh and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        return self._load(email)
+
+    def balance(self, email, fresh=False):
+        """Текущий баланс с учетом еще не записанных отложенных списаний"""
+        credits = self._stored_balance(email, fresh)
+        with self._lock:
+            return credits - self._pending.get(email, 0) - self._inflight.get(email, 0)
+
+    def invalidate(self, email=None):
+        with self._lock:
+            if email is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(email, None)
+
+    # --- СПИСАНИЯ ---
+
+    def try_deduct(self, email, amount=1):
+        """Атомарно списывает amount, если хватает. True — списано, False — недостаточно средств"""
+        expected = self._stored_balance(email)
+        for _ in range(MAX_CAS_RETRIES):
+            if expected < amount:
+                # Кэш мог устареть в меньшую сторону — перед отказом сверяемся с базой
+                fresh = self._load(email)
+                if fresh < amount:
+                    return False
+                expected = fresh
+                continue
+
+            if self.store.compare_and_set(email, expected, expected - amount):
+                self._remember(email, expected - amount)
+                return True
+
+            # Кто-то списал параллельно — перечитываем и пробуем снова
+            expected = self._load(email)
+
+        raise RuntimeError("Не удалось списать кредиты: слишком много конкурентных изменений")
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def charge_deferred(self, email, amount=1):
+        """Резервирует списание в памяти; в базу оно уйдет при ближайшем flush()"""
+        # Запрос в базу (если кэш устарел) — без блокировки: она только на резерв
+        credits = self._stored_balance(email)
+        with self._lock:
+            # Пока ждали базу, flush мог обновить кэш — берем самый свежий баланс
+            cached = self._cache.get(email)
+            if cached:
+                credits = cached[0]
+            if credits - self._pending.get(email, 0) - self._inflight.get(email, 0) < amount:
+                return False
+            self._pending[email] = self._pending.get(email, 0) + amount
+            self._schedule_flush()
+        return True
+
+    def flush(self):
+        """Записывает все отложенные списания (по одному атомарному запросу на пользователя)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+            for email, amount in pending.items():
+                self._inflight[email] = self._inflight.get(email, 0) + amount
+
+        for email, amount in pending.items():
+            try:
+                if not self.try_deduct(email, amount):
+                    print(f"Warning: deferred charge for {email} exceeded balance")
+            except Exception as e:
+                # Не теряем списание — вернем в очередь до следующего сброса
+                print(f"Warning: deferred charge for {email} failed: {e}")
+                with self._lock:
+                    self._pending[email] = self._pending.get(email, 0) + amount
+                    self._schedule_flush()
+            finally:
+                with self._lock:
+                    self._inflight[email] -= amount
+                    if not self._inflight[email]:
+                        del self._inflight[email]
@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import subprocess
+
+from utils.audio import (
+    FFPROBE, COPY_CODECS, WHISPER_MAX_MB, TRIM_SILENCE, TRIM_MIN_DURATION, _ffmpeg, transcode_audio, trim_silence,
+)
+
+# Разбор загруженного медиафайла до любых облачных вызовов: по сигнатуре и метаданным
+# ffprobe выбираем самый дешевый путь к Whisper.
+#   passthrough — файл уходит в Whisper как есть;
+#   copy        — аудиофайл в неподходящем контейнере: та же дорожка без перекодирования;
+#   remux       — видео: берем только аудиодорожку, без перекодирования;
+#   transcode   — кодек не подходит или файл слишком большой: сжимаем в MP3;
+#   trim        — вырезаны длинные паузы (заменяет любой из путей выше, см. audio.trim_silence).
+
+# --- СИГНАТУРЫ ---
+# (смещение, байты, формат). ftyp/RIFF проверяются отдельно
+MAGIC = [
+    (0, b"%PDF", "pdf"),
+    (0, b"PK\x03\x04", "zip"),          # docx / pptx / xlsx
+    (0, b"OggS", "ogg"),
+    (0, b"fLaC", "flac"),
+    (0, b"ID3", "mp3"),
+    (0, b"\x1a\x45\xdf\xa3", "matroska"),  # mkv / webm
+    (0, b"\x00\x00\x01\xba", "mpeg"),
+    (0, b"#!AMR", "amr"),
+]
+# Расширения медиа — запасной признак, если сигнатура незнакомая
+MEDIA_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".mp3", ".mpeg", ".m4a", ".wav",
+              ".ogg", ".oga", ".opus", ".flac", ".amr"}
+# Текст с BOM: FF FE похоже на заголовок кадра MPEG, поэтому BOM проверяем раньше
+TEXT_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+MEDIA_FORMATS = {"ogg", "flac", "mp3", "matroska", "mpeg", "amr", "mp4", "wav", "avi", "aac"}
+DOCUMENT_FORMATS = {"pdf", "zip", "text"}
+
+# Контейнеры, которые Whisper принимает (по имени файла) — с нужным расширением
+WHISPER_FORMATS = {"mp3": ".mp3", "mp4": ".m4a", "ogg": ".ogg", "flac": ".flac", "wav": ".wav", "mpeg": ".mpeg"}
+PASSTHROUGH_CODECS = set(COPY_CODECS) | {"pcm_s16le"}
+
+
+class UnsupportedMediaError(Exception):
+    """Файл не удастся распознать: нет звука или формат не читается"""
+
+
+def _mpeg_audio_header(head):
+    """Похоже ли начало на заголовок кадра MPEG audio: sync, версия, слой, битрейт и частота допустимы"""
+    if len(head) < 4 or head[0] != 0xFF or head[1] & 0xE0 != 0xE0:
+        return False
+    version = (head[1] >> 3) & 0b11
+    layer = (head[1] >> 1) & 0b11
+    bitrate = head[2] >> 4
+    rate = (head[2] >> 2) & 0b11
+    return version != 0b01 and layer != 0b00 and bitrate not in (0, 0b1111) and rate != 0b11
+
+
+def sniff(source):
+    """Формат по первым байтам файла (путь или поток с seek) или None"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            head = f.read(16)
+    else:
+        pos = source.tell()
+        head = source.read(16)
+        source.seek(pos)
+
+    if head.startswith(TEXT_BOMS):
+        return "text"
+    for offset, magic, fmt in MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return fmt
+    if head[4:8] == b"ftyp":
+        return "mp4"                       # mp4 / m4a / mov / 3gp
+    if head[:4] == b"RIFF":
+        return {b"WAVE": "wav", b"AVI ": "avi"}.get(head[8:12])
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return "aac"                       # ADTS
+    if _mpeg_audio_header(head):
+        return "mp3"                       # MPEG audio без ID3
+    return None
+
+
+def is_media(source, name=""):
+    """Медиа ли это: по содержимому, а если сигнатура незнакомая — по расширению"""
+    fmt = sniff(source)
+    if fmt in MEDIA_FORMATS:
+        return True
+    if fmt in DOCUMENT_FORMATS:
+        return False
+    return os.path.splitext(name)[1].lower() in MEDIA_EXTS
+
+
+def probe(path):
+    """
+    Метаданные ffprobe: {"format", "duration", "audio_codec", "has_video", "bytes"}.
+    Без ffprobe — только то, что видно по сигнатуре.
+    """
+    info = {"format": sniff(path), "duration": 0.0, "audio_codec": None, "has_video": False,
+            "bytes": os.path.getsize(path)}
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error",
+             "-show_entries", "format=duration:stream=codec_type,codec_name:stream_disposition=attached_pic",
+             "-of", "json", path],
+            capture_output=True, check=True,
+        )
+    except FileNotFoundError:
+        print("Warning: ffprobe not found, media route is chosen by signature only")
+        info["probed"] = False
+        return info
+    except subprocess.CalledProcessError as e:
+        raise UnsupportedMediaError(
+            f"Не удалось прочитать медиафайл: {e.stderr.decode(errors='ignore').strip()[:200]}"
+        ) from e
+
+    data = json.loads(result.stdout or b"{}")
+    info["probed"] = True
+    info["duration"] = float(data.get("format", {}).get("duration") or 0)
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "audio" and info["audio_codec"] is None:
+            info["audio_codec"] = stream.get("codec_name")
+        # Обложка mp3 — это «видеопоток» из одного кадра, видео она не делает
+        if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic"):
+            info["has_video"] = True
+    return info
+
+
+def plan_route(info):
+    """Самый дешевый путь для файла по данным probe(). Бросает UnsupportedMediaError"""
+    too_big = info["bytes"] / (1024 * 1024) > WHISPER_MAX_MB
+    if not info.get("probed"):
+        # Без ffprobe доверяем сигнатуре: подходящий контейнер отправляем как есть
+        if info["format"] in WHISPER_FORMATS and not too_big:
+            return "passthrough"
+        if info["format"] not in MEDIA_FORMATS:
+            raise UnsupportedMediaError("Файл не похож на аудио или видео")
+        return "transcode"
+
+    codec = info["audio_codec"]
+    if codec is None:
+        raise UnsupportedMediaError("В файле нет аудиодорожки")
+    if info["has_video"]:
+        # Видео весит в разы больше звука — в Whisper уходит только дорожка
+        return "remux" if codec in COPY_CODECS else "transcode"
+    if too_big:
+        return "transcode"
+    if info["format"] in WHISPER_FORMATS and codec in PASSTHROUGH_CODECS:
+        return "passthrough"
+    return "copy" if codec in COPY_CODECS else "transcode"
+
+
+def _with_ext(path, ext):
+    # Whisper определяет формат по имени: голосовое .oga или файл без расширения переименовываем
+    if path.lower().endswith(ext):
+        return path
+    target = path + ext
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return target
+
+
+def _trim(path, info):
+    """Обрезка пауз, если она окупается; иначе (None, статистика или None)"""
+    if not info.get("probed") or info["duration"] < TRIM_MIN_DURATION:
+        return None, None
+    try:
+        return trim_silence(path, path + "_trimmed.mp3")
+    except ImportError:
+        print("Warning: numpy is not installed, silence trimming is skipped")
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"Warning: silence trimming failed: {e}")
+    return None, None
+
+
+def prepare_audio(path, trim=TRIM_SILENCE, info=None):
+    """
+    Готовит файл для Whisper самым дешевым подходящим способом.
+    Возвращает (путь, маршрут, статистика обрезки пауз или None);
+    путь может совпадать с исходным. info — уже готовый результат probe(path).
+    """
+    info = info or probe(path)
+    route = plan_route(info)
+
+    stats = None
+    if trim:
+        trimmed, stats = _trim(path, info)
+        if trimmed:
+            return trimmed, "trim", stats
+
+    if route == "passthrough":
+        # m4a и mp4 — один контейнер; видео сюда не попадает
+        return _with_ext(path, WHISPER_FORMATS[info["format"]]), route, stats
+    if route in ("copy", "remux"):
+        output_path = path + "_audio" + COPY_CODECS[info["audio_codec"]]
+        _ffmpeg(["-i", path, "-vn", "-map", "0:a:0", "-c:a", "copy", output_path])
+        # Дорожка без сжатия может оказаться больше лимита — тогда все-таки перекодируем
+        if os.path.getsize(output_path) / (1024 * 1024) <= WHISPER_MAX_MB:
+            return output_path, route, stats
+        os.remove(output_path)
+        route = "transcode"
+    return transcode_audio(path, path + "_compressed.mp3"), route, stats
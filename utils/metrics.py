@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# --- НАСТРОЙКИ ---
+# VYUD_METRICS: "" / "0" — выключено (span() ничего не делает),
+# "1" — гистограммы в памяти (бот отдает их на METRICS_PORT),
+# "log" — плюс JSON-строка в лог на каждый этап (для Streamlit, где нет своего HTTP)
+MODE = os.getenv("VYUD_METRICS", "").strip().lower()
+ENABLED = MODE not in ("", "0", "false", "off")
+LOG_SPANS = MODE == "log"
+
+# Границы бакетов в секундах: от кэша (миллисекунды) до часовой лекции в Whisper
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+PREFIX = "vyud"
+# Расширение файла в метках — только из известного списка, остальное "other":
+# иначе каждое новое расширение от пользователя заводит свой временной ряд
+EXT_LABELS = {".pdf", ".docx", ".pptx", ".xlsx", ".txt", ".md"}
+
+logger = logging.getLogger("vyud.metrics")
+_lock = threading.Lock()
+_histograms = {}   # (stage, labels) -> [counts по бакетам, сумма, число]
+_counters = {}     # (name, stage, labels) -> значение
+
+
+def enable(log_spans=False):
+    """Включает сбор метрик из кода (например, если задан METRICS_PORT)"""
+    global ENABLED, LOG_SPANS
+    ENABLED = True
+    LOG_SPANS = LOG_SPANS or log_spans
+
+
+# --- ЗАПИСЬ ---
+
+def observe(stage, seconds, **labels):
+    """Добавляет одно измерение длительности этапа в гистограмму"""
+    if not ENABLED:
+        return
+    key = (stage, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+                break
+        hist[1] += seconds
+        hist[2] += 1
+
+
+def ext_label(ext):
+    """Значение метки ext: известное расширение или «other»"""
+    ext = (ext or "").lower()
+    return ext if ext in EXT_LABELS else "other"
+
+
+def count(name, stage, value, **labels):
+    """Увеличивает счетчик (байты, токены, символы) этапа"""
+    if not ENABLED:
+        return
+    key = (name, stage, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class Span:
+    """
+    Замер одного этапа. Атрибуты:
+    - строки и bool — метки гистограммы (только с малым числом значений: тип файла, кэш);
+    - числа — счетчики <имя>_total (байты, токены).
+    Итог (outcome) — "ok" или имя исключения.
+    """
+
+    __slots__ = ("stage", "attrs", "start")
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        outcome = "ok" if exc_type is None else exc_type.__name__
+        labels = {"outcome": outcome}
+        numbers = {}
+        for name, value in self.attrs.items():
+            if isinstance(value, (str, bool)):
+                labels[name] = str(value).lower() if isinstance(value, bool) else value
+            elif isinstance(value, (int, float)):
+                numbers[name] = value
+        observe(self.stage, seconds, **labels)
+        for name, value in numbers.items():
+            count(name, self.stage, value, **{k: v for k, v in labels.items() if k != "outcome"})
+        if LOG_SPANS:
+            logger.info(json.dumps(
+                {"stage": self.stage, "seconds": round(seconds, 4), **labels, **numbers}, ensure_ascii=False
+            ))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage, **attrs):
+    """
+    with span("extract", mode="whisper") as s: ...; s.set(input_bytes=n)
+    Если метрики выключены — возвращает общий пустой объект (без замеров и аллокаций).
+    """
+    if not ENABLED:
+        return _NOOP
+    return Span(stage, attrs)
+
+
+# --- ЭКСПОРТ ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    """Текущие метрики в текстовом формате Prometheus (exposition format 0.0.4)"""
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    name = f"{PREFIX}_stage_seconds"
+    lines = [f"# HELP {name} Длительность этапов пайплайна", f"# TYPE {name} histogram"]
+    for (stage, labels), (buckets, total, n) in sorted(histograms.items()):
+        base = (("stage", stage),) + labels
+        cumulative = 0
+        for bound, value in zip(BUCKETS, buckets):
+            cumulative += value
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{name}_bucket{_format_labels(base, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(base)} {total}")
+        lines.append(f"{name}_count{_format_labels(base)} {n}")
+
+    for counter in sorted({k[0] for k in counters}):
+        metric = f"{PREFIX}_stage_{counter}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (c_name, stage, labels), value in sorted(counters.items()):
+            if c_name == counter:
+                lines.append(f"{metric}{_format_labels((('stage', stage),) + labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+async def start_http_server(port, host="0.0.0.0"):
+    """Отдает /metrics для Prometheus из процесса бота (aiohttp уже есть как зависимость aiogram)"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def log_to_stderr():
+    """Structured-log режим для Streamlit: JSON-строки этапов в stderr"""
+    global LOG_SPANS
+    LOG_SPANS = True
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
@@ -0,0 +1,249 @@
+import math
+import re
+
+# Подготовка текста к промпту: убираем повторяющийся мусор (колонтитулы, номера
+# страниц, дубли абзацев) и, если текст не влезает в бюджет, оставляем самые
+# информативные фрагменты по всей длине документа (BM25 на numpy).
+
+# --- НАСТРОЙКИ ---
+CHARS_PER_TOKEN = 4         # та же грубая оценка, что в logic.py
+PASSAGE_CHARS = 1200        # длинные абзацы (транскрипты) режем по предложениям
+HEADING_CHARS = 80          # короткий абзац без точки — заголовок, склеиваем со следующим
+BOILERPLATE_LINE_CHARS = 150
+BOILERPLATE_MIN_REPEATS = 3
+EDGE_LINES = 3             # сколько строк сверху и снизу страницы проверять на колонтитулы
+NEAR_DUP_JACCARD = 0.8
+REGIONS = 8                 # бюджет делится между частями документа, чтобы не брать все из начала
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+PAGE_NUMBER_RE = re.compile(
+    r"^\s*(?:[-–—]\s*)?(?:(?:page|стр\.?|страница|с\.)\s*)?\d{1,4}(?:\s*(?:/|of|из)\s*\d{1,4})?(?:\s*[-–—])?\s*$",
+    re.IGNORECASE,
+)
+PAGE_BREAK_RE = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+# --- ОЧИСТКА ---
+
+def _line_key(line):
+    """Нормализация строки колонтитула: номера и даты меняются от страницы к странице"""
+    return re.sub(r"\d+", "#", line.lower()).strip(" #|-–—*_.")
+
+
+def _is_candidate(line):
+    # Заголовки Markdown («## Раздел 3») повторяются по смыслу, а не как колонтитул
+    return line and len(line) <= BOILERPLATE_LINE_CHARS and not line.startswith("#") and any(
+        ch.isalpha() for ch in line
+    )
+
+
+def strip_boilerplate(text):
+    """
+    Удаляет номера страниц, разделители страниц (---) и колонтитулы:
+    - строки, дословно повторяющиеся много раз в любом месте;
+    - первые/последние строки страниц, отличающиеся только числами («Стр. 3 из 10»),
+      если они есть на половине страниц (нужна явная разбивка на страницы).
+    """
+    pages = [[]]
+    for line in text.split("\n"):
+        if PAGE_BREAK_RE.match(line):
+            pages.append([])
+        else:
+            pages[-1].append(line)
+    threshold = max(BOILERPLATE_MIN_REPEATS, math.ceil(len(pages) * 0.3))
+
+    exact = {}
+    for page in pages:
+        for line in page:
+            stripped = line.strip()
+            if _is_candidate(stripped):
+                exact[stripped.lower()] = exact.get(stripped.lower(), 0) + 1
+
+    edge_keys = {}
+    edges = []
+    if len(pages) >= BOILERPLATE_MIN_REPEATS:
+        for page in pages:
+            filled = [i for i, line in enumerate(page) if line.strip()]
+            edge = set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+            edges.append(edge)
+            for key in {_line_key(page[i].strip()) for i in edge if _is_candidate(page[i].strip())}:
+                edge_keys[key] = edge_keys.get(key, 0) + 1
+    numbered = {key for key, n in edge_keys.items() if n >= max(threshold, math.ceil(len(pages) * 0.5))}
+
+    kept = []
+    for n, page in enumerate(pages):
+        for i, line in enumerate(page):
+            stripped = line.strip()
+            if stripped and PAGE_NUMBER_RE.match(stripped):
+                continue
+            if _is_candidate(stripped) and (
+                exact[stripped.lower()] >= threshold
+                or (edges and i in edges[n] and _line_key(stripped) in numbered)
+            ):
+                continue
+            kept.append(line)
+        kept.append("")
+    return "\n".join(kept)
+
+
+def split_passages(text, max_chars=PASSAGE_CHARS):
+    """Абзацы как единицы отбора: заголовки приклеены к тексту, длинные куски порезаны по предложениям"""
+    passages = []
+    heading = ""
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) < HEADING_CHARS and not para.endswith((".", "!", "?", ":", ";")):
+            heading = f"{heading}\n{para}" if heading else para
+            continue
+        if heading:
+            para = f"{heading}\n{para}"
+            heading = ""
+        if len(para) <= max_chars:
+            passages.append(para)
+            continue
+        current = ""
+        for sentence in SENTENCE_END_RE.split(para):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+        if current:
+            passages.append(current)
+    if heading:
+        passages.append(heading)
+    return passages
+
+
+def _shingles(words):
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def dedupe_passages(passages):
+    """
+    Убирает повторы: точные (с точностью до цифр и пунктуации) и почти точные
+    (Jaccard по словесным триграммам). Кандидаты сравниваются только внутри
+    корзин по первым и последним словам — без попарного перебора всего документа.
+    """
+    seen = set()
+    buckets = {}
+    kept = []
+    for passage in passages:
+        words = re.sub(r"\d+", "#", passage.lower()).split()
+        words = [w.strip(".,;:!?()«»\"'") for w in words]
+        key = " ".join(words)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        shingles = _shingles(words)
+        bucket_keys = (("head", tuple(words[:4])), ("tail", tuple(words[-4:])))
+        duplicate = False
+        if len(words) >= 8:
+            for bucket_key in bucket_keys:
+                for other in buckets.get(bucket_key, ()):
+                    if len(shingles & other) / len(shingles | other) >= NEAR_DUP_JACCARD:
+                        duplicate = True
+                        break
+                if duplicate:
+                    break
+        if duplicate:
+            continue
+        for bucket_key in bucket_keys:
+            buckets.setdefault(bucket_key, []).append(shingles)
+        kept.append(passage)
+    return kept
+
+
+def clean_passages(text):
+    return dedupe_passages(split_passages(strip_boilerplate(text)))
+
+
+def clean_text(text):
+    """Текст без колонтитулов и дублей (порядок абзацев сохраняется)"""
+    return "\n\n".join(clean_passages(text))
+
+
+# --- ОТБОР ПО БЮДЖЕТУ ---
+
+def bm25_scores(passages):
+    """
+    Информативность каждого фрагмента: BM25 против «запроса» из терминов всего
+    документа (частые в документе, но не встречающиеся везде). Все вычисления — numpy.
+    """
+    import numpy as np
+
+    vocab = {}
+    rows, cols = [], []
+    for i, passage in enumerate(passages):
+        for term in re.findall(r"\w{3,}", passage.lower()):
+            term_id = vocab.get(term)
+            if term_id is None:
+                term_id = vocab[term] = len(vocab)
+            rows.append(i)
+            cols.append(term_id)
+    n, v = len(passages), len(vocab)
+    if not v:
+        return np.zeros(n)
+
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    pairs, tf = np.unique(rows * v + cols, return_counts=True)
+    p_row, p_col = pairs // v, pairs % v
+
+    df = np.bincount(p_col, minlength=v)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    length = np.bincount(rows, minlength=n).astype(float)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / max(length.mean(), 1.0))
+    weight = idf[p_col] * tf * (BM25_K1 + 1) / (tf + norm[p_row])
+
+    # Вес термина в «запросе»: сколько раз встречается в документе, с поправкой на idf
+    query = np.log1p(np.bincount(cols, minlength=v)) * idf
+    return np.bincount(p_row, weights=weight * query[p_col], minlength=n)
+
+
+def select_passages(text, token_budget, chars_per_token=CHARS_PER_TOKEN, cleaned=False):
+    """
+    Чистит текст и, если он больше token_budget, оставляет самые информативные
+    фрагменты. Бюджет распределяется между REGIONS частями документа пропорционально
+    их объему, остаток добирается лучшими фрагментами. Порядок фрагментов — исходный.
+    cleaned=True — текст уже прошел clean_text, повторно только режем на фрагменты.
+    """
+    passages = split_passages(text) if cleaned else clean_passages(text)
+    costs = [len(p) // chars_per_token + 1 for p in passages]
+    total = sum(costs)
+    if total <= token_budget:
+        return "\n\n".join(passages)
+
+    try:
+        scores = bm25_scores(passages)
+    except ImportError:
+        print("Warning: numpy is not installed, passages are picked by position only")
+        scores = [-i for i in range(len(passages))]
+
+    # Границы частей документа по накопленному объему
+    region_of, acc = [], 0
+    for cost in costs:
+        region_of.append(min(REGIONS - 1, acc * REGIONS // total))
+        acc += cost
+    region_budget = [0.0] * REGIONS
+    for region, cost in zip(region_of, costs):
+        region_budget[region] += cost * token_budget / total
+
+    order = sorted(range(len(passages)), key=lambda i: (-float(scores[i]), i))
+    chosen, used = set(), 0
+    region_used = [0] * REGIONS
+    for i in order:
+        region = region_of[i]
+        if region_used[region] + costs[i] <= region_budget[region] and used + costs[i] <= token_budget:
+            chosen.add(i)
+            region_used[region] += costs[i]
+            used += costs[i]
+    for i in order:
+        if i not in chosen and used + costs[i] <= token_budget:
+            chosen.add(i)
+            used += costs[i]
+    return "\n\n".join(passages[i] for i in sorted(chosen))
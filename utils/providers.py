@@ -0,0 +1,123 @@
+import os
+import random
+import threading
+import time
+
+# httpx, openai и llama_index импортируются при первом использовании
+from utils.ratelimit import RateLimiter
+from utils.metrics import span
+
+# --- НАСТРОЙКИ ---
+# Лимиты аккаунта OpenAI (по умолчанию — консервативные значения для tier 1)
+LIMITS = {
+    "chat": (int(os.getenv("OPENAI_RPM", "500")), int(os.getenv("OPENAI_TPM", "30000"))),
+    "whisper": (int(os.getenv("WHISPER_RPM", "50")), None),
+}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0     # секунды
+BACKOFF_MAX = 30.0
+
+_lock = threading.Lock()
+_http_client = None
+_clients = {}      # api_key -> OpenAIClient
+_llms = {}         # (api_key, model, temperature) -> llama_index OpenAI
+_limiters = {}     # (kind, api_key) -> RateLimiter
+
+
+def _key(api_key):
+    return api_key or os.getenv("OPENAI_API_KEY") or ""
+
+
+def get_http_client():
+    """Один httpx-клиент с пулом keep-alive соединений на весь процесс"""
+    global _http_client
+    import httpx
+
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+            )
+        return _http_client
+
+
+def get_openai_client(api_key=None):
+    """Долгоживущий клиент OpenAI на ключ (Whisper и прямые вызовы API)"""
+    from openai import OpenAI as OpenAIClient
+
+    key = _key(api_key)
+    http_client = get_http_client()
+    with _lock:
+        if key not in _clients:
+            # Ретраи делаем сами (call_with_limits), чтобы не умножать их
+            _clients[key] = OpenAIClient(api_key=key or None, http_client=http_client, max_retries=0)
+        return _clients[key]
+
+
+def get_llm(model="gpt-4o", temperature=0.2, api_key=None):
+    """LLM для LlamaIndex: передается явно, глобальный Settings.llm не трогаем"""
+    from llama_index.llms.openai import OpenAI
+
+    key = _key(api_key)
+    http_client = get_http_client()
+    with _lock:
+        cache_key = (key, model, temperature)
+        if cache_key not in _llms:
+            _llms[cache_key] = OpenAI(
+                model=model,
+                temperature=temperature,
+                api_key=key or None,
+                max_retries=0,
+                http_client=http_client,
+            )
+        return _llms[cache_key]
+
+
+def get_rate_limiter(kind="chat", api_key=None):
+    key = (kind, _key(api_key))
+    with _lock:
+        if key not in _limiters:
+            rpm, tpm = LIMITS[kind]
+            _limiters[key] = RateLimiter(rpm, tpm)
+        return _limiters[key]
+
+
+def estimate_tokens(*texts):
+    """Грубая оценка токенов (≈4 символа на токен) — для TPM-лимита этого достаточно"""
+    return sum(len(t) for t in texts if t) // 4
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_limits(fn, kind="chat", tokens=0, api_key=None):
+    """
+    Вызывает fn() в рамках RPM/TPM лимитов ключа.
+    На 429 и сетевые обрывы — повтор с экспоненциальной задержкой и джиттером
+    (не раньше, чем просит Retry-After).
+    """
+    from openai import RateLimitError, APIConnectionError
+
+    limiter = get_rate_limiter(kind, api_key)
+    for attempt in range(MAX_RETRIES + 1):
+        with span("openai.wait", kind=kind):
+            limiter.acquire(tokens)
+        try:
+            # Токены — оценка для лимитера (estimate_tokens), а не usage из ответа
+            with span("openai", kind=kind, estimated_tokens=tokens, retry=attempt > 0):
+                return fn()
+        except (RateLimitError, APIConnectionError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            delay = max(delay, _retry_after(e) or 0)
+            print(f"Warning: {kind} rate limited, retry in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
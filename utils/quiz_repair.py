@@ -0,0 +1,300 @@
+import json
+import re
+
+# Разбор и починка ответа LLM с тестом без повторного запроса: обрезанный JSON,
+# индекс ответа не в диапазоне, лишние/пустые варианты, лимиты Telegram.
+# Что починить нельзя (вопрос длиннее лимита, нет вариантов), отдается
+# вызывающему с причиной — переспрашивается только этот вопрос.
+
+# --- ЛИМИТЫ TELEGRAM (sendPoll) ---
+QUESTION_MAX = 300
+OPTION_MAX = 100
+EXPLANATION_MAX = 200
+MIN_OPTIONS = 2
+MAX_OPTIONS = 10
+
+FIELD_ALIASES = {
+    "scenario": ("scenario", "question", "text", "prompt"),
+    "options": ("options", "answers", "choices", "variants"),
+    "correct_option_id": ("correct_option_id", "correct_option", "correct_answer", "correct", "answer", "answer_index"),
+    "explanation": ("explanation", "rationale", "comment"),
+}
+OPTION_LABEL_RE = re.compile(r"^\s*(?:[A-JА-Е]|\d{1,2})[\).:]\s+")
+LETTERS = "ABCDEFGHIJ"
+CYRILLIC_LETTERS = "АБВГДЕ"
+
+
+class QuestionStreamParser:
+    """
+    Инкрементальный разбор ответа LLM: feed() получает очередной кусок текста
+    и возвращает JSON-строки вопросов, объекты которых уже закрылись.
+    Понимает и {"questions": [...]}, и голый массив [...].
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.array_depth = None
+        self.in_string = False
+        self.escape = False
+        self.current = None   # символы текущего вопроса
+
+    def feed(self, chunk):
+        completed = []
+        for ch in chunk:
+            if self.current is not None:
+                self.current.append(ch)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch == "[":
+                self.depth += 1
+                if self.array_depth is None:
+                    self.array_depth = self.depth
+            elif ch == "{":
+                if self.array_depth is not None and self.depth == self.array_depth:
+                    self.current = ["{"]
+                self.depth += 1
+            elif ch in "]}":
+                self.depth -= 1
+                if ch == "}" and self.current is not None and self.depth == self.array_depth:
+                    completed.append("".join(self.current))
+                    self.current = None
+        return completed
+
+
+def loads_lenient(raw):
+    """json.loads, который прощает висячие запятые; None, если не разобрать"""
+    for candidate in (raw, re.sub(r",\s*([}\]])", r"\1", raw)):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+def extract_questions(raw):
+    """
+    Объекты вопросов из ответа модели — даже если ответ обрезан на середине
+    (закрывшиеся вопросы сохраняются) или обернут в ```json. Неразобранный
+    объект возвращается строкой.
+    """
+    raw = re.sub(r"^\s*```(?:json)?|```\s*$", "", raw.strip())
+    objects = QuestionStreamParser().feed(raw)
+    if objects:
+        return [loads_lenient(obj) or obj for obj in objects]
+    # Модель вернула один вопрос без массива
+    data = loads_lenient(raw[raw.find("{"):]) if "{" in raw else None
+    return [data] if isinstance(data, dict) else []
+
+
+def _field(data, name):
+    for key in FIELD_ALIASES[name]:
+        if key in data:
+            return data[key]
+    return None
+
+
+def _correct_index(value, options, raw_count):
+    """Индекс правильного ответа из числа, строки «2», буквы «B» или текста варианта"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, str):
+        text = OPTION_LABEL_RE.sub("", value).strip()
+        if value.strip().isdigit():
+            value = int(value.strip())
+        elif len(value.strip()) == 1 and value.strip().upper() in LETTERS + CYRILLIC_LETTERS:
+            letter = value.strip().upper()
+            value = LETTERS.find(letter) if letter in LETTERS else CYRILLIC_LETTERS.find(letter)
+        else:
+            lowered = [o.lower() for o in options]
+            return lowered.index(text.lower()) if text.lower() in lowered else None
+    if not isinstance(value, int):
+        return None
+    if 0 <= value < raw_count:
+        return value
+    if value == raw_count:
+        return value - 1   # нумерация с единицы
+    return None
+
+
+def shorten(text, limit):
+    """Укорачивает по границе предложения, а если не выйдет — слова, с многоточием"""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    sentence = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if sentence >= limit // 2:
+        return cut[:sentence + 1]
+    space = cut[:limit - 1].rfind(" ")
+    return (cut[:space] if space >= limit // 2 else cut[:limit - 1]).rstrip(" ,;:-") + "…"
+
+
+def normalize_question(data):
+    """
+    Приводит вопрос к схеме и лимитам Telegram.
+    Возвращает (вопрос, None) или (None, причина), если нужен повторный запрос.
+    """
+    if not isinstance(data, dict):
+        return None, "JSON вопроса не разбирается"
+
+    scenario = _field(data, "scenario")
+    if not isinstance(scenario, str) or not scenario.strip():
+        return None, "нет текста вопроса"
+    scenario = scenario.strip()
+    if len(scenario) > QUESTION_MAX:
+        return None, f"вопрос длиннее {QUESTION_MAX} символов"
+
+    raw_options = _field(data, "options")
+    if not isinstance(raw_options, list):
+        return None, "нет списка вариантов"
+    texts = []
+    for option in raw_options:
+        if isinstance(option, dict):
+            option = option.get("text") or option.get("option") or ""
+        texts.append(str(option).strip() if option is not None else "")
+    # «A) ...», «1. ...» — метки только мешают в опросе
+    if texts and all(OPTION_LABEL_RE.match(t) for t in texts):
+        texts = [OPTION_LABEL_RE.sub("", t) for t in texts]
+
+    correct = _correct_index(_field(data, "correct_option_id"), texts, len(texts))
+    if correct is None:
+        return None, "индекс правильного ответа вне диапазона"
+
+    # Пустые и повторяющиеся варианты выкидываем, индекс ответа пересчитываем
+    options, position, new_correct = [], {}, None
+    for i, text in enumerate(texts):
+        key = text.lower()
+        if text and key not in position:
+            position[key] = len(options)
+            options.append(text)
+        if i == correct:
+            new_correct = position.get(key)
+    if new_correct is None:
+        return None, "правильный вариант пустой"
+    if len(options) < MIN_OPTIONS:
+        return None, f"меньше {MIN_OPTIONS} вариантов"
+    if len(options) > MAX_OPTIONS:
+        # Лишние дистракторы отбрасываем, правильный оставляем
+        keep = [i for i in range(len(options)) if i != new_correct][:MAX_OPTIONS - 1] + [new_correct]
+        keep.sort()
+        options = [options[i] for i in keep]
+        new_correct = keep.index(new_correct)
+    if any(len(o) > OPTION_MAX for o in options):
+        return None, f"вариант длиннее {OPTION_MAX} символов"
+
+    explanation = _field(data, "explanation")
+    explanation = shorten(str(explanation).strip(), EXPLANATION_MAX) if explanation else ""
+
+    return {
+        "scenario": scenario,
+        "options": options,
+        "correct_option_id": new_correct,
+        "explanation": explanation,
+    }, None
+
+
+def fit_limits(data):
+    """
+    Последний шанс после неудачного повтора: подрезает длинные поля и прогоняет
+    normalize_question еще раз. Вопрос или None.
+    """
+    if not isinstance(data, dict):
+        return None
+    data = dict(data)
+    scenario = _field(data, "scenario")
+    if isinstance(scenario, str):
+        data["scenario"] = shorten(scenario.strip(), QUESTION_MAX)
+    options = _field(data, "options")
+    if isinstance(options, list):
+        data["options"] = [shorten(o.strip(), OPTION_MAX) if isinstance(o, str) else o for o in options]
+    return normalize_question(data)[0]
+
+
+# --- ПОВТОРНЫЙ ЗАПРОС ---
+
+def fix_prompt(items, lang):
+    """Запрос на переписывание сломанных вопросов: items — {id: (объект, причина)}"""
+    listing = "\n".join(
+        f"id {i}. Problem: {problem}\n{json.dumps(item, ensure_ascii=False)}" for i, (item, problem) in items.items()
+    )
+    return (
+        f"These quiz questions break the format rules. Rewrite each one, keeping its meaning and correct answer. "
+        f"Language: '{lang}'. Rules: 'scenario' at most {QUESTION_MAX} characters, each option at most "
+        f"{OPTION_MAX}, 'explanation' at most {EXPLANATION_MAX}; {MIN_OPTIONS} to {MAX_OPTIONS} options; "
+        f"'correct_option_id' is a 0-based index into 'options'. Copy each question's id into the 'id' field.\n\n"
+        "Output format: return ONLY a JSON object, no markdown fences, exactly like:\n"
+        '{"questions": [{"id": 0, "scenario": "...", "options": ["...", "..."], "correct_option_id": 0, '
+        '"explanation": "..."}]}'
+        "\n\nQuestions:\n" + listing
+    )
+
+
+def match_repaired(ids, raw):
+    """
+    Ответ на fix_prompt -> {id: вопрос} только для вопросов, которые модель починила.
+    Сопоставление по полю id; без id — по порядку, и то лишь если модель вернула
+    ровно столько вопросов, сколько просили.
+    """
+    items = extract_questions(raw)
+    with_ids = any(isinstance(item, dict) and "id" in item for item in items)
+    positional = not with_ids and len(items) == len(ids)
+    repaired = {}
+    for n, item in enumerate(items):
+        if with_ids:
+            try:
+                key = int(item.get("id")) if isinstance(item, dict) else None
+            except (TypeError, ValueError):
+                continue
+        else:
+            key = ids[n] if positional else None
+        if key not in ids or key in repaired:
+            continue
+        fixed, _ = normalize_question(item)
+        if fixed:
+            repaired[key] = fixed
+    return repaired
+
+
+def repair_slots(slots, count, ask_fix, ask_more):
+    """
+    Вторая попытка только для проблемных вопросов.
+    slots — ответ модели по порядку: годный вопрос (dict) или (объект, причина).
+    ask_fix(items) переписывает сломанные ({id: (объект, причина)} -> ответ модели),
+    ask_more(n, уже_есть) догенерирует недостающие (ответ модели или None).
+    Починенные встают на места исходных; не починенные подрезаются под лимиты
+    (fit_limits) или выбрасываются; добранные до count — в конец.
+    """
+    broken = {i: slot for i, slot in enumerate(slots) if isinstance(slot, tuple)}
+    fixable = {i: slot for i, slot in broken.items() if isinstance(slot[0], dict)}
+    repaired = {}
+    if fixable:
+        raw = ask_fix(fixable)
+        if raw:
+            repaired = match_repaired(list(fixable), raw)
+    # Последний шанс без модели: подрезаем длинные поля
+    for i, (item, _) in fixable.items():
+        if i not in repaired:
+            fixed = fit_limits(item)
+            if fixed:
+                repaired[i] = fixed
+
+    result = [repaired[i] if i in broken else slot for i, slot in enumerate(slots) if i not in broken or i in repaired]
+    missing = count - len(result)
+    if missing > 0:
+        raw = ask_more(missing, result)
+        if raw:
+            extra = [q for q in map(lambda item: normalize_question(item)[0], extract_questions(raw)) if q]
+            result += extra[:missing]
+    return result[:count]
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket с резервированием: запрос сразу «занимает» токены (баланс может
+    уйти в минус) и получает время ожидания. Так конкурирующие запросы
+    выстраиваются в очередь равномерно, а не будят друг друга пачками.
+    Потокобезопасен; есть синхронное и асинхронное ожидание.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n=1):
+        """Занимает n токенов и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(n, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self, n=1):
+        wait = self.reserve(n)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, n=1):
+        wait = self.reserve(n)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Пара лимитов API: запросы в минуту (RPM) и токены в минуту (TPM)"""
+
+    def __init__(self, rpm, tpm=None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def _reserve(self, tokens):
+        wait = self.requests.reserve(1)
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+from collections import deque
+
+from utils.ratelimit import TokenBucket
+from utils.metrics import span
+
+# --- ЛИМИТЫ TELEGRAM ---
+# Глобально ~30 сообщений в секунду, в личный чат ~1 в секунду (короткие всплески
+# допустимы), в группу — 20 в минуту
+GLOBAL_PER_MINUTE = int(os.getenv("TG_GLOBAL_PER_MINUTE", "1800"))
+CHAT_PER_MINUTE = int(os.getenv("TG_CHAT_PER_MINUTE", "60"))
+CHAT_BURST = 3
+GROUP_PER_MINUTE = 20
+MAX_RETRIES = 5
+MAX_IDLE_CHATS = 10000     # после этого забываем лимитеры чатов, в которые давно не писали
+
+
+class MessageSender:
+    """
+    Исходящие сообщения бота с учетом лимитов Telegram.
+    - Порядок внутри чата сохраняется: у каждого чата своя очередь и один воркер.
+    - Разные чаты отправляются параллельно в пределах глобального лимита.
+    - На 429 ждем retry_after (TelegramRetryAfter) и повторяем то же сообщение.
+    """
+
+    def __init__(self, global_per_minute=GLOBAL_PER_MINUTE, chat_per_minute=CHAT_PER_MINUTE,
+                 chat_burst=CHAT_BURST, group_per_minute=GROUP_PER_MINUTE, max_retries=MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_per_minute, capacity=global_per_minute // 60)
+        self.chat_per_minute = chat_per_minute
+        self.chat_burst = chat_burst
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self._queues = {}      # chat_id -> deque[(factory, kind, future)]
+        self._workers = {}     # chat_id -> asyncio.Task
+        self._buckets = {}     # chat_id -> TokenBucket
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_CHATS:
+                self._prune()
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_per_minute, capacity=self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_per_minute, capacity=self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        # Полный бакет ничем не отличается от нового — такие можно выбросить
+        for chat_id, bucket in list(self._buckets.items()):
+            bucket.reserve(0)
+            if chat_id not in self._workers and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+
+    def submit(self, chat_id, factory, kind="message"):
+        """
+        Ставит отправку в очередь чата. factory() должна вернуть корутину вызова
+        Bot API (например, lambda: bot.send_poll(...)). Возвращает future с результатом.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((factory, kind, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        return future
+
+    async def send(self, chat_id, factory, kind="message"):
+        """Отправляет и ждет результата (порядок с остальными сообщениями чата сохраняется)"""
+        return await self.submit(chat_id, factory, kind)
+
+    async def drain(self, chat_id=None):
+        """Дожидается отправки всего, что уже в очередях (для остановки бота); chat_id — только этого чата"""
+        while True:
+            workers = [task for chat, task in self._workers.items() if chat_id is None or chat == chat_id]
+            if not workers:
+                return
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                factory, kind, future = queue.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = await self._deliver(chat_id, factory, kind)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+
+    async def _deliver(self, chat_id, factory, kind):
+        bucket = self._bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire_async()
+            await self.global_bucket.acquire_async()
+            try:
+                with span(f"telegram.{kind}", retry=attempt > 0):
+                    return await factory()
+            except Exception as e:
+                # TelegramRetryAfter (aiogram) несет retry_after в секундах
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                print(f"Warning: flood control in chat {chat_id}, retry in {retry_after}s")
+                await asyncio.sleep(retry_after)
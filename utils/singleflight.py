@@ -0,0 +1,71 @@
+import asyncio
+
+
+class _Flight:
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых задач, которые идут одновременно (asyncio).
+    Первый вызов stream(key, ...) запускает генератор в отдельной задаче, остальные
+    с тем же ключом подписываются на него: каждый получает все элементы с начала
+    и дальше по мере появления. Ошибка генератора (и отмена) достается всем подписчикам.
+    Ключ забывается, как только генератор закончился — это не кэш результатов.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def running(self, key):
+        return key in self._flights
+
+    def stream(self, key, factory):
+        """
+        Асинхронный итератор по элементам factory() (асинхронного генератора).
+        Возвращает (итератор, shared): shared=True, если работу делает другой вызов.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if not shared:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+        return self._follow(flight), shared
+
+    async def _run(self, key, flight, factory):
+        try:
+            async for item in factory():
+                flight.items.append(item)
+                flight.wake()
+        except Exception as e:
+            flight.error = e
+        except asyncio.CancelledError as e:
+            # Отмена ведущей задачи (остановка бота) — подписчики тоже получают отмену,
+            # а не тихий конец потока без элементов
+            flight.error = e
+            raise
+        finally:
+            flight.done = True
+            self._flights.pop(key, None)
+            flight.wake()
+
+    async def _follow(self, flight):
+        i = 0
+        while True:
+            while i < len(flight.items):
+                yield flight.items[i]
+                i += 1
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await flight.changed.wait()
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from utils.cache import CACHE_DIR
+
+# --- НАСТРОЙКИ ---
+# Очередь входящих апдейтов Telegram для webhook-режима (переживает рестарт и деплой)
+QUEUE_PATH = Path(os.getenv("VYUD_UPDATES_PATH", CACHE_DIR / "vyud_updates.sqlite"))
+LEASE_SECONDS = 120      # воркер продлевает аренду, пока задача идет
+MAX_ATTEMPTS = 3         # после стольких падений/аренд апдейт откладывается в dead
+DONE_TTL = 24 * 3600     # столько помним обработанные update_id (Telegram повторяет не дольше суток)
+PURGE_INTERVAL = 600     # как часто удаляем старые обработанные записи
+
+
+class UpdateQueue:
+    """
+    Надежная очередь на SQLite: webhook кладет апдейт (put), воркер берет его в аренду
+    (lease), продлевает (extend) и подтверждает (ack) после обработки. Если воркер упал,
+    аренда истекает и апдейт достается следующему. Повторы Telegram отсекаются по update_id:
+    обработанный апдейт остается в таблице меткой 'done' еще DONE_TTL секунд.
+    Апдейты шардируются по чату: один чат всегда обрабатывает один воркер
+    (порядок сообщений и сборка альбомов остаются в одном процессе).
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else QUEUE_PATH
+        self._ready = False
+        self._purged_at = 0.0
+
+    def _connect(self):
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS updates ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " update_id INTEGER UNIQUE NOT NULL,"
+                " chat_id INTEGER NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'queued',"
+                " lease_until REAL NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS updates_ready ON updates (status, lease_until, id)")
+            self._ready = True
+        return conn
+
+    def put(self, update_id, chat_id, payload):
+        """Сохраняет апдейт; повтор того же update_id игнорируется. True — апдейт новый"""
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO updates (update_id, chat_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                (update_id, chat_id, payload, time.time()),
+            )
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def lease(self, shard=0, shards=1, limit=1, lease_seconds=LEASE_SECONDS):
+        """Берет до limit апдейтов своего шарда (chat_id % shards == shard): [(id, payload)]"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, payload, attempts FROM updates"
+                " WHERE status IN ('queued', 'leased') AND lease_until < ? AND abs(chat_id) % ? = ?"
+                " ORDER BY id LIMIT ?",
+                (now, shards, shard, limit),
+            ).fetchall()
+            leased = []
+            for row_id, payload, attempts in rows:
+                if attempts >= MAX_ATTEMPTS:
+                    # Апдейт роняет воркер раз за разом — не блокируем им очередь
+                    conn.execute("UPDATE updates SET status = 'dead' WHERE id = ?", (row_id,))
+                    print(f"Warning: update {row_id} moved to dead after {attempts} attempts")
+                    continue
+                conn.execute(
+                    "UPDATE updates SET status = 'leased', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now + lease_seconds, row_id),
+                )
+                leased.append((row_id, payload))
+            conn.execute("COMMIT")
+            return leased
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def extend(self, ids, lease_seconds=LEASE_SECONDS):
+        """Продлевает аренду задач, которые еще выполняются"""
+        if not ids:
+            return
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "UPDATE updates SET lease_until = ? WHERE id = ? AND status = 'leased'",
+                [(time.time() + lease_seconds, row_id) for row_id in ids],
+            )
+        finally:
+            conn.close()
+
+    def ack(self, row_id):
+        """Апдейт обработан: тело удаляем, update_id оставляем, чтобы отсечь повтор Telegram"""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE updates SET status = 'done', payload = '', lease_until = 0 WHERE id = ?", (row_id,))
+        finally:
+            conn.close()
+        if time.time() - self._purged_at > PURGE_INTERVAL:
+            self.purge()
+
+    def purge(self, ttl=DONE_TTL):
+        """Удаляет обработанные апдейты старше ttl секунд"""
+        self._purged_at = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM updates WHERE status = 'done' AND created_at < ?", (time.time() - ttl,))
+        finally:
+            conn.close()
+
+    def release(self, row_id):
+        """Возвращает апдейт в очередь без штрафа (остановка воркера до начала обработки)"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE updates SET status = 'queued', lease_until = 0, attempts = max(attempts - 1, 0)"
+                " WHERE id = ? AND status = 'leased'",
+                (row_id,),
+            )
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT status, count(*) FROM updates GROUP BY status").fetchall())
+        finally:
+            conn.close()